@@ -7,7 +7,6 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pydeck as pdk
-from scipy import stats
 import plotly.graph_objects as go
 import plotly.express as px
 import plotly.figure_factory as ff
@@ -16,10 +15,27 @@ from PIL import Image
 import requests
 from io import StringIO
 
+from wildfires_data import dico_regions, data_filename, RowLayout
+from wildfires_aggregates import (rollup, count_of, sum_of, mean_of, stats_of, crosstab_of, for_state, conf_int, doy_density,
+    lod_resolutions, grid_aggregate, sketch_quantiles, sketch_box_stats, sketch_accuracy, trends, trend_leaderboard)
+from wildfires_views import views
+from wildfires_duckdb import DuckBackend, duckdb_enabled, open_backend
+from wildfires_store import attach, store_enabled
+from wildfires_registry import datasets
+from wildfires_figures import figure_cache, plotly_cache
+from wildfires_profiling import profiler, profile_env
+from wildfires_plots import (make_barplot, ridgeplot_from_density, make_countplot_from_counts,
+    make_countplot_with_annot_from_counts, box_stats, make_boxplot_from_stats, make_lineplot_from_stats,
+    state_count_year, state_surf_year_lineplot, state_month_boxplot, state_duration_lineplot)
+
 
 st.set_page_config(layout="wide")
+# Profiling of this rerun (see wildfires_profiling) : WILDFIRES_PROFILE=1, or ?profile=1 in the url.
+# The outputs of st are then spans too
+if profiler.start_rerun(profile_env or
+        st.experimental_get_query_params().get('profile', ['0'])[0] not in ('', '0')):
+    st = profiler.instrument(st)
 st.title('Wildfires in USA - Analysis from 1992 to 2018')
-data_filename = 'wildfires_final_frac0.05.csv'
 
 
 
@@ -30,6 +46,12 @@ fires_surf = 'Surface of wildfires'
 fires_dur = 'Duration of wildfires'
 fires_temp = 'Temporal Data'
 fires_state = 'States'
+streaming_info = 'Not available with the streaming ingest, which does not keep the rows of the file.'
+trend_groups = {'States' : ('STATE_FULL',), 'Regions' : ('Region',), 'Causes' : ('CAUSE',),
+    'States and causes' : ('STATE_FULL', 'CAUSE')}
+trend_by_labels = {'STATE_FULL' : 'State', 'Region' : 'Region', 'CAUSE' : 'Cause'}
+trend_labels = {'Number of fires' : 'count', 'Burnt surface' : 'surface',
+    'Average surface of a fire' : 'mean surface', 'Average duration of a fire' : 'mean duration'}
 
 months_labels = ['Jan', 'Feb','Mar', 'Apr','May','Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
 days_labels = ['Mon','Tue','Wed','Thu','Fri','Sat','Sun']
@@ -42,17 +64,6 @@ regions_list = ['East', 'West', 'North', 'South', 'Center',
 regions_list_split = ['East', 'West', 'North', 'South', 'Center',
      'North-\nEast', 'North-\nWest', 'South\n-East', 'South-\nWest', 'Tropical']
 
-dico_regions = {
-'AL': 'South-East', 'AK': 'North', 'AZ': 'South-West', 'AR': 'Center', 'CA': 'South-West',
-'CO': 'Center','CT': 'North-East','DE': 'North-East','DC': 'North-East','FL': 'South-East',
-'GA': 'South-East','HI': 'Tropical','ID': 'North-West','IL': 'Center','IN': 'North-East',
-'IA': 'Center','KS': 'Center','KY': 'East','LA': 'South-East','ME': 'North-East',
-'MD': 'North-East','MA': 'North-East','MI': 'North-East','MN': 'North','MS': 'South-East',
-'MO': 'Center','MT': 'North-West','NE': 'Center','NV': 'West','NH': 'North-East',
-'NJ': 'North-East','NM': 'South','NY': 'North-East','NC': 'East','ND': 'North','OH': 'North-East',
-'OK': 'South','OR': 'North-West','PA': 'North-East','PR': 'Tropical','RI': 'North-East',
-'SC': 'East','SD': 'North','TN': 'East','TX': 'South','UT': 'West','VT': 'North-East','VA': 'East',
-'WA': 'North-West','WV': 'North-East','WI': 'North','WY': 'North-West'}
 df_regions = pd.DataFrame(dico_regions.items(), columns=['State', 'Region'])
 
 # ------------ Colors
@@ -86,171 +97,85 @@ plt.rcParams.update({'font.size': 9})
 # ------------------------------------------
 # ---------------------------- Fonctions
 # ------------------------------------------
-@st.cache
-def load_data(data_filename):
-    data = pd.read_csv(data_filename)
-    data['DISCOVERY_DATE'] = pd.to_datetime(data['DISCOVERY_DATE'])
-    data['DISC_DOY'] = data['DISCOVERY_DATE'].dt.dayofyear
-    data['Region'] = [dico_regions[x] for x in data.STATE]
-    data.rename(columns = {'LATITUDE':'lat', 'LONGITUDE':'lon'}, inplace = True)
-    data.drop(['COUNTY', 'OWNER_DESCR', 'NWCG_CAUSE_AGE_CATEGORY',
-        'NWCG_REPORTING_AGENCY', 'geometry'], axis = 1, inplace = True)
-    return data
-# ------------------------------------ Countplots
-def make_countplot(data, x, title = '',
-    xtitle ='', ytitle = 'Number of \nevents',
-    x_rot = 0, rm_legend = False,
-    color_plot = None, palette = None,
-    order = None, xlabels = None,
-    hue = None, hue_order = None, edgecolor = 'black',
-    linewidth = 0.8, width = 8, height = 2.5):
-    fig, ax = plt.subplots(figsize = (width, height))
-    sns.countplot(x = x, data = data,
-            hue = hue, hue_order = hue_order, order = order, edgecolor = edgecolor,
-            color = color_plot, palette = palette, linewidth = linewidth,
-            ax = ax)
-    plt.xlabel(xtitle)
-    plt.ylabel(ytitle)
-    plt.title(title, y = 1.1)
-    ax.tick_params(axis='x', labelrotation= x_rot)
-    if xlabels :
-        ax.set_xticklabels(labels = xlabels, rotation = x_rot, ha = 'center')
-    if rm_legend :
-        ax.get_legend().remove()
-    else :
-        plt.legend(ncol=2, title = '', fontsize = 9)
-    return(fig)
-
-
-def make_countplot_with_annot(data, x, title = '',
-    xtitle ='', ytitle = 'Number of \nevents',
-    x_rot = 0, xlabels = None,
-    color_plot = None, palette = None,
-    order = None, linewidth = 0.8, edgecolor = 'black',
-    width = 8, height = 2.5, rm_legend = False):
-# Work only for dataframe with CAUSE
-    fig, ax = plt.subplots(figsize = (width, height))
-    sns.countplot(x = x, data = data,
-            order = order, edgecolor = edgecolor,
-            color = color_plot, palette = palette, linewidth = linewidth,
-            ax = ax)
-    if xlabels :
-        ax.set_xticklabels(labels = xlabels, rotation = x_rot, ha = 'center')
-    ax.set_xlabel('')
-    ax.set_ylim(0, max(data.CAUSE.value_counts()) + max(data.CAUSE.value_counts())*0.3)
-    ax.set_ylabel(ytitle)
-    ax.set_title(title, y = 1.1);
-    for i in range(len(order)) :
-        ax.annotate(str(round((data[x] == order[i]).sum() *100/data.shape[0], 1) ) + '%',
-            xy = (i, (data[x] == order[i]).sum() + max(data.CAUSE.value_counts())*0.1),
-            ha = 'center' )
-    if rm_legend :
-        ax.get_legend().remove()
-    return(fig)
-
-# ------------------------------------ Boxplot
-def make_boxplot(data, x, y, title = '',
-    xtitle ='', ytitle = 'Number of \nevents',
-    x_rot = 0, xlabels = None,
-    color_plot = None, palette = None,
-    hue = None, hue_order = None,
-    width = 8, height = 2.5):
-    fig, ax = plt.subplots(figsize = (width, height))
-    sns.boxplot(x = x, y = y,
-            data = data,
-            hue = hue, hue_order = hue_order,
-            color = color_plot, palette = palette,
-            ax = ax)
-    if xlabels :
-        ax.set_xticklabels(xlabels)
-    ax.tick_params(axis='x', labelrotation= x_rot)
-    ax.set_xlabel(xtitle)
-    ax.set_ylabel(ytitle)
-    plt.title(title, y = 1.1)
-    return(fig)
-
-# ------------------------------------ Barplot
-def make_barplot(data, x, y, title = '',
-    xtitle = '', x_rot = 0, order = None,
-    hue = None, hue_order = None,
-    xlabels = None, ytitle = '',
-    palette = None, color_plot = None, linewidth = 0.8,
-    errcolor='.26', errwidth=None, edgecolor = 'black',
-    width = 8, height = 2.5, rm_legend = False, ncol = 3):
-    fig, ax = plt.subplots(figsize = (8, 2.5))
-    sns.barplot( x = x, y = y,
-        data = data, order = order,
-        hue = hue, hue_order = hue_order,
-        color = color_plot, palette = palette, linewidth = linewidth,
-        errcolor = errcolor, errwidth = errwidth,
-        ax = ax)
-    if xlabels :
-        ax.set_xticklabels(xlabels)
-    if rm_legend :
-        ax.get_legend().remove()
-    else :
-        plt.legend(ncol=ncol, bbox_to_anchor=(1, -0.2))
-    ax.tick_params(axis='x', labelrotation= x_rot)
-    ax.set_xlabel(xtitle)
-    ax.set_ylabel(ytitle)
-    plt.title(title, y = 1.1)
-    return(fig)
-
-def ridgeplot(data, title = 'Distribution of wildfires \nalong a year') :
-    sns.set_theme(style="white", rc={"axes.facecolor": (0, 0, 0, 0)})
-    g = sns.FacetGrid(data.sort_values(by = 'DISC_YEAR'),
-                      row = 'DISC_YEAR', aspect=10, height=0.4)
-    g.map(sns.kdeplot, 'DISC_DOY',
-          bw_adjust=1, clip_on=True, color = '#BCC6D1',
-          fill=True, alpha=1, linewidth=1.5)
-    g.map(sns.kdeplot, 'DISC_DOY',
-          bw_adjust=1, clip_on=False,
-          color="w", lw=3) # White contour
-    g.map(plt.axhline, y=0, color =  '#BCC6D1',
-          lw=2, clip_on=False)
-    g.fig.subplots_adjust(hspace=-0.5)
-    for i, ax in enumerate(g.axes.flat):
-        ax.text(-60, 0.0005,
-                data.sort_values(by = 'DISC_YEAR').DISC_YEAR.unique()[i],
-                fontweight='bold', fontsize=15,
-                color= 'grey')
-    g.set_titles("")
-    g.set(yticks=[])
-    g.despine(bottom=True, left=True)
-    axes = g.axes.flatten()
-    for ax in axes:
-        ax.set_ylabel("")
-    plt.xlim(-5, 365)
-    plt.xticks(ticks = [0, 181, 360], labels=['Jan', 'Jun','Dec'])
-    plt.setp(ax.get_xticklabels(), fontsize=15)
-    plt.xlabel('', fontsize=15)
-    plt.figure(figsize=(10, 3))
-    g.fig.suptitle(title,
-                   ha='center',
-                   y=1.05,
-                   fontsize=18, fontweight='bold')
-    return(g)
-
-# ------------------------------------ Lineplot
-def make_lineplot(data, x, y, title = '',
-    xtitle ='', ytitle = 'Number of \nevents',
-    x_rot = 0, xlabels = None,
-    color_plot = None, palette = None,
-    marker = 'o', hue = None, hue_order = None,
-    width = 8, height = 2.5):
-    fig, ax = plt.subplots(figsize = (width, height))
-    sns.lineplot(x = x, y = y,
-            data = data, hue = hue, hue_order = hue_order, marker = marker,
-            color = color_plot, palette = palette,
-            ax = ax)
-    if xlabels :
-        ax.set_xticklabels(xlabels)
-    ax.tick_params(axis='x', labelrotation= x_rot)
-    ax.set_xlabel(xtitle)
-    ax.set_ylabel(ytitle)
-    plt.legend(ncol=3, bbox_to_anchor=(1, -0.2))
-    plt.title(title, y = 1.1)
-    return(fig)
+@profiler.traced('load_dataset', 'data')
+def load_dataset(source, streaming = False, progress = None):
+    # Prepared frame, aggregate cube and quantile sketches of a path or an upload, from the registry
+    # of the server : the source is hashed once, then found by its stat or its upload id. The frames
+    # are read-only and the same objects at each rerun, so their roll-ups are computed only once.
+    # The last value is the token of the dataset in the memo of the view graph
+    dataset = datasets.get(source, streaming, progress)
+    return dataset.data, dataset.cube, dataset.sketch, ('dataset', dataset.fingerprint['sha1'], streaming)
+
+@profiler.traced('load_backend', 'data')
+def load_backend(data_filename):
+    # Parquet file of the csv queried by DuckDB (WILDFIRES_BACKEND=duckdb) : the rows stay on disk.
+    # One backend per csv for the server, opened again when the csv changes
+    return open_backend(data_filename)
+
+def load_source(data_filename):
+    # Rows, aggregate cube, quantile sketches and token of a csv : the rows are a pandas frame, or the
+    # DuckDB backend. With the shared store (WILDFIRES_STORE_DIR), the frames are mapped from its
+    # current version
+    if duckdb_enabled():
+        backend = load_backend(data_filename)
+        return backend, backend.cube(), backend.sketch(), ('duckdb', backend.fingerprint['sha1'])
+    if store_enabled():
+        return attach(data_filename)
+    return load_dataset(data_filename)
+
+# --- Year by year maps : by default only the selected year is sent to the browser,
+# --- with the values rounded to their display precision and one label per state
+def year_selector(years):
+    # None : all the years in the frames of an animation
+    if st.radio('Frames :', ('One year at a time', 'Animation')) == 'Animation':
+        return None
+    return st.select_slider('Year :', list(years))
+
+def year_frame(data, column, year, decimals):
+    # plotly express orders the frames of an animation by first appearance : sorted by year, a year
+    # missing from the first states is not put at the end of the slider
+    data = data.sort_values(column, kind = 'mergesort') if year is None else data[data[column] == year]
+    return data.round(decimals)
+
+# --- Map of the fires of a state by cause : one layer for all the causes, the color of each fire
+# --- comes from the code of its cause. st.pydeck_chart sends the whole deck json at each rerun (no
+# --- binary transport nor partial update of a deck outside of jupyter), so a toggle of a cause sends
+# --- the records again : only the records of the causes shown are sent. They are built once by
+# --- state and cause (see state_points), a toggle only joins their lists
+def cause_map(points, causes, radius):
+    records = [record for cause in causes for record in points['records'][causes_labels.index(cause)]]
+    layer = pdk.Layer(
+        'ScatterplotLayer',
+        data = records,
+        id = 'causes',
+        opacity = 0.5,
+        get_position = '[lon, lat]',
+        get_fill_color = '[{}][c]'.format(', '.join(causes_color_rgb)),
+        get_radius = radius)
+    return pdk.Deck(map_style='mapbox://styles/mapbox/light-v9',
+        initial_view_state=pdk.ViewState(latitude=points['latitude'],
+            longitude=points['longitude'], zoom=3, pitch=0),
+        layers = [layer])
+
+def state_labels(states):
+    # Codes of the states as a text trace, once each
+    states = pd.unique(states)
+    return go.Scattergeo(locationmode = 'USA-states', locations = states, text = states,
+        hoverinfo = 'skip', mode = 'text')
+
+def profiling_panel():
+    # Time and memory of the spans of this rerun, state of the caches and Chrome trace of the last reruns
+    rerun = profiler.end_rerun()
+    st.sidebar.markdown('### Profiling')
+    st.sidebar.caption('Rerun : {:.0f} ms, {} spans, RSS {:+.1f} MB'.format(
+        (rerun['end'] - rerun['start']) / 1e3, len(rerun['spans']),
+        sum(span['rss_delta'] for span in rerun['spans'] if span['depth'] == 0) / 2**20))
+    st.sidebar.dataframe(pd.DataFrame(profiler.breakdown(rerun)))
+    caches = {'figures' : figure_cache.stats(), 'plotly json' : plotly_cache.stats(),
+              'view graph' : views.stats()}
+    st.sidebar.dataframe(pd.DataFrame(caches).fillna('').astype(str))
+    st.sidebar.download_button('Chrome trace (json)', profiler.chrome_trace(),
+        file_name = 'wildfires_trace.json', mime = 'application/json')
 
 
 # ------------------------------------------
@@ -260,9 +185,9 @@ def make_lineplot(data, x, y, title = '',
 if st.checkbox('Use sample data', value = True):
     # Create a text element and let the reader know the data is loading.
     data_load_state = st.text('Loading data...')
-    df_fires = load_data(data_filename)
+    df_fires, fires_cube, fires_sketch, fires_token = load_source(data_filename)
     # Notify the reader that the data was successfully loaded.
-    data_load_state.text("Done! (using st.cache)")
+    data_load_state.text("Done!")
     st.markdown("### Warning : You're using a sample file that contains 5% of the complete dataset.")
     st.markdown("Please refer to our github repository to generate the complete dataset.")
     st.markdown("Or you can downloaded it at : \
@@ -280,13 +205,19 @@ else :
     uploaded_file = st.file_uploader("Choose a file")
     if uploaded_file is not None:
        data_load_state = st.text('Loading data...')
-       df_fires = load_data(uploaded_file)
-       data_load_state.text("Done! (using st.cache)")
+       if st.checkbox('Streaming ingest (for large files, only the aggregates are kept in memory)'):
+           # The file is read by chunks, only the aggregate cube and the sketches are kept (df_fires is None)
+           df_fires, fires_cube, fires_sketch, fires_token = load_dataset(uploaded_file, streaming = True,
+               progress = lambda rows : data_load_state.text('Loading data... ({:,} rows)'.format(rows)))
+           data_load_state.text("Done! (streaming ingest)")
+       else :
+           df_fires, fires_cube, fires_sketch, fires_token = load_dataset(uploaded_file)
+           data_load_state.text("Done!")
     else :
        data_load_state = st.text('Loading data...')
-       df_fires = load_data(data_filename)
+       df_fires, fires_cube, fires_sketch, fires_token = load_source(data_filename)
        # Notify the reader that the data was successfully loaded.
-       data_load_state.text("Done! (using st.cache)")
+       data_load_state.text("Done!")
        st.markdown("### Warning : You're using a sample file that contains 5% of the complete dataset.")
        st.markdown("Please refer to our github repository to generate the complete dataset.")
        st.markdown("Or you can downloaded it at : \
@@ -297,107 +228,312 @@ else :
 # ------------------------------------------
 # -------------------------- Create Sub-datframe used for plots later
 # ------------------------------------------
+# --- Each frame is a node of the view graph : it is only computed when a chart of the
+# --- selected tab needs it, then served from the memo of the graph at the next reruns.
+# --- All the frames are roll-ups of the aggregate cube fires_cube, the distributions of the fire
+# --- size and duration come from its quantile sketches fires_sketch
+# --- The inputs are those of this session, identified in the memo by the token of the dataset
+views.set_input('cube', fires_cube, token = fires_token)
+views.set_input('rows', df_fires, token = fires_token)
+views.set_input('sketch', fires_sketch, token = fires_token)
+
 # --- For global analysis
-fires_months_tmp_df = df_fires.groupby( [ 'DISC_YEAR', 'DISC_MONTH' ],
-    as_index=False).agg({'STATE' : 'count'})
-fires_days_tmp_df = df_fires.groupby( ['DISC_DOW', 'DISC_YEAR'],
-    as_index=False).agg({ 'STATE' : 'count' })
-
-surface_fires_tmp = pd.DataFrame(df_fires.groupby('DISC_YEAR', as_index=False).agg({'FIRE_SIZE': 'mean'}))
-surface = df_fires.groupby('DISC_YEAR', as_index=False)['FIRE_SIZE'].sum()
-surface_total_state = df_fires.groupby(['DISC_YEAR', 'STATE', 'STATE_FULL'], as_index=False)['FIRE_SIZE'].sum()
-surface_total_state.columns = ['year', 'St', 'State', 'Total burnt area (ha)']
-surface_avg_state = df_fires.groupby(['DISC_YEAR', 'STATE', 'STATE_FULL'],
-                        as_index=False)['FIRE_SIZE'].mean().groupby(['STATE', 'STATE_FULL'],
-                            as_index = False)['FIRE_SIZE'].mean()
-surface_avg_state.columns = ['St', 'State', 'Avg burnt area (ha)']
+@views.node(deps = ['cube'])
+def fires_months_tmp_df(cube):
+    return count_of(cube, [ 'DISC_YEAR', 'DISC_MONTH' ], 'STATE')
+
+@views.node(deps = ['cube'])
+def fires_days_tmp_df(cube):
+    return count_of(cube, ['DISC_DOW', 'DISC_YEAR'], 'STATE')
+
+@views.node(deps = ['cube'])
+def fires_year_count(cube):
+    return count_of(cube, ['DISC_YEAR'])
+
+@views.node(deps = ['cube'])
+def size_class_count(cube):
+    return count_of(cube, ['FIRE_SIZE_CLASS'])
+
+@views.node(deps = ['cube'])
+def causes_count(cube):
+    return count_of(cube, ['CAUSE'])
+
+@views.node(deps = ['cube'])
+def surface_fires_tmp(cube):
+    return mean_of(cube, ['DISC_YEAR'], 'FIRE_SIZE')
+
+# Lines of the yearly count, surface, mean surface and mean duration of all the fires
+@views.node(deps = ['cube'])
+def global_trends(cube):
+    return trends(cube, [])
+
+@views.node(deps = ['cube'])
+def surface(cube):
+    return sum_of(cube, ['DISC_YEAR'], 'FIRE_SIZE')
+
+@views.node(deps = ['cube'])
+def surface_total_state(cube):
+    surface_total_state = sum_of(cube, ['DISC_YEAR', 'STATE', 'STATE_FULL'], 'FIRE_SIZE')
+    surface_total_state.columns = ['year', 'St', 'State', 'Total burnt area (ha)']
+    return surface_total_state
+
+@views.node(deps = ['cube'])
+def surface_avg_state(cube):
+    surface_avg_state = mean_of(cube, ['DISC_YEAR', 'STATE', 'STATE_FULL'],
+                            'FIRE_SIZE').groupby(['STATE', 'STATE_FULL'],
+                                as_index = False, observed = True)['FIRE_SIZE'].mean()
+    surface_avg_state.columns = ['St', 'State', 'Avg burnt area (ha)']
+    return surface_avg_state
 
 ## --- For Barplot with confidence interval
-surface_months = df_fires.groupby(['DISC_MONTH'],as_index=False).agg({'FIRE_SIZE':['mean', 'std', 'count']})
-surface_months.columns = ['DISC_MONTH', 'FIRE_SIZE_avg', 'FIRE_SIZE_std', 'FIRE_SIZE_count']
-surface_months['DISC_MONTH'] = months_labels
-surface_months['conf_int'] = 1.96*np.divide(surface_months['FIRE_SIZE_std'],
-    np.sqrt(surface_months['FIRE_SIZE_count']))
-
-duration_months = df_fires.groupby(['DISC_MONTH'],as_index=False).agg({'DURATION':['mean', 'std', 'count']})
-duration_months.columns = ['DISC_MONTH', 'DURATION_avg', 'DURATION_std', 'DURATION_count']
-duration_months['DISC_MONTH'] = months_labels
-duration_months['conf_int'] = 1.96*np.divide(duration_months['DURATION_std'],
-    np.sqrt(duration_months['DURATION_count']))
-
-duration_months_cause = df_fires.groupby(['DISC_MONTH', 'CAUSE'],as_index=False).agg({'DURATION':['mean', 'std', 'count']})
-duration_months_cause.columns = ['DISC_MONTH', 'CAUSE', 'DURATION_avg', 'DURATION_std', 'DURATION_count']
-duration_months_cause['DISC_MONTH'] = [j for j in months_labels for i in range(5)]
-duration_months_cause['conf_int'] = 1.96*np.divide(duration_months_cause['DURATION_std'],
-    np.sqrt(duration_months_cause['DURATION_count']))
-surface_months_cause = df_fires.groupby(['DISC_MONTH', 'CAUSE'],as_index=False).agg({'FIRE_SIZE':['mean', 'std', 'count']})
-surface_months_cause.columns = ['DISC_MONTH', 'CAUSE', 'FIRE_SIZE_avg', 'FIRE_SIZE_std', 'FIRE_SIZE_count']
-surface_months_cause['DISC_MONTH'] = [j for j in months_labels for i in range(5)]
-surface_months_cause['conf_int'] = 1.96*np.divide(surface_months_cause['FIRE_SIZE_std'],
-    np.sqrt(surface_months_cause['FIRE_SIZE_count']))
-
-cause_month_year = df_fires.groupby(['DISC_YEAR', 'DISC_MONTH', 'CAUSE'],
-                                  as_index = False).agg(
-                                  {'STATE' : 'count'}).groupby(
-                                  ['DISC_MONTH', 'CAUSE'], as_index = False).agg({'STATE' : ['mean', 'std', 'count']})
-cause_month_year.columns = ['DISC_MONTH', 'CAUSE', 'N_avg', 'N_std', 'N_count']
-cause_month_year['DISC_MONTH'] = [j for j in months_labels for i in range(5)]
-cause_month_year['conf_int'] = 1.96*np.divide(cause_month_year['N_std'],
-    np.sqrt(cause_month_year['N_count']))
-
-cause_human_month_year = df_fires[df_fires['CAUSE'] == 'Individuals\' mistake'].groupby(
-    ['DISC_YEAR', 'DISC_MONTH', 'NWCG_GENERAL_CAUSE'], as_index = False).agg({'STATE' : 'count'}).groupby(
-                                  ['DISC_MONTH', 'NWCG_GENERAL_CAUSE'], as_index = False).agg({'STATE' : ['mean', 'std', 'count']})
-cause_human_month_year.columns = ['DISC_MONTH', 'NWCG_GENERAL_CAUSE', 'N_avg', 'N_std', 'N_count']
-cause_human_month_year['DISC_MONTH'] = [j for j in months_labels for i in range(8)]
-cause_human_month_year['conf_int'] = 1.96*np.divide(cause_human_month_year['N_std'],
-    np.sqrt(cause_human_month_year['N_count']))
-
-
-
-
-
-surface_avg = df_fires.groupby(['DISC_YEAR','CAUSE'], as_index=False)['FIRE_SIZE'].mean()
-surface_avg_year = df_fires.groupby(['DISC_YEAR','CAUSE'],as_index=False).agg({'FIRE_SIZE': 'mean'})
-duration_avg_state = df_fires.groupby(['DISC_YEAR', 'STATE','STATE_FULL'],
-    as_index=False).agg({'DURATION':'mean'}).groupby(['STATE','STATE_FULL'], as_index=False)['DURATION'].mean()
-duration_avg_state.columns=['St', 'State', 'Avg duration of a fire (days)']
-duration_year_state = df_fires.groupby(['DISC_YEAR', 'STATE','STATE_FULL'],
-    as_index=False).agg({'DURATION':'mean'})
-duration_year_state.columns=['Year','St', 'State', 'Avg duration of a fire (days)']
-months_cause = df_fires.groupby(['DISC_MONTH','CAUSE'],as_index=False).agg({'FIRE_SIZE':'mean'})
-months_cause_total = df_fires.groupby(['DISC_MONTH', 'CAUSE'],
-                                 as_index=False).agg({'FIRE_SIZE':'sum'})
-months_year_total = df_fires.groupby(['DISC_MONTH', 'DISC_YEAR'],
-                                 as_index=False).agg({'FIRE_SIZE':'sum'})
-day_size = df_fires.groupby('DISC_DOW', as_index=False).agg({'FIRE_SIZE':'mean'})
-day_size_cause = df_fires.groupby(['DISC_DOW','CAUSE'], as_index=False).agg({'FIRE_SIZE':'mean'}).set_index('DISC_DOW')
-weekday_size_cause = pd.pivot_table(data=day_size_cause,
-                                  index=day_size_cause.index, columns='CAUSE',
-                                  values='FIRE_SIZE', aggfunc='mean')
-duration_causes=df_fires.groupby(['DISC_YEAR','CAUSE'], as_index=False)['DURATION'].mean()
-
-
-causes_year=pd.crosstab(df_fires['DISC_YEAR'], df_fires['CAUSE']).stack().reset_index().rename(columns=
-    {'DISC_YEAR':'Year', 'CAUSE':'cause', 0:'count'})
-ct_classe_cause = pd.crosstab(df_fires.FIRE_SIZE_CLASS, df_fires.CAUSE)
-ct_classe_cause_perc = ct_classe_cause.apply(lambda x : (x/x.sum()) *100, axis  = 1)
-ct_classe_cause_perc = ct_classe_cause_perc[causes_labels]
+@views.node(deps = ['cube'])
+def surface_months(cube):
+    surface_months = stats_of(cube, ['DISC_MONTH'], 'FIRE_SIZE')
+    surface_months.columns = ['DISC_MONTH', 'FIRE_SIZE_avg', 'FIRE_SIZE_std', 'FIRE_SIZE_count']
+    surface_months['DISC_MONTH'] = months_labels
+    surface_months['conf_int'] = conf_int(surface_months['FIRE_SIZE_std'],
+        surface_months['FIRE_SIZE_count'])
+    return surface_months
+
+@views.node(deps = ['cube'])
+def duration_months(cube):
+    duration_months = stats_of(cube, ['DISC_MONTH'], 'DURATION')
+    duration_months.columns = ['DISC_MONTH', 'DURATION_avg', 'DURATION_std', 'DURATION_count']
+    duration_months['DISC_MONTH'] = months_labels
+    duration_months['conf_int'] = conf_int(duration_months['DURATION_std'],
+        duration_months['DURATION_count'])
+    return duration_months
+
+@views.node(deps = ['cube'])
+def duration_months_cause(cube):
+    duration_months_cause = stats_of(cube, ['DISC_MONTH', 'CAUSE'], 'DURATION')
+    duration_months_cause.columns = ['DISC_MONTH', 'CAUSE', 'DURATION_avg', 'DURATION_std', 'DURATION_count']
+    duration_months_cause['DISC_MONTH'] = [j for j in months_labels for i in range(5)]
+    duration_months_cause['conf_int'] = conf_int(duration_months_cause['DURATION_std'],
+        duration_months_cause['DURATION_count'])
+    return duration_months_cause
+
+@views.node(deps = ['cube'])
+def surface_months_cause(cube):
+    surface_months_cause = stats_of(cube, ['DISC_MONTH', 'CAUSE'], 'FIRE_SIZE')
+    surface_months_cause.columns = ['DISC_MONTH', 'CAUSE', 'FIRE_SIZE_avg', 'FIRE_SIZE_std', 'FIRE_SIZE_count']
+    surface_months_cause['DISC_MONTH'] = [j for j in months_labels for i in range(5)]
+    surface_months_cause['conf_int'] = conf_int(surface_months_cause['FIRE_SIZE_std'],
+        surface_months_cause['FIRE_SIZE_count'])
+    return surface_months_cause
+
+@views.node(deps = ['cube'])
+def cause_month_year(cube):
+    cause_month_year = count_of(cube, ['DISC_YEAR', 'DISC_MONTH', 'CAUSE'], 'STATE').groupby(
+                                      ['DISC_MONTH', 'CAUSE'], as_index = False, observed = True).agg({'STATE' : ['mean', 'std', 'count']})
+    cause_month_year.columns = ['DISC_MONTH', 'CAUSE', 'N_avg', 'N_std', 'N_count']
+    cause_month_year['DISC_MONTH'] = [j for j in months_labels for i in range(5)]
+    cause_month_year['conf_int'] = conf_int(cause_month_year['N_std'],
+        cause_month_year['N_count'])
+    return cause_month_year
+
+@views.node(deps = ['cube'])
+def cause_human_month_year(cube):
+    cause_human_month_year = count_of(cube, ['DISC_YEAR', 'DISC_MONTH', 'CAUSE', 'NWCG_GENERAL_CAUSE'], 'STATE')
+    cause_human_month_year = cause_human_month_year[cause_human_month_year['CAUSE'] == 'Individuals\' mistake'].groupby(
+                                      ['DISC_MONTH', 'NWCG_GENERAL_CAUSE'], as_index = False, observed = True).agg({'STATE' : ['mean', 'std', 'count']})
+    cause_human_month_year.columns = ['DISC_MONTH', 'NWCG_GENERAL_CAUSE', 'N_avg', 'N_std', 'N_count']
+    cause_human_month_year['DISC_MONTH'] = [j for j in months_labels for i in range(8)]
+    cause_human_month_year['conf_int'] = conf_int(cause_human_month_year['N_std'],
+        cause_human_month_year['N_count'])
+    return cause_human_month_year
+
+
+
+
+@views.node(deps = ['cube'])
+def surface_avg(cube):
+    return mean_of(cube, ['DISC_YEAR','CAUSE'], 'FIRE_SIZE')
+
+@views.node(deps = ['cube'])
+def surface_avg_year(cube):
+    return mean_of(cube, ['DISC_YEAR','CAUSE'], 'FIRE_SIZE')
+
+@views.node(deps = ['cube'])
+def duration_avg_state(cube):
+    duration_avg_state = mean_of(cube, ['DISC_YEAR', 'STATE','STATE_FULL'],
+        'DURATION').groupby(['STATE','STATE_FULL'], as_index=False, observed=True)['DURATION'].mean()
+    duration_avg_state.columns=['St', 'State', 'Avg duration of a fire (days)']
+    return duration_avg_state
+
+@views.node(deps = ['cube'])
+def duration_year_state(cube):
+    duration_year_state = mean_of(cube, ['DISC_YEAR', 'STATE','STATE_FULL'], 'DURATION')
+    duration_year_state.columns=['Year','St', 'State', 'Avg duration of a fire (days)']
+    return duration_year_state
+
+@views.node(deps = ['cube'])
+def months_cause(cube):
+    return mean_of(cube, ['DISC_MONTH','CAUSE'], 'FIRE_SIZE')
+
+@views.node(deps = ['cube'])
+def months_cause_total(cube):
+    return sum_of(cube, ['DISC_MONTH', 'CAUSE'], 'FIRE_SIZE')
+
+@views.node(deps = ['cube'])
+def months_year_total(cube):
+    return sum_of(cube, ['DISC_MONTH', 'DISC_YEAR'], 'FIRE_SIZE')
+
+@views.node(deps = ['cube'])
+def day_size(cube):
+    return mean_of(cube, ['DISC_DOW'], 'FIRE_SIZE')
+
+@views.node(deps = ['cube'])
+def day_size_cause(cube):
+    return mean_of(cube, ['DISC_DOW','CAUSE'], 'FIRE_SIZE').set_index('DISC_DOW')
+
+@views.node(deps = ['day_size_cause'])
+def weekday_size_cause(day_size_cause):
+    return pd.pivot_table(data=day_size_cause,
+                          index=day_size_cause.index, columns='CAUSE',
+                          values='FIRE_SIZE', aggfunc='mean')
+
+@views.node(deps = ['cube'])
+def duration_causes(cube):
+    return mean_of(cube, ['DISC_YEAR','CAUSE'], 'DURATION')
+
+@views.node(deps = ['cube'])
+def duration_global(cube):
+    return mean_of(cube, ['DISC_YEAR'], 'DURATION')
+
+@views.node(deps = ['cube'])
+def duration_month(cube):
+    return mean_of(cube, ['DISC_MONTH'], 'DURATION')
+
+
+@views.node(deps = ['cube'])
+def causes_year(cube):
+    return crosstab_of(cube, 'DISC_YEAR', 'CAUSE').stack().reset_index().rename(columns=
+        {'DISC_YEAR':'Year', 'CAUSE':'cause', 0:'count'})
+
+@views.node(deps = ['cube'])
+def ct_classe_cause(cube):
+    return crosstab_of(cube, 'FIRE_SIZE_CLASS', 'CAUSE')
+
+@views.node(deps = ['ct_classe_cause'])
+def ct_classe_cause_perc(ct_classe_cause):
+    ct_classe_cause_perc = ct_classe_cause.apply(lambda x : (x/x.sum()) *100, axis  = 1)
+    return ct_classe_cause_perc[causes_labels]
 
 
 # --- For state analysis
-state_year_tmp_df = df_fires.groupby(['STATE', 'STATE_FULL', 'DISC_YEAR'],
-    as_index=False).agg({ 'FPA_ID' : 'count', 'lat' : 'mean', 'lon' : 'mean', 'FIRE_SIZE' : 'sum'})
-state_year_tmp_df.columns = ['St', 'State', 'Year', 'Number of fires', 'lat', 'lon', 'Surf']
-state_year_avg_df = state_year_tmp_df.groupby(['State', 'St'],
-    as_index=False).agg({'Number of fires' : 'mean'})
+@views.node(deps = ['cube'])
+def state_year_tmp_df(cube):
+    state_year_tmp_df = rollup(cube, ['STATE', 'STATE_FULL', 'DISC_YEAR'])
+    return pd.DataFrame({'St' : state_year_tmp_df.STATE, 'State' : state_year_tmp_df.STATE_FULL,
+        'Year' : state_year_tmp_df.DISC_YEAR, 'Number of fires' : state_year_tmp_df.n,
+        'lat' : state_year_tmp_df.lat / state_year_tmp_df.n, 'lon' : state_year_tmp_df.lon / state_year_tmp_df.n,
+        'Surf' : state_year_tmp_df.FIRE_SIZE})
+
+@views.node(deps = ['state_year_tmp_df'])
+def fires_years(state_year_tmp_df):
+    return [int(year) for year in np.sort(state_year_tmp_df['Year'].unique())]
+
+@views.node(deps = ['state_year_tmp_df'])
+def state_year_avg_df(state_year_tmp_df):
+    return state_year_tmp_df.groupby(['State', 'St'],
+        as_index=False, observed=True).agg({'Number of fires' : 'mean'})
+
 # --- For region anlysis
-region_cause_df = pd.crosstab(df_fires['Region'], df_fires['CAUSE'])
-region_cause_df['total']=region_cause_df.sum(axis=1)
-for col in region_cause_df.columns:
-    region_cause_df[col]=region_cause_df[col]/region_cause_df['total']*100
-region_cause_df.drop('total', axis=1, inplace=True)
-region_fire_number = pd.crosstab(df_fires['DISC_YEAR'], df_fires['Region'])
+@views.node(deps = ['cube'])
+def region_cause_df(cube):
+    region_cause_df = crosstab_of(cube, 'Region', 'CAUSE')
+    region_cause_df['total']=region_cause_df.sum(axis=1)
+    for col in region_cause_df.columns:
+        region_cause_df[col]=region_cause_df[col]/region_cause_df['total']*100
+    region_cause_df.drop('total', axis=1, inplace=True)
+    return region_cause_df
+
+@views.node(deps = ['cube'])
+def region_fire_number(cube):
+    return crosstab_of(cube, 'DISC_YEAR', 'Region')
+
+# --- For the selected state (widget 'state')
+@views.node(deps = ['rows'])
+def row_layout(rows):
+    # The loaded rows are sorted by state and year : the rows of a state are one slice of them.
+    # The DuckDB backend queries the rows of a state in the same order
+    return rows if isinstance(rows, DuckBackend) else RowLayout(rows)
+
+@views.node(deps = ['row_layout'], widgets = ['state'])
+def df_sub(row_layout, state):
+    return row_layout.rows(state)
+
+@views.node(deps = ['cube'], widgets = ['state'])
+def state_cube(cube, state):
+    return for_state(rollup(cube, ['STATE_FULL', 'DISC_YEAR', 'CAUSE']), state)
+
+@views.node(deps = ['state_cube'])
+def df_sub_count(state_cube):
+    return crosstab_of(state_cube, 'DISC_YEAR',
+        'CAUSE').stack().reset_index().rename(
+        columns= {'DISC_YEAR':'Year', 'CAUSE':'cause', 0:'count'})
+
+@views.node(deps = ['cube'], widgets = ['state'])
+def state_year_count(cube, state):
+    return for_state(count_of(cube, ['STATE_FULL', 'DISC_YEAR']), state)
+
+@views.node(deps = ['state_cube'])
+def state_causes_count(state_cube):
+    return count_of(state_cube, ['CAUSE'])
+
+@views.node(deps = ['cube'], widgets = ['state'])
+def state_nb_month(cube, state):
+    return for_state(count_of(cube, [ 'STATE_FULL', 'DISC_YEAR', 'DISC_MONTH' ],
+        'FPA_ID'), state)
+
+@views.node(deps = ['cube'], widgets = ['state'])
+def state_surf_year(cube, state):
+    return for_state(sum_of(cube, [ 'STATE_FULL', 'DISC_YEAR' ],
+        'FIRE_SIZE'), state)
+
+@views.node(deps = ['state_cube'])
+def ct_cause_state_year(state_cube):
+    return crosstab_of(state_cube, 'DISC_YEAR', 'CAUSE')
+
+@views.node(deps = ['ct_cause_state_year'])
+def ct_cause_state_year_perc(ct_cause_state_year):
+    return ct_cause_state_year.apply(lambda x : (x/x.sum()) *100, axis  = 1)
+
+@views.node(deps = ['state_cube'])
+def state_surf_year_cause(state_cube):
+    return sum_of(state_cube, ['DISC_YEAR', 'CAUSE'], 'FIRE_SIZE')
+
+# Fires of the pydeck map : position (rounded to about 10 m) and code of the cause, the only
+# fields sent to the browser. Built once by state, the records by code of cause (see cause_map)
+@views.node(deps = ['df_sub'])
+def state_points(df_sub):
+    points = pd.DataFrame({'lon' : df_sub['lon'].astype('float64').round(4),
+        'lat' : df_sub['lat'].astype('float64').round(4),
+        'c' : pd.Categorical(df_sub['CAUSE'].astype(str), categories = causes_labels).codes})
+    return {'records' : [points[points['c'].values == code].to_dict(orient = 'records')
+                         for code in range(len(causes_labels))],
+            # Python floats : pydeck can't serialize the float32 of the columns
+            'latitude' : float(df_sub['lat'].mean()), 'longitude' : float(df_sub['lon'].mean())}
+
+# Densities of the ridgeplot, a few kB by state instead of the days of all its fires
+@views.node(deps = ['df_sub'])
+def state_doy_density(df_sub):
+    return doy_density(df_sub)
+
+# --- Distributions of the fire size and duration, from the quantile sketches (no sort of the rows)
+def percentile_table(sketch, keys, quantiles = [0.5, 0.9, 0.99]):
+    tables = [sketch_quantiles(sketch, keys, col, quantiles).set_index(keys)
+        for col in ['FIRE_SIZE', 'DURATION']]
+    return pd.concat(tables, axis = 1, keys = ['Fire size (ha)', 'Duration (days)']).round(2)
+
+@views.node(deps = ['sketch'])
+def percentiles_cause(sketch):
+    return percentile_table(sketch, ['CAUSE'])
+
+@views.node(deps = ['sketch'], widgets = ['state'])
+def state_percentiles(sketch, state):
+    return percentile_table(sketch, ['STATE_FULL', 'CAUSE']).xs(state, level = 'STATE_FULL')
 
 
 # ------------------------------------------
@@ -421,7 +557,10 @@ st.caption("Github : [https://github.com/DataScientest-Studio/Pyromaniacs](https
 #---------------------------- Check table is correctly loaded
 if st.checkbox('Show raw data'):
     st.subheader('Raw data')
-    st.write(df_fires.head())
+    if df_fires is None:
+        st.info(streaming_info)
+    else :
+        st.write(df_fires.head())
 
 genre = st.radio(
      "What kind of analysis to you want to perform ?",
@@ -458,7 +597,9 @@ if genre == 'Our process':
     st.write('The initial data set consisted of 2,166,753 rows and 37 columns.')
 
     st.markdown('**We selected 15 variables, and dropped 22.**')
-    pertinentes=pertinentes=pd.DataFrame({'Nom Variable': {0: 'FPA_ID',
+    @views.node()
+    def pertinentes():
+        return pd.DataFrame({'Nom Variable': {0: 'FPA_ID',
   1: 'NWCG_REPORTING_AGENCY',
   2: 'DISCOVERY_DATE',
   3: 'DISCOVERY_TIME',
@@ -523,9 +664,11 @@ if genre == 'Our process':
   14: 'Utile pour classer les feux',
   15: 'Utile pour classer les feux'}})
     if st.checkbox('The selected variables') :
-        st.dataframe(pertinentes)
+        st.dataframe(views.get('pertinentes'))
 
-    non_pertinentes=pd.DataFrame({'Nom Variable': {0: 'FOD_ID',
+    @views.node()
+    def non_pertinentes():
+        return pd.DataFrame({'Nom Variable': {0: 'FOD_ID',
   1: 'SOURCE_SYSTEM_TYPE',
   2: 'SOURCE_SYSTEM',
   3: 'NWCG_REPORTING_UNIT_ID',
@@ -610,11 +753,13 @@ if genre == 'Our process':
   19: 'Redondant avec Comté',
   20: 'Redondant avec Comté'}})
     if st.checkbox("The variables we have not selected"):
-        st.dataframe(non_pertinentes)
+        st.dataframe(views.get('non_pertinentes'))
 
     st.header('Data processing')
     st.caption('We made 7 variables up.')
-    createdvars=pd.DataFrame({'Nom Variable': {0: 'DISC_YEAR',
+    @views.node()
+    def createdvars():
+        return pd.DataFrame({'Nom Variable': {0: 'DISC_YEAR',
   1: 'DISC_MONTH',
   2: 'DISC_DAY',
   3: 'DISC_DOW',
@@ -644,7 +789,7 @@ if genre == 'Our process':
                                     6:"importation d'un jeu externe"}
 })
     if st.checkbox('The variables we created'):
-        st.dataframe(createdvars)
+        st.dataframe(views.get('createdvars'))
 
     st.subheader("Other transformations")
     st.markdown("""
@@ -703,76 +848,90 @@ if genre == 'Global':
             map_type_fires = st.radio(
      "Map type :", ('Year by year', 'Average over the years'))
             if map_type_fires == 'Year by year' :
-                fig = px.choropleth(
-                    state_year_tmp_df,
-                    locations='St',
-                    color='Number of fires',
-                    locationmode='USA-states',
-                    color_continuous_scale='Reds',
-                    range_color = [1, 15000],
-                    animation_frame = 'Year',
-                    hover_name = 'State',
-                    hover_data = {'St' : False, 'Year' : False}
-                )
-                fig.add_trace(go.Scattergeo(
-                    locationmode = 'USA-states',
-                    locations=state_year_avg_df['St'],    ###codes for states,
-                    text=state_year_avg_df['St'],
-                    hoverinfo = 'skip',
-                    mode = 'text' )  )
-                fig.update_layout(
-                    title={'text':'<b>Number of fires per state per year</b>', 'font':{'size':18}},
-                    geo = dict(
-                        scope='usa',
-                        projection=go.layout.geo.Projection(type = 'albers usa'),
-                        showlakes=True, # lakes
-                        lakecolor='rgb(255, 255, 255)'),
-                        margin=dict(
-                            l=0, r=0, b=0, t=30, pad=2  )
-                )
-                st.plotly_chart(fig, use_container_width=True)
+                map_year = year_selector(views.get('fires_years'))
+                # The maps only depend on the dataset : their json is kept on disk for all the
+                # sessions and the next starts of the server (see PlotlyCache)
+                @views.node(deps = ['state_year_tmp_df', 'state_year_avg_df'], widgets = ['map_year'])
+                @plotly_cache.cached
+                def map_fires_year(state_year_tmp_df, state_year_avg_df, map_year):
+                    fig = px.choropleth(
+                        year_frame(state_year_tmp_df, 'Year', map_year, {'Number of fires' : 0}),
+                        locations='St',
+                        color='Number of fires',
+                        locationmode='USA-states',
+                        color_continuous_scale='Reds',
+                        range_color = [1, 15000],
+                        animation_frame = 'Year' if map_year is None else None,
+                        hover_name = 'State',
+                        hover_data = {'St' : False, 'Year' : False}
+                    )
+                    fig.add_trace(state_labels(state_year_avg_df['St']))
+                    fig.update_layout(
+                        title={'text':'<b>Number of fires per state per year</b>', 'font':{'size':18}},
+                        geo = dict(
+                            scope='usa',
+                            projection=go.layout.geo.Projection(type = 'albers usa'),
+                            showlakes=True, # lakes
+                            lakecolor='rgb(255, 255, 255)'),
+                            margin=dict(
+                                l=0, r=0, b=0, t=30, pad=2  )
+                    )
+                    return fig
+                st.plotly_chart(views.get('map_fires_year', map_year = map_year), use_container_width=True)
             else :
-                fig2 = px.choropleth(
-                    state_year_avg_df,
-                    locations='St',
-                    color='Number of fires',
-                    locationmode='USA-states',
-                    color_continuous_scale='Reds',
-                    range_color = [1, 10000],
-                    hover_name = 'State',
-                    hover_data = {'St' : False}
-                )
-                fig2.add_trace(go.Scattergeo(
-                    locationmode = 'USA-states',
-                    locations=state_year_avg_df['St'],    ###codes for states,
-                    text=state_year_avg_df['St'],
-                    hoverinfo = 'skip',
-                    mode = 'text' )  )
-                fig2.update_layout(
-                    title_text='Average number of fires per state per year',
-                    geo = dict(
-                        scope='usa',
-                        projection=go.layout.geo.Projection(type = 'albers usa'),
-                        showlakes=True, # lakes
-                        lakecolor='rgb(255, 255, 255)'),
-                    margin=dict(l=0, r=0, b=0, t=30, pad=2)
-
-                )
-                st.plotly_chart(fig2, use_container_width=True)
+                @views.node(deps = ['state_year_avg_df'])
+                @plotly_cache.cached
+                def map_fires_avg(state_year_avg_df):
+                    fig2 = px.choropleth(
+                        state_year_avg_df,
+                        locations='St',
+                        color='Number of fires',
+                        locationmode='USA-states',
+                        color_continuous_scale='Reds',
+                        range_color = [1, 10000],
+                        hover_name = 'State',
+                        hover_data = {'St' : False}
+                    )
+                    fig2.add_trace(go.Scattergeo(
+                        locationmode = 'USA-states',
+                        locations=state_year_avg_df['St'],    ###codes for states,
+                        text=state_year_avg_df['St'],
+                        hoverinfo = 'skip',
+                        mode = 'text' )  )
+                    fig2.update_layout(
+                        title_text='Average number of fires per state per year',
+                        geo = dict(
+                            scope='usa',
+                            projection=go.layout.geo.Projection(type = 'albers usa'),
+                            showlakes=True, # lakes
+                            lakecolor='rgb(255, 255, 255)'),
+                        margin=dict(l=0, r=0, b=0, t=30, pad=2)
+
+                    )
+                    return fig2
+                st.plotly_chart(views.get('map_fires_avg'), use_container_width=True)
         with c2 :
-            fig = make_countplot(df_fires, 'DISC_YEAR',
-                ytitle = 'Number of fires', xtitle ='', x_rot = 90, color_plot = color_fire)
-            plt.title('Number of fires per year', fontsize=14, fontweight='bold')
-            st.pyplot(fig, use_container_width=True) # SHOW THE FIGURE
+            @views.node(deps = ['fires_year_count'])
+            @figure_cache.cached
+            def count_fires_year(fires_year_count):
+                fig = make_countplot_from_counts(fires_year_count, 'DISC_YEAR',
+                    ytitle = 'Number of fires', xtitle ='', x_rot = 90, color_plot = color_fire)
+                plt.title('Number of fires per year', fontsize=14, fontweight='bold')
+                return fig
+            st.image(views.get('count_fires_year'), use_column_width=True) # SHOW THE FIGURE
             st.markdown("On the global US territory, \
                 the number of fires didn't significately increase since 1992.\
                 However, some years have been more affected than others \
                 (2006 and 2011 for example).")
-            fig = make_boxplot(fires_months_tmp_df, 'DISC_MONTH', 'STATE',
-                xtitle = '', x_rot = 0, xlabels = months_labels,
-                ytitle = 'Number of fires \nper year', palette = month_colors)
-            plt.title("Average number of fires per month", fontsize=14, fontweight='bold')
-            st.pyplot(fig, use_container_width=True) # SHOW THE FIGURE
+            @views.node(deps = ['fires_months_tmp_df'])
+            @figure_cache.cached
+            def box_fires_month(fires_months_tmp_df):
+                fig = make_boxplot_from_stats(box_stats(fires_months_tmp_df, 'DISC_MONTH', 'STATE'),
+                    xtitle = '', x_rot = 0, xlabels = months_labels,
+                    ytitle = 'Number of fires \nper year', palette = month_colors)
+                plt.title("Average number of fires per month", fontsize=14, fontweight='bold')
+                return fig
+            st.image(views.get('box_fires_month'), use_column_width=True) # SHOW THE FIGURE
             st.markdown("Wildfires are particularly abundant in the beginning of \
                 spring and summer.")
 
@@ -785,69 +944,75 @@ if genre == 'Global':
             map_type_fires = st.radio(
      "Map type :", ('Year by year', 'Average over the years'))
             if map_type_fires == 'Year by year' :
-                # df_subset = state_year_tmp_df[state_year_tmp_df.DISC_YEAR == year_plot]
-                fig = px.choropleth(
-                    surface_total_state,
-                    locations='St',
-                    color='Total burnt area (ha)',
-                    locationmode='USA-states',
-                    color_continuous_scale='YlOrBr',
-                    range_color = [1, 400000],
-                    animation_frame = 'year',
-                    hover_name = 'State',
-                    hover_data = {'St' : False, 'year' : False}
-                )
-                fig.add_trace(go.Scattergeo(
-                    locationmode = 'USA-states',
-                    locations=surface_total_state['St'],    ###codes for states,
-                    text=surface_total_state['St'],
-                    hoverinfo = 'skip',
-                    mode = 'text' )  )
-                fig.update_layout(
-                    title_text='Surface burnt per year',
-                    geo = dict(
-                        scope='usa',
-                        projection=go.layout.geo.Projection(type = 'albers usa'),
-                        showlakes=True, # lakes
-                        lakecolor='rgb(255, 255, 255)'),
-                        margin=dict(
-                            l=0, r=0, b=0, t=30, pad=2  )
-                )
-                st.plotly_chart(fig, use_container_width=True)
+                map_year = year_selector(views.get('fires_years'))
+                @views.node(deps = ['surface_total_state'], widgets = ['map_year'])
+                @plotly_cache.cached
+                def map_surf_year(surface_total_state, map_year):
+                    fig = px.choropleth(
+                        year_frame(surface_total_state, 'year', map_year, {'Total burnt area (ha)' : 1}),
+                        locations='St',
+                        color='Total burnt area (ha)',
+                        locationmode='USA-states',
+                        color_continuous_scale='YlOrBr',
+                        range_color = [1, 400000],
+                        animation_frame = 'year' if map_year is None else None,
+                        hover_name = 'State',
+                        hover_data = {'St' : False, 'year' : False}
+                    )
+                    fig.add_trace(state_labels(surface_total_state['St']))
+                    fig.update_layout(
+                        title_text='Surface burnt per year',
+                        geo = dict(
+                            scope='usa',
+                            projection=go.layout.geo.Projection(type = 'albers usa'),
+                            showlakes=True, # lakes
+                            lakecolor='rgb(255, 255, 255)'),
+                            margin=dict(
+                                l=0, r=0, b=0, t=30, pad=2  )
+                    )
+                    return fig
+                st.plotly_chart(views.get('map_surf_year', map_year = map_year), use_container_width=True)
             else :
-                fig2 = px.choropleth(
-                    surface_avg_state,
-                    locations='St',
-                    color='Avg burnt area (ha)',
-                    locationmode='USA-states',
-                    color_continuous_scale='YlOrBr',
-                    range_color = [1, 250],
-                    hover_name = 'State',
-                    hover_data = {'St' : False}
-                )
-                fig2.add_trace(go.Scattergeo(
-                    locationmode = 'USA-states',
-                    locations=surface_avg_state['St'],    ###codes for states,
-                    text=surface_avg_state['St'],
-                    hoverinfo = 'skip',
-                    mode = 'text' )  )
-                fig2.update_layout(
-                    title_text='Average surface burnt per state per year',
-                    geo = dict(
-                        scope='usa',
-                        projection=go.layout.geo.Projection(type = 'albers usa'),
-                        showlakes=True, # lakes
-                        lakecolor='rgb(255, 255, 255)'),
-                    margin=dict(l=0, r=0, b=0, t=30, pad=2)
-
-                )
-                st.plotly_chart(fig2, use_container_width=True)
-            fig = make_countplot(x='FIRE_SIZE_CLASS', data=df_fires,
-                ytitle = 'Number of fires', xtitle = 'Fire class',
-                title = 'Count of the fires based on their size category, 1992-2018',
-                order=['A','B','C','D','E','F','G'],
-                palette = categories_palette)
-            st.pyplot(fig, use_container_width=True)
+                @views.node(deps = ['surface_avg_state'])
+                @plotly_cache.cached
+                def map_surf_avg(surface_avg_state):
+                    fig2 = px.choropleth(
+                        surface_avg_state,
+                        locations='St',
+                        color='Avg burnt area (ha)',
+                        locationmode='USA-states',
+                        color_continuous_scale='YlOrBr',
+                        range_color = [1, 250],
+                        hover_name = 'State',
+                        hover_data = {'St' : False}
+                    )
+                    fig2.add_trace(go.Scattergeo(
+                        locationmode = 'USA-states',
+                        locations=surface_avg_state['St'],    ###codes for states,
+                        text=surface_avg_state['St'],
+                        hoverinfo = 'skip',
+                        mode = 'text' )  )
+                    fig2.update_layout(
+                        title_text='Average surface burnt per state per year',
+                        geo = dict(
+                            scope='usa',
+                            projection=go.layout.geo.Projection(type = 'albers usa'),
+                            showlakes=True, # lakes
+                            lakecolor='rgb(255, 255, 255)'),
+                        margin=dict(l=0, r=0, b=0, t=30, pad=2)
+
+                    )
+                    return fig2
+                st.plotly_chart(views.get('map_surf_avg'), use_container_width=True)
+            @views.node(deps = ['size_class_count'])
+            @figure_cache.cached
+            def count_size_class(size_class_count):
+                return make_countplot_from_counts(size_class_count, 'FIRE_SIZE_CLASS',
+                    ytitle = 'Number of fires', xtitle = 'Fire class',
+                    title = 'Count of the fires based on their size category, 1992-2018',
+                    order=['A','B','C','D','E','F','G'],
+                    palette = categories_palette)
+            st.image(views.get('count_size_class'), use_column_width=True)
             st.caption("The Federal Administration of the USA classifies \
                 the wildfire depending on their size in a 7-letter nomenclature : \
                 \nA - less than 1000 m2 approx. ; \nB - between 1000 m2 and 4 ha approx. ;\
@@ -860,21 +1025,27 @@ if genre == 'Global':
 
         with c2:
             if check_cause :
-                fig=px.bar(pd.DataFrame(ct_classe_cause_perc.stack()).reset_index().rename(columns=
-                    {'FIRE_SIZE_CLASS':'class', 'CAUSE':'Cause',0:'%'}), x='class', y='%',
-                color='Cause', color_discrete_sequence = causes_color,
-                    template = 'simple_white')
-                fig.update_layout(title_text='<b>Causes of fires for each fire size category<b>',
-                    title_x=0.5, showlegend=True,
-                    plot_bgcolor='white',font = dict(family= 'Helvetica', size= 15))
-                st.plotly_chart(fig, use_container_width=True)
+                @views.node(deps = ['ct_classe_cause_perc'])
+                def bar_class_cause(ct_classe_cause_perc):
+                    fig=px.bar(pd.DataFrame(ct_classe_cause_perc.stack()).reset_index().rename(columns=
+                        {'FIRE_SIZE_CLASS':'class', 'CAUSE':'Cause',0:'%'}), x='class', y='%',
+                    color='Cause', color_discrete_sequence = causes_color,
+                        template = 'simple_white')
+                    fig.update_layout(title_text='<b>Causes of fires for each fire size category<b>',
+                        title_x=0.5, showlegend=True,
+                        plot_bgcolor='white',font = dict(family= 'Helvetica', size= 15))
+                    return fig
+                st.plotly_chart(views.get('bar_class_cause'), use_container_width=True)
                 st.markdown('The largest fires are by far triggered by lightings, whereas individual mistakes are less damaging.')
-                fig = make_lineplot(x = 'DISC_YEAR', y = 'FIRE_SIZE',
-                    data = surface_avg, hue = 'CAUSE',
-                    palette = causes_color,
-                    ytitle = 'Average damaged surface \nper fire (ha)',
-                    title = 'Change in the average damage surface per year, 1992-2018')
-                st.pyplot(fig, use_container_width=True)
+                @views.node(deps = ['surface_avg'])
+                @figure_cache.cached
+                def line_surf_cause(surface_avg):
+                    return make_lineplot_from_stats(x = 'DISC_YEAR', y = 'FIRE_SIZE',
+                        data = surface_avg, hue = 'CAUSE',
+                        palette = causes_color,
+                        ytitle = 'Average damaged surface \nper fire (ha)',
+                        title = 'Change in the average damage surface per year, 1992-2018')
+                st.image(views.get('line_surf_cause'), use_column_width=True)
                 st.markdown('Lightning cause the most extensive fires throughout the study \
                     period, and this has been increasing. Next come technical accidents \
                     on infrastructures (which concern sparks from braking or mechanical \
@@ -882,19 +1053,22 @@ if genre == 'Global':
 
 
             else:
-                fig = px.bar(
-                    surface_months,
-                    x= 'DISC_MONTH', y = 'FIRE_SIZE_avg', color = 'DISC_MONTH',
-                    error_y='conf_int',
-                    color_discrete_sequence = month_colors,
-                    labels = {'DISC_MONTH' : '', 'FIRE_SIZE_avg' : 'Average burnt area (ha)'},
-                    template = 'simple_white'
-                )
-                fig.update_layout(title_text='<b>Average damaged surface <br> of fires depending on the month<b>',
-                    title_x=0.5, showlegend=False,
-                    plot_bgcolor='white',
-                    font = dict(family= 'Helvetica', size= 15) )
-                st.plotly_chart(fig, use_container_width=True)
+                @views.node(deps = ['surface_months'])
+                def bar_surf_month(surface_months):
+                    fig = px.bar(
+                        surface_months,
+                        x= 'DISC_MONTH', y = 'FIRE_SIZE_avg', color = 'DISC_MONTH',
+                        error_y='conf_int',
+                        color_discrete_sequence = month_colors,
+                        labels = {'DISC_MONTH' : '', 'FIRE_SIZE_avg' : 'Average burnt area (ha)'},
+                        template = 'simple_white'
+                    )
+                    fig.update_layout(title_text='<b>Average damaged surface <br> of fires depending on the month<b>',
+                        title_x=0.5, showlegend=False,
+                        plot_bgcolor='white',
+                        font = dict(family= 'Helvetica', size= 15) )
+                    return fig
+                st.plotly_chart(views.get('bar_surf_month'), use_container_width=True)
                 st.markdown('It is during the summer period, especially in June, \
                     that fires are the most devastating in terms of area burned')
                 # fig = make_barplot(months_year_total, 'DISC_MONTH', 'FIRE_SIZE',
@@ -905,22 +1079,41 @@ if genre == 'Global':
                 # st.markdown('Nonetheless, when the total area burnt over the entire period is considered, \
                 #     July is the most damaging month, as fires are more numerous, even though \
                 #     their average area is smaller than in June.')
-                fig, ax = plt.subplots(figsize = (8, 2.5))
-                slope, intercept, r_value, p_value, std_err = stats.linregress(df_fires.groupby('DISC_YEAR',
-                as_index=False).agg({'FIRE_SIZE': 'mean'}).DISC_YEAR,
-                df_fires.groupby('DISC_YEAR', as_index=False).agg({'FIRE_SIZE': 'mean'}).FIRE_SIZE)
-                line = slope*surface_fires_tmp.DISC_YEAR+intercept
-                ax.plot(surface_fires_tmp['DISC_YEAR'] , surface_fires_tmp['FIRE_SIZE'],
-                     c = color_surf, marker = 'o')
-                plt.plot(surface_fires_tmp.DISC_YEAR, line, color = 'grey', linestyle = 'dotted', lw = 3,
-                label='y = {:.2f}x{:.2f}'.format(slope,intercept))
-                plt.ylabel('Average surface (ha)')
-                plt.title('Average surface burned \nper fire (hectares)', y = 1.1);
-                st.pyplot(fig, use_container_width=True)
+                @views.node(deps = ['surface_fires_tmp', 'global_trends'])
+                @figure_cache.cached
+                def trend_surf_year(surface_fires_tmp, global_trends):
+                    fig, ax = plt.subplots(figsize = (8, 2.5))
+                    slope, intercept = global_trends.set_index('metric').loc['mean surface', ['slope', 'intercept']]
+                    line = slope*surface_fires_tmp.DISC_YEAR+intercept
+                    ax.plot(surface_fires_tmp['DISC_YEAR'] , surface_fires_tmp['FIRE_SIZE'],
+                         c = color_surf, marker = 'o')
+                    plt.plot(surface_fires_tmp.DISC_YEAR, line, color = 'grey', linestyle = 'dotted', lw = 3,
+                    label='y = {:.2f}x{:.2f}'.format(slope,intercept))
+                    plt.ylabel('Average surface (ha)')
+                    plt.title('Average surface burned \nper fire (hectares)', y = 1.1);
+                    return fig
+                st.image(views.get('trend_surf_year'), use_column_width=True)
                 st.markdown('&emsp; The average area of a fire increases progressively throughout \
                 the period despite significant annual variations; the regression line (grey) \
                 confirms this trend.')
 
+        st.subheader('Distribution of the fire size by cause')
+        c1, c2 = st.columns((1.25, 1))
+        with c1 :
+            @views.node(deps = ['sketch'])
+            @figure_cache.cached
+            def box_size_cause(sketch):
+                fig = make_boxplot_from_stats(sketch_box_stats(sketch, 'CAUSE', 'FIRE_SIZE'),
+                    xtitle = '', x_rot = 0, order = causes_labels, xlabels = causes_labels_split,
+                    ytitle = 'Surface of a fire (ha)', palette = causes_color, log = True)
+                plt.title('Surface of the fires depending on their cause', fontsize=14, fontweight='bold')
+                return fig
+            st.image(views.get('box_size_cause'), use_column_width=True)
+        with c2 :
+            st.dataframe(views.get('percentiles_cause'))
+            st.caption('Percentiles computed from quantile sketches, within {:.0%} of the exact values.'.format(
+                sketch_accuracy))
+
 
 
     if option_main_variable == fires_causes :
@@ -940,20 +1133,28 @@ if genre == 'Global':
             """)
 
         with c2 :
-            fig = make_countplot_with_annot(df_fires, 'CAUSE',
-                order = causes_labels, xlabels = causes_labels_split, height = 4,
-                ytitle = 'Total number of fires', palette = causes_color)
-            plt.title('Causes of wildfires, 1992-2018', fontsize=15, fontweight='bold')
-            st.pyplot(fig, use_container_width=True)
+            @views.node(deps = ['causes_count'])
+            @figure_cache.cached
+            def count_causes(causes_count):
+                fig = make_countplot_with_annot_from_counts(causes_count, 'CAUSE',
+                    order = causes_labels, xlabels = causes_labels_split, height = 4,
+                    ytitle = 'Total number of fires', palette = causes_color)
+                plt.title('Causes of wildfires, 1992-2018', fontsize=15, fontweight='bold')
+                return fig
+            st.image(views.get('count_causes'), use_column_width=True)
 
         c1, c2 = st.columns((1.8, 1))
         with c1 :
-            fig = make_lineplot(causes_year, x='Year', y='count', hue = 'cause', hue_order = causes_labels,
-                                ytitle = 'Number of fires', x_rot = 0, palette= causes_color)
-            plt.title('Evolution of the causes of wildfires from 1992 to 2018',
-                fontsize=13, fontweight='bold')
-            plt.legend(ncol=3, bbox_to_anchor=(0.9, -0.25))
-            st.pyplot(fig, use_container_width=True)
+            @views.node(deps = ['causes_year'])
+            @figure_cache.cached
+            def line_causes_year(causes_year):
+                fig = make_lineplot_from_stats(causes_year, x='Year', y='count', hue = 'cause', hue_order = causes_labels,
+                                    ytitle = 'Number of fires', x_rot = 0, palette= causes_color)
+                plt.title('Evolution of the causes of wildfires from 1992 to 2018',
+                    fontsize=13, fontweight='bold')
+                plt.legend(ncol=3, bbox_to_anchor=(0.9, -0.25))
+                return fig
+            st.image(views.get('line_causes_year'), use_column_width=True)
 
 
         with c2 :
@@ -965,52 +1166,61 @@ if genre == 'Global':
 
         c1,c2,c3=st.columns((0.01, 1, 0.01))
         with c2:
-            fig = px.bar(
-                cause_month_year,
-                x= 'DISC_MONTH', y = 'N_avg', color = 'CAUSE',
-                error_y='conf_int',
-                color_discrete_map = dico_causes_colors, category_orders = dico_causes,
-                labels = {'DISC_MONTH' : '', 'N_avg' : 'Number of fires'},
-                template = 'simple_white'
-            )
-            fig.update_layout(title_text='<b>Number of fires depending of the cause and the month</b>',
-                title_x=0.5, barmode = 'group',
-                plot_bgcolor='white',
-                font = dict(family= 'Helvetica', size= 15) )
-            st.plotly_chart(fig, use_container_width=True)
+            @views.node(deps = ['cause_month_year'])
+            def bar_causes_month(cause_month_year):
+                fig = px.bar(
+                    cause_month_year,
+                    x= 'DISC_MONTH', y = 'N_avg', color = 'CAUSE',
+                    error_y='conf_int',
+                    color_discrete_map = dico_causes_colors, category_orders = dico_causes,
+                    labels = {'DISC_MONTH' : '', 'N_avg' : 'Number of fires'},
+                    template = 'simple_white'
+                )
+                fig.update_layout(title_text='<b>Number of fires depending of the cause and the month</b>',
+                    title_x=0.5, barmode = 'group',
+                    plot_bgcolor='white',
+                    font = dict(family= 'Helvetica', size= 15) )
+                return fig
+            st.plotly_chart(views.get('bar_causes_month'), use_container_width=True)
             st.markdown('&emsp; We can have a closer look to the "Individuals\' mistake" category to better\
                 understand the problematic baheviors (see below).')
 
-            fig = px.bar(
-                cause_human_month_year,
-                x= 'DISC_MONTH', y = 'N_avg', color = 'NWCG_GENERAL_CAUSE',
-                error_y='conf_int',
-                labels = {'DISC_MONTH' : '', 'N_avg' : 'Number of fires'},
-                template = 'simple_white'
-            )
-            fig.update_layout(title_text='<b>Number of fires depending of the human cause and the month</b>',
-                title_x=0.5, barmode = 'group',
-                plot_bgcolor='white',
-                font = dict(family= 'Helvetica', size= 15) )
-            st.plotly_chart(fig, use_container_width=True)
-
-            st.markdown("&emsp; Burning of garbage is particularly involved from February through May. \
-                Festive fires are also more frequent in the summer, until September, and \
-                fireworks are especially visible in July (the month of the national holiday).")
-            fig = px.bar(
-                    surface_months_cause,
-                    x= 'DISC_MONTH', y = 'FIRE_SIZE_avg', color = 'CAUSE',
+            @views.node(deps = ['cause_human_month_year'])
+            def bar_human_causes_month(cause_human_month_year):
+                fig = px.bar(
+                    cause_human_month_year,
+                    x= 'DISC_MONTH', y = 'N_avg', color = 'NWCG_GENERAL_CAUSE',
                     error_y='conf_int',
-                    color_discrete_map = dico_causes_colors, category_orders = dico_causes,
-                    labels = {'DISC_MONTH' : '', 'DURATION_avg' : 'Surface (ha)'},
+                    labels = {'DISC_MONTH' : '', 'N_avg' : 'Number of fires'},
                     template = 'simple_white'
                 )
-            fig.update_layout(title_text='<b>Surface fires depending on the month and the cause</b>',
-                    title_x=0.5, showlegend=True, barmode = 'group',
+                fig.update_layout(title_text='<b>Number of fires depending of the human cause and the month</b>',
+                    title_x=0.5, barmode = 'group',
                     plot_bgcolor='white',
                     font = dict(family= 'Helvetica', size= 15) )
-            fig.update_yaxes(range=[0, 300])
-            st.plotly_chart(fig, use_container_width=True)
+                return fig
+            st.plotly_chart(views.get('bar_human_causes_month'), use_container_width=True)
+
+            st.markdown("&emsp; Burning of garbage is particularly involved from February through May. \
+                Festive fires are also more frequent in the summer, until September, and \
+                fireworks are especially visible in July (the month of the national holiday).")
+            @views.node(deps = ['surface_months_cause'])
+            def bar_surf_month_cause(surface_months_cause):
+                fig = px.bar(
+                        surface_months_cause,
+                        x= 'DISC_MONTH', y = 'FIRE_SIZE_avg', color = 'CAUSE',
+                        error_y='conf_int',
+                        color_discrete_map = dico_causes_colors, category_orders = dico_causes,
+                        labels = {'DISC_MONTH' : '', 'DURATION_avg' : 'Surface (ha)'},
+                        template = 'simple_white'
+                    )
+                fig.update_layout(title_text='<b>Surface fires depending on the month and the cause</b>',
+                        title_x=0.5, showlegend=True, barmode = 'group',
+                        plot_bgcolor='white',
+                        font = dict(family= 'Helvetica', size= 15) )
+                fig.update_yaxes(range=[0, 300])
+                return fig
+            st.plotly_chart(views.get('bar_surf_month_cause'), use_container_width=True)
             st.markdown("##### Wildfires caused by lightings are always the most extensive one.")
 
 
@@ -1021,130 +1231,165 @@ if genre == 'Global':
         c1, c2 = st.columns((1.75, 1))
         with c2:
             if check_cause:
-                fig=make_lineplot(duration_causes, 'DISC_YEAR', 'DURATION', xtitle ='', x_rot = 45,
-                    palette = causes_color, marker = 'o', hue = 'CAUSE', hue_order = causes_labels, width = 9, height = 5)
-                plt.title('Change in the fire duration \nover the period, depending on its cause',
-                    fontsize=15, fontweight='bold')
-                plt.ylabel('Avg duration', fontsize=12)
-                plt.xlabel('')
-                plt.xticks(range(1992,2019))
-                st.pyplot(fig.figure)
+                @views.node(deps = ['duration_causes'])
+                @figure_cache.cached
+                def line_duration_cause(duration_causes):
+                    fig=make_lineplot_from_stats(duration_causes, 'DISC_YEAR', 'DURATION', xtitle ='', x_rot = 45,
+                        palette = causes_color, marker = 'o', hue = 'CAUSE', hue_order = causes_labels, width = 9, height = 5)
+                    plt.title('Change in the fire duration \nover the period, depending on its cause',
+                        fontsize=15, fontweight='bold')
+                    plt.ylabel('Avg duration', fontsize=12)
+                    plt.xlabel('')
+                    plt.xticks(range(1992,2019))
+                    return fig
+                st.image(views.get('line_duration_cause'), use_column_width=True)
 
                 st.markdown("&emsp; It is visible that the lightnings cause fires that have been longer and longer since 1992; \
                     it may be due to the evolution of the soils and vegetation, increasingly dry over the years.")
-                fig = px.bar(
-                    duration_months_cause,
-                    x= 'DISC_MONTH', y = 'DURATION_avg', color = 'CAUSE',
-                    error_y='conf_int',
-                    color_discrete_map = dico_causes_colors, category_orders = dico_causes,
-                    labels = {'DISC_MONTH' : '', 'DURATION_avg' : 'Duration (days)'},
-                    template = 'simple_white'
-                )
-                fig.update_layout(title_text='<b>Duration of fires depending on the month and the cause</b>',
-                    title_x=0.5, showlegend=False, barmode = 'group',
-                    plot_bgcolor='white',
-                    font = dict(family= 'Helvetica', size= 15) )
-                st.plotly_chart(fig, use_container_width=True)
+                @views.node(deps = ['duration_months_cause'])
+                def bar_duration_month_cause(duration_months_cause):
+                    fig = px.bar(
+                        duration_months_cause,
+                        x= 'DISC_MONTH', y = 'DURATION_avg', color = 'CAUSE',
+                        error_y='conf_int',
+                        color_discrete_map = dico_causes_colors, category_orders = dico_causes,
+                        labels = {'DISC_MONTH' : '', 'DURATION_avg' : 'Duration (days)'},
+                        template = 'simple_white'
+                    )
+                    fig.update_layout(title_text='<b>Duration of fires depending on the month and the cause</b>',
+                        title_x=0.5, showlegend=False, barmode = 'group',
+                        plot_bgcolor='white',
+                        font = dict(family= 'Helvetica', size= 15) )
+                    return fig
+                st.plotly_chart(views.get('bar_duration_month_cause'), use_container_width=True)
                 st.markdown("##### Wildfires caused by lightings are always the longest ones to be contained.")
 
             else:
-                duration_global=df_fires.groupby('DISC_YEAR', as_index=False)['DURATION'].mean()
-                duration_month=df_fires.groupby('DISC_MONTH', as_index=False)['DURATION'].mean()
-                fig=make_lineplot(duration_global, 'DISC_YEAR', 'DURATION', xtitle ='', ytitle = 'Avg duration',
-                    x_rot = 45, xlabels =sorted(df_fires['DISC_YEAR'].unique()), color_plot = color_dura,
-                    palette = None, marker = 'o', hue = None, width = 8, height = 2.5)
-                plt.title('Change in the fire duration over the period',  fontsize=15, fontweight='bold')
-                plt.xticks(range(1992,2018))
-                st.pyplot(fig.figure)
+                @views.node(deps = ['duration_global'])
+                @figure_cache.cached
+                def line_duration_year(duration_global):
+                    fig=make_lineplot_from_stats(duration_global, 'DISC_YEAR', 'DURATION', xtitle ='', ytitle = 'Avg duration',
+                        x_rot = 45, xlabels =list(duration_global['DISC_YEAR']), color_plot = color_dura,
+                        palette = None, marker = 'o', hue = None, width = 8, height = 2.5)
+                    plt.title('Change in the fire duration over the period',  fontsize=15, fontweight='bold')
+                    plt.xticks(range(1992,2018))
+                    return fig
+                st.image(views.get('line_duration_year'), use_column_width=True)
                 st.markdown("##### There has been a slow trend in the average duration of fires since the early 1990s. \
                     This is certainly one of the major signs of the worsening fire phenomenon in the USA.")
-                fig = px.bar(
-                    duration_months,
-                    x= 'DISC_MONTH', y = 'DURATION_avg', color = 'DISC_MONTH',
-                    error_y='conf_int',
-                    color_discrete_sequence = month_colors,
-                    labels = {'DISC_MONTH' : '', 'DURATION_avg' : 'Duration (days)'},
-                    template = 'simple_white'
-                )
-                fig.update_layout(title_text='<b>Duration of fires depending on \nthe month</b>',
-                    title_x=0.5, showlegend=False,
-                    plot_bgcolor='white',
-                    font = dict(family= 'Helvetica', size= 15) )
-                st.plotly_chart(fig, use_container_width=True)
+                @views.node(deps = ['duration_months'])
+                def bar_duration_month(duration_months):
+                    fig = px.bar(
+                        duration_months,
+                        x= 'DISC_MONTH', y = 'DURATION_avg', color = 'DISC_MONTH',
+                        error_y='conf_int',
+                        color_discrete_sequence = month_colors,
+                        labels = {'DISC_MONTH' : '', 'DURATION_avg' : 'Duration (days)'},
+                        template = 'simple_white'
+                    )
+                    fig.update_layout(title_text='<b>Duration of fires depending on \nthe month</b>',
+                        title_x=0.5, showlegend=False,
+                        plot_bgcolor='white',
+                        font = dict(family= 'Helvetica', size= 15) )
+                    return fig
+                st.plotly_chart(views.get('bar_duration_month'), use_container_width=True)
                 st.markdown("##### The duration of the fires rises on average from the spring, and peaks in August.")
 
 
         with c1:
             map_type_fires = st.radio("Map type :", ('Year by year', 'Average over the years'))
             if map_type_fires== 'Year by year':
-                fig = px.choropleth(
-                    duration_year_state,
-                    locations='St',
-                    color='Avg duration of a fire (days)',
-                    locationmode='USA-states',
-                    color_continuous_scale='YlOrBr',
-                    range_color = [0, 15],
-                    animation_frame = 'Year',
-                    hover_name = 'State',
-                    hover_data = {'St' : False, 'Avg duration of a fire (days)' : True}
-                )
-                fig.add_trace(go.Scattergeo(
-                    locationmode = 'USA-states',
-                    locations=duration_year_state['St'],
-                    text=duration_year_state['St'],
-                    hoverinfo = 'skip',
-                    mode = 'text' )  )
-                fig.update_layout(
-                    title={'text':'<b>Evolution of the average duration of <br> fires by state over the period </b>', 'font':{'size':18}},
-                    legend_title_text='Avg duration <br> of a fire (days)',
-                    geo = dict(
-                        scope='usa',
-                        projection=go.layout.geo.Projection(type = 'albers usa'),
-                        showlakes=True,
-                        lakecolor='rgb(255, 255, 255)'),
-                        margin=dict(
-                            l=0, r=0, b=0, t=30, pad=2  )
-                )
-                st.plotly_chart(fig, use_container_width=True)
+                map_year = year_selector(views.get('fires_years'))
+                @views.node(deps = ['duration_year_state'], widgets = ['map_year'])
+                @plotly_cache.cached
+                def map_duration_year(duration_year_state, map_year):
+                    fig = px.choropleth(
+                        year_frame(duration_year_state, 'Year', map_year, {'Avg duration of a fire (days)' : 2}),
+                        locations='St',
+                        color='Avg duration of a fire (days)',
+                        locationmode='USA-states',
+                        color_continuous_scale='YlOrBr',
+                        range_color = [0, 15],
+                        animation_frame = 'Year' if map_year is None else None,
+                        hover_name = 'State',
+                        hover_data = {'St' : False, 'Avg duration of a fire (days)' : True}
+                    )
+                    fig.add_trace(state_labels(duration_year_state['St']))
+                    fig.update_layout(
+                        title={'text':'<b>Evolution of the average duration of <br> fires by state over the period </b>', 'font':{'size':18}},
+                        legend_title_text='Avg duration <br> of a fire (days)',
+                        geo = dict(
+                            scope='usa',
+                            projection=go.layout.geo.Projection(type = 'albers usa'),
+                            showlakes=True,
+                            lakecolor='rgb(255, 255, 255)'),
+                            margin=dict(
+                                l=0, r=0, b=0, t=30, pad=2  )
+                    )
+                    return fig
+                st.plotly_chart(views.get('map_duration_year', map_year = map_year), use_container_width=True)
 
 
             if map_type_fires == 'Average over the years' :
-                fig = px.choropleth(
-                    duration_avg_state,
-                    locations='St',
-                    color='Avg duration of a fire (days)',
-                    locationmode='USA-states',
-                    color_continuous_scale='YlOrBr',
-                    range_color = [0, 8],
-                    hover_name = 'State',
-                    hover_data = {'St' : False}
-                )
-                fig.add_trace(go.Scattergeo(
-                    locationmode = 'USA-states',
-                    locations=duration_avg_state['St'],    ###codes for states,
-                    text=duration_avg_state['St'],
-                    hoverinfo = 'skip',
-                    mode = 'text' )  )
-                fig.update_layout(title={'text':'<b>Average duration <br> of a fire by State </b>', 'font':{'size':18}},
-                    legend_title_text='Avg duration <br> of a fire (days)',
-                    geo = dict(
-                        scope='usa',
-                        projection=go.layout.geo.Projection(type = 'albers usa'),
-                        showlakes=True, # lakes
-                        lakecolor='rgb(255, 255, 255)'),
-                    margin=dict(l=0, r=0, b=0, t=30, pad=2)
-
-                )
-                st.plotly_chart(fig)
+                @views.node(deps = ['duration_avg_state'])
+                @plotly_cache.cached
+                def map_duration_avg(duration_avg_state):
+                    fig = px.choropleth(
+                        duration_avg_state,
+                        locations='St',
+                        color='Avg duration of a fire (days)',
+                        locationmode='USA-states',
+                        color_continuous_scale='YlOrBr',
+                        range_color = [0, 8],
+                        hover_name = 'State',
+                        hover_data = {'St' : False}
+                    )
+                    fig.add_trace(go.Scattergeo(
+                        locationmode = 'USA-states',
+                        locations=duration_avg_state['St'],    ###codes for states,
+                        text=duration_avg_state['St'],
+                        hoverinfo = 'skip',
+                        mode = 'text' )  )
+                    fig.update_layout(title={'text':'<b>Average duration <br> of a fire by State </b>', 'font':{'size':18}},
+                        legend_title_text='Avg duration <br> of a fire (days)',
+                        geo = dict(
+                            scope='usa',
+                            projection=go.layout.geo.Projection(type = 'albers usa'),
+                            showlakes=True, # lakes
+                            lakecolor='rgb(255, 255, 255)'),
+                        margin=dict(l=0, r=0, b=0, t=30, pad=2)
+
+                    )
+                    return fig
+                st.plotly_chart(views.get('map_duration_avg'))
                 st.markdown('Fires appear longest on average in the West, but this is even more noticeable in Alaska, \
                     which was affected by very long fires \
                     in 2004 and 2005, and then more recently, since 2015 and up to now.')
 
+        st.subheader('Distribution of the fire duration by cause')
+        c1, c2 = st.columns((1.25, 1))
+        with c1 :
+            @views.node(deps = ['sketch'])
+            @figure_cache.cached
+            def box_duration_cause(sketch):
+                fig = make_boxplot_from_stats(sketch_box_stats(sketch, 'CAUSE', 'DURATION'),
+                    xtitle = '', x_rot = 0, order = causes_labels, xlabels = causes_labels_split,
+                    ytitle = 'Duration (days)', palette = causes_color)
+                plt.title('Duration of the fires depending on their cause', fontsize=14, fontweight='bold')
+                return fig
+            st.image(views.get('box_duration_cause'), use_column_width=True)
+        with c2 :
+            st.dataframe(views.get('percentiles_cause'))
+            st.caption('Percentiles computed from quantile sketches, within {:.0%} of the exact values.'.format(
+                sketch_accuracy))
 
 
 # ---------------------------------------------
 # ---------------------------- Plots State by State
 #----------------------------------------------
+elif genre == 'By State' and df_fires is None :
+    st.info(streaming_info)
+
 elif genre == 'By State' :
     st.markdown( "##### &emsp;This tool provides, for each U.S. state, a visualization\
         of the spatial distribution of fires over the period 1992-2018, as well as :")
@@ -1158,58 +1403,88 @@ elif genre == 'By State' :
     with col_state:
         selected_state = st.selectbox(
          'Select the state you would like to analyse',
-         [' -- Rankings -- '] + list(np.sort(df_fires.STATE_FULL.unique())) )
+         [' -- Rankings -- '] + list(np.sort(fires_cube.STATE_FULL.dropna().unique())) )
     if selected_state == ' -- Rankings -- ' :
         c_1, c_2 = st.columns((1, 1))
         with c_1 :
-            f_number = make_barplot( state_year_tmp_df.sort_values( by = 'Number of fires', ascending = False),
-                'Number of fires','State',
-                xtitle = '', x_rot = 0,
-                order = state_year_tmp_df.groupby( ['State']).agg(
-                    {'Number of fires' : 'mean'}).sort_values(
-                    'Number of fires', ascending = False).index,
-                hue = None, hue_order = None,
-                xlabels = None, ytitle = '',
-                palette = None, color_plot = color_fire, linewidth = 0.8,
-                errcolor='.5', errwidth=0.8)
-            plt.title('Number of fires per state per year',
-                fontsize=15, fontweight='bold', y = 1.02)
-            f_number.set_figheight(8)
-            st.pyplot( f_number, use_container_width=True )
+            @views.node(deps = ['state_year_tmp_df'])
+            @figure_cache.cached
+            def rank_state_number(state_year_tmp_df):
+                f_number = make_barplot( state_year_tmp_df.sort_values( by = 'Number of fires', ascending = False),
+                    'Number of fires','State',
+                    xtitle = '', x_rot = 0,
+                    order = state_year_tmp_df.groupby( ['State'], observed = True).agg(
+                        {'Number of fires' : 'mean'}).sort_values(
+                        'Number of fires', ascending = False).index,
+                    hue = None, hue_order = None,
+                    xlabels = None, ytitle = '',
+                    palette = None, color_plot = color_fire, linewidth = 0.8,
+                    errcolor='.5', errwidth=0.8)
+                plt.title('Number of fires per state per year',
+                    fontsize=15, fontweight='bold', y = 1.02)
+                f_number.set_figheight(8)
+                return f_number
+            st.image(views.get('rank_state_number'), use_column_width=True)
         with c_2 :
-            f_surf = make_barplot( state_year_tmp_df,
-                'Surf','State',
-                xtitle = '', x_rot = 0,
-                order = state_year_tmp_df.groupby( ['State']).agg(
-                    {'Surf' : 'mean'}).sort_values(
-                    'Surf', ascending = False).index,
-                hue = None, hue_order = None,
-                xlabels = None, ytitle = '',
-                palette = None, color_plot = color_surf, linewidth = 0.8,
-                errcolor='.5', errwidth=0.8)
-            plt.title('Total surface burnt (ha) per state per year',
-                fontsize=15, fontweight='bold', y = 1.02)
-            f_surf.set_figheight(8)
-            st.pyplot( f_surf, use_container_width=True )
+            @views.node(deps = ['state_year_tmp_df'])
+            @figure_cache.cached
+            def rank_state_surf(state_year_tmp_df):
+                f_surf = make_barplot( state_year_tmp_df,
+                    'Surf','State',
+                    xtitle = '', x_rot = 0,
+                    order = state_year_tmp_df.groupby( ['State'], observed = True).agg(
+                        {'Surf' : 'mean'}).sort_values(
+                        'Surf', ascending = False).index,
+                    hue = None, hue_order = None,
+                    xlabels = None, ytitle = '',
+                    palette = None, color_plot = color_surf, linewidth = 0.8,
+                    errcolor='.5', errwidth=0.8)
+                plt.title('Total surface burnt (ha) per state per year',
+                    fontsize=15, fontweight='bold', y = 1.02)
+                f_surf.set_figheight(8)
+                return f_surf
+            st.image(views.get('rank_state_surf'), use_column_width=True)
+        st.subheader('Fastest-worsening states, regions and causes')
+        c_1, c_2 = st.columns((1, 1))
+        with c_1 :
+            trend_by = trend_groups[st.selectbox('Trend of the :', list(trend_groups))]
+        with c_2 :
+            trend_metric = trend_labels[st.selectbox('Yearly series :', list(trend_labels))]
+        # All the groups at once from the cube, in a few milliseconds (see wildfires_aggregates.trends)
+        @views.node(deps = ['cube'], widgets = ['trend_by', 'trend_metric'])
+        def leaderboard(cube, trend_by, trend_metric):
+            board = trend_leaderboard(cube, trend_by, trend_metric)
+            board = board[list(trend_by) + ['change %', 'slope', 'r2', 'p_value', 'significant', 'years']]
+            return board.rename(columns = dict(trend_by_labels, **{'change %' : 'Change per year (%)',
+                'slope' : 'Slope per year', 'p_value' : 'p-value'})).round(4)
+        st.dataframe(views.get('leaderboard', trend_by = trend_by, trend_metric = trend_metric))
+        st.caption("Least squares line of the yearly series of each group, its slope relative to \
+            the mean of the series. Significant : p-value of the slope below 5%.")
 
     else :
-        df_sub = df_fires[(df_fires.STATE_FULL == selected_state)]
-        df_sub_count=pd.crosstab(df_sub['DISC_YEAR'],
-            df_sub['CAUSE']).stack().reset_index().rename(
-            columns= {'DISC_YEAR':'Year', 'CAUSE':'cause', 0:'count'})
+        # The frames of the state are nodes of the view graph keyed by the selected state (see above)
+        df_sub = views.get('df_sub', state = selected_state)
         state_abb = df_sub.STATE.unique()[0]
-        state_nb_month = df_sub.groupby( [ 'DISC_YEAR', 'DISC_MONTH' ],
-            as_index=False).agg({'FPA_ID' : 'count'})
-        state_surf_year = df_sub.groupby( [ 'DISC_YEAR' ],
-            as_index=False).agg({'FIRE_SIZE' : 'sum'})
-        ct_cause_state_year = pd.crosstab(df_sub.DISC_YEAR, df_sub.CAUSE)
-        ct_cause_state_year_perc = ct_cause_state_year.apply(lambda x : (x/x.sum()) *100, axis  = 1)
         with col_cause :
             cause_on = st.radio(
                 "Do you want to visualize the data by separating the \
                 information according to the cause of the fires ?",
                 ('Yes', 'No'))
         st.header(selected_state)
+        if cause_on == 'No' :
+            # The five charts of the state are independent : they are drawn at the same time by the
+            # worker processes, each one from the columns or the roll-up it needs
+            @views.node(deps = ['state_year_count', 'state_surf_year', 'state_nb_month', 'state_doy_density',
+                'duration_year_state'], widgets = ['state'])
+            def state_charts(state_year_count, state_surf_year, state_nb_month, state_doy_density,
+                duration_year_state, state):
+                return figure_cache.render_many([
+                    (state_count_year, (state_year_count,), {}),
+                    (state_surf_year_lineplot, (state_surf_year,), {}),
+                    (state_month_boxplot, (state_nb_month,), {'xlabels' : months_labels, 'palette' : month_colors}),
+                    (ridgeplot_from_density, (state_doy_density,), {}),
+                    (state_duration_lineplot, (duration_year_state.loc[duration_year_state['State']==state],), {})])
+            state_charts = views.get('state_charts', state = selected_state)
         if cause_on == 'Yes' :
             c1, c2 = st.columns((1.5, 1))
         else :
@@ -1218,177 +1493,123 @@ elif genre == 'By State' :
             map_type_fires = st.radio(
                 "Map type :", ('Year by year', 'All years'))
             if map_type_fires == 'Year by year' :
-                fig = px.scatter_geo(df_sub.sort_values(by = 'DISC_YEAR'),
-                lat = 'lat',
-                lon = 'lon',
-                locationmode = 'USA-states',
-                color = 'CAUSE',
-                category_orders = dico_causes,
-                color_discrete_map = dico_causes_colors,
-                animation_frame = 'DISC_YEAR',
-                size = 'FIRE_SIZE',
-                size_max = 50,
-                opacity = 0.8,
-                )
-                fig.update_layout(legend = dict(
-                    title = '', yanchor="bottom", y=0.5,
-                    xanchor="left", x=0),
-                                  geo = dict( scope='usa',
-                    projection=go.layout.geo.Projection(type = 'albers usa'),
-                    showlakes=True, # lakes
-                    lakecolor='rgb(255, 255, 255)'),
-                    margin=dict(l=0, r=0, b=0, t=30, pad=2),
-                    title={'text':'<b>Number of fires per year according to their cause</b>', 'font':{'size':18}}
-                )
-                fig.update_geos(fitbounds="locations")
-                st.plotly_chart(fig, use_container_width=True)
+                # Above the marker budget, the fires are grouped by cells of a lat / lon grid
+                map_details = dict([('Auto', 'auto'), ('Every fire', None)] +
+                    [('Cells of {}°'.format(resolution), resolution) for resolution in lod_resolutions])
+                map_detail = map_details[st.selectbox('Detail of the map :', list(map_details))]
+
+                @views.node(deps = ['df_sub'], widgets = ['map_detail'])
+                def state_markers(df_sub, map_detail):
+                    # The rows of the state are already sorted by year (see sort_layout)
+                    return grid_aggregate(df_sub, map_detail)
+
+                @views.node(deps = ['state_markers'])
+                def map_state_year(state_markers):
+                    fig = px.scatter_geo(state_markers,
+                    lat = 'lat',
+                    lon = 'lon',
+                    locationmode = 'USA-states',
+                    color = 'CAUSE',
+                    category_orders = dico_causes,
+                    color_discrete_map = dico_causes_colors,
+                    animation_frame = 'DISC_YEAR',
+                    size = 'FIRE_SIZE',
+                    size_max = 50,
+                    opacity = 0.8,
+                    hover_data = ['count'],
+                    )
+                    fig.update_layout(legend = dict(
+                        title = '', yanchor="bottom", y=0.5,
+                        xanchor="left", x=0),
+                                      geo = dict( scope='usa',
+                        projection=go.layout.geo.Projection(type = 'albers usa'),
+                        showlakes=True, # lakes
+                        lakecolor='rgb(255, 255, 255)'),
+                        margin=dict(l=0, r=0, b=0, t=30, pad=2),
+                        title={'text':'<b>Number of fires per year according to their cause</b>', 'font':{'size':18}}
+                    )
+                    fig.update_geos(fitbounds="locations")
+                    return fig
+                st.plotly_chart(views.get('map_state_year', state = selected_state, map_detail = map_detail),
+                    use_container_width=True)
 
             elif map_type_fires == 'All years' :
+                points = views.get('state_points', state = selected_state)
                 if selected_state=='California':
                     image = Image.open('California.png')
                     st.image(image)
                     if st.button('Create the interactive version'):
                         options_layers = st.multiselect( 'Which causes to add :', causes_labels, causes_labels)
-                        layers = []
-                        for lay in options_layers :
-                            i = causes_labels.index(lay)
-                            layers.append( pdk.Layer(
-                                'ScatterplotLayer',
-                                data=df_sub[df_sub.CAUSE == lay],
-                                id = 'test',
-                                opacity=0.5,
-                                get_position='[lon, lat]',
-                                get_color=causes_color_rgb[i],
-                                get_radius=1500 ))
-                        st.pydeck_chart(pdk.Deck(
-                                map_style='mapbox://styles/mapbox/light-v9',
-                                initial_view_state=pdk.ViewState(
-                                    latitude=df_sub['lat'].mean(),
-                                    longitude=df_sub['lon'].mean(),
-                                    zoom=3,
-                                    pitch=0,
-                                ),layers= layers,
-                            ))
+                        st.pydeck_chart(cause_map(points, options_layers, 1500))
                 elif selected_state=='Florida':
                     image = Image.open('Florida.png')
                     st.image(image)
                     if st.button('Create the interactive version'):
                         options_layers = st.multiselect( 'Which causes to add :', causes_labels, causes_labels)
-                        layers = []
-                        for lay in options_layers :
-                            i = causes_labels.index(lay)
-                            layers.append( pdk.Layer(
-                                'ScatterplotLayer',
-                                data=df_sub[df_sub.CAUSE == lay],
-                                id = 'test',
-                                opacity=0.5,
-                                get_position='[lon, lat]',
-                                get_color=causes_color_rgb[i],
-                                get_radius=1500 ))
-                        st.pydeck_chart(pdk.Deck(
-                                map_style='mapbox://styles/mapbox/light-v9',
-                                initial_view_state=pdk.ViewState(
-                                    latitude=df_sub['lat'].mean(),
-                                    longitude=df_sub['lon'].mean(),
-                                    zoom=3,
-                                    pitch=0,
-                                ),layers= layers,
-                            ))
+                        st.pydeck_chart(cause_map(points, options_layers, 1500))
                 else:
                     options_layers = st.multiselect( 'Which causes to add :',
                     causes_labels, causes_labels)
-                    layers = []
-                    for lay in options_layers :
-                        i = causes_labels.index(lay)
-                        layers.append( pdk.Layer(
-                             'ScatterplotLayer',
-                             data=df_sub[df_sub.CAUSE == lay],
-                             id = 'test',
-                            opacity=0.5,
-                             get_position='[lon, lat]',
-                             get_color=causes_color_rgb[i],
-                             get_radius=2000 ))
-                    st.pydeck_chart(pdk.Deck(map_style='mapbox://styles/mapbox/light-v9',
-                            initial_view_state=pdk.ViewState(latitude=df_sub['lat'].mean(),
-                                                             longitude=df_sub['lon'].mean(),zoom=3,pitch=0),
-                            layers= layers,
-                    ))
-
-
-            if cause_on == 'Yes':
-                f2 = make_lineplot(df_sub_count, x='Year', y='count',
-                    hue = 'cause',
-                    ytitle = '',
-                    palette = causes_color,
-                    width = 8, height = 2.5)
-                plt.title('Number of fires per year in ' + selected_state +
-                    "\ndepending of the cause", fontsize=15, fontweight='bold')
-            else : # cause_on = No
-                f1 = make_countplot( df_sub,
-                'DISC_YEAR', xtitle ='', ytitle = '\n\n', x_rot = 90, color_plot = 'lightslategray')
-                plt.title('Number of fires per year', fontsize=15, fontweight='bold')
-                f2 = make_lineplot(state_surf_year,
-                    'DISC_YEAR', 'FIRE_SIZE',
-                    xtitle = '', x_rot = 90, xlabels = range(1992, 2019),
-                    ytitle = 'Total surface burnt\n(hectares)', color_plot='lightslategray')
-                plt.title('Total surface burnt per year', fontsize=15, fontweight='bold')
-                f3 = make_boxplot(state_nb_month,
-                    'DISC_MONTH', 'FPA_ID',
-                    xtitle = '', x_rot = 0, xlabels = months_labels,
-                    ytitle = 'Number of fires \nper year', palette = month_colors)
-                plt.title('Number of fires per month', fontsize=15, fontweight='bold')
-                st.pyplot(f1, use_container_width=True)
-                st.pyplot(f2, use_container_width=True)
-                st.pyplot(f3, use_container_width=True)
+                    st.pydeck_chart(cause_map(points, options_layers, 2000))
+
+
+            if cause_on == 'No':
+                st.image(state_charts[0], use_column_width=True)
+                st.image(state_charts[1], use_column_width=True)
+                st.image(state_charts[2], use_column_width=True)
 
         with c2:
             if cause_on == 'Yes' :
-                f1 = make_countplot_with_annot(df_sub, 'CAUSE',
-                    xtitle ='', ytitle = '\n\n', x_rot = 0,
-                    order = causes_labels, xlabels = causes_labels_split, palette = causes_color)
-                plt.title('Distribution of the wildfires causes', fontsize=15, fontweight='bold')
-                st.pyplot(f1, use_container_width=True)
-                f2 = make_lineplot(df_sub_count, x='Year', y='count',
-                    hue = 'cause',
-                    ytitle = '',
-                    palette = causes_color,
-                    width = 8, height = 2.5)
-                plt.title('Number of fires per year in ' + selected_state + "\ndepending of the cause",
-                    fontsize=15, fontweight='bold')
-                st.pyplot(f2, use_container_width=True)
+                @views.node(deps = ['state_causes_count'])
+                @figure_cache.cached
+                def count_state_causes(state_causes_count):
+                    f1 = make_countplot_with_annot_from_counts(state_causes_count, 'CAUSE',
+                        xtitle ='', ytitle = '\n\n', x_rot = 0,
+                        order = causes_labels, xlabels = causes_labels_split, palette = causes_color)
+                    plt.title('Distribution of the wildfires causes', fontsize=15, fontweight='bold')
+                    return f1
+                st.image(views.get('count_state_causes', state = selected_state), use_column_width=True)
+                @views.node(deps = ['df_sub_count'], widgets = ['state'])
+                @figure_cache.cached
+                def line_state_causes(df_sub_count, state):
+                    f2 = make_lineplot_from_stats(df_sub_count, x='Year', y='count',
+                        hue = 'cause',
+                        ytitle = '',
+                        palette = causes_color,
+                        width = 8, height = 2.5)
+                    plt.title('Number of fires per year in ' + state + "\ndepending of the cause",
+                        fontsize=15, fontweight='bold')
+                    return f2
+                st.image(views.get('line_state_causes', state = selected_state), use_column_width=True)
             else :
-                f4 = ridgeplot(df_sub)
-                st.pyplot(f4, use_container_width=True)
+                st.image(state_charts[3], use_column_width=True)
                 st.markdown("&emsp;The plot above shows the density \
                     of the fires occurences along the year from 1992 to 2018. It offers a complementary \
                     perspective on the impacts of climate change: depending on the state, \
                     we can observe phenomena of lengthening of the fire season \
                     (for example in Puerto Rico, Colorado or Arizona), or on the contrary, \
                     a brutal radicalization of fires over one or two seasons (in Kansas)." )
-                f5=make_lineplot(duration_year_state.loc[duration_year_state['State']==selected_state],
-                    x='Year', y='Avg duration of a fire (days)', x_rot = 45, marker = 'o',
-                    width = 9, height = 5, color_plot='#B26A22')
-                plt.ylabel('Average duration (days)', fontsize=12)
-                plt.xlabel('', fontsize=12)
-                plt.xticks(range(1992,2018))
-                plt.title('Change in the fire duration over the period', fontsize=15, fontweight='bold')
-                st.pyplot(f5.figure)
+                st.image(state_charts[4], use_column_width=True)
                 st.markdown("&emsp; It is obvious that fires have been longer and longer since 1992; \
                     it may be due to the evolution of the soils and vegetation, increasingly dry over the years.")
 
         if cause_on == 'Yes' :
-            f3 = px.bar(df_sub.groupby(['DISC_YEAR', 'CAUSE'],
-                as_index = False).agg({'FIRE_SIZE':'sum'}),
-                x='DISC_YEAR', y='FIRE_SIZE',
-                color = 'CAUSE', color_discrete_sequence = causes_color, template='simple_white',
-                labels = {'DISC_YEAR' : '', 'FIRE_SIZE' : 'Damaged surface (ha)'}
-                )
-            f3.update_layout(title_text='<b>Total surface burnt per year depending of the cause<b>',
-                    title_x=0.5, showlegend=True, barmode = 'group',
-                    plot_bgcolor='white',
-                    font = dict(family= 'Helvetica', size= 15))
-            st.plotly_chart(f3, use_container_width=True)
-            
+            @views.node(deps = ['state_surf_year_cause'])
+            def bar_state_surf_cause(state_surf_year_cause):
+                f3 = px.bar(state_surf_year_cause,
+                    x='DISC_YEAR', y='FIRE_SIZE',
+                    color = 'CAUSE', color_discrete_sequence = causes_color, template='simple_white',
+                    labels = {'DISC_YEAR' : '', 'FIRE_SIZE' : 'Damaged surface (ha)'}
+                    )
+                f3.update_layout(title_text='<b>Total surface burnt per year depending of the cause<b>',
+                        title_x=0.5, showlegend=True, barmode = 'group',
+                        plot_bgcolor='white',
+                        font = dict(family= 'Helvetica', size= 15))
+                return f3
+            st.plotly_chart(views.get('bar_state_surf_cause', state = selected_state), use_container_width=True)
+            st.markdown('##### Distribution of the fire size and duration by cause')
+            st.dataframe(views.get('state_percentiles', state = selected_state))
+
 
 elif genre == 'Regional':
     st.markdown("##### &emsp; Spatial analysis of fires reveals significant disparities in the causes, \
@@ -1397,32 +1618,36 @@ elif genre == 'Regional':
     st.markdown('---')
     c1, c2 = st.columns((1, 1.5))
     with c1:
-        fig = px.choropleth(
-            df_regions,
-            locations='State',
-            locationmode='USA-states',
-            color = 'Region',
-            hover_name = 'State',
-            color_discrete_map  = dico_regions_colors,
-            category_orders = dico_regions_order,
-        )
-        fig.add_trace(go.Scattergeo(
-            locationmode = 'USA-states',
-            locations=df_regions.State,
-            text=df_regions.State,
-            hoverinfo = 'skip',
-            mode = 'text' ) )
-        fig.update_layout(
-            title_text='Regions',
-            geo = dict(
-                scope='usa',
-                projection=go.layout.geo.Projection(type = 'albers usa'),
-                showlakes=True, # lakes
-                lakecolor='rgb(255, 255, 255)'),
-                margin=dict(
-                    l=0, r=0, b=0, t=30, pad=2  )
-        )
-        st.plotly_chart(fig)
+        @views.node()
+        @plotly_cache.cached
+        def map_regions():
+            fig = px.choropleth(
+                df_regions,
+                locations='State',
+                locationmode='USA-states',
+                color = 'Region',
+                hover_name = 'State',
+                color_discrete_map  = dico_regions_colors,
+                category_orders = dico_regions_order,
+            )
+            fig.add_trace(go.Scattergeo(
+                locationmode = 'USA-states',
+                locations=df_regions.State,
+                text=df_regions.State,
+                hoverinfo = 'skip',
+                mode = 'text' ) )
+            fig.update_layout(
+                title_text='Regions',
+                geo = dict(
+                    scope='usa',
+                    projection=go.layout.geo.Projection(type = 'albers usa'),
+                    showlakes=True, # lakes
+                    lakecolor='rgb(255, 255, 255)'),
+                    margin=dict(
+                        l=0, r=0, b=0, t=30, pad=2  )
+            )
+            return fig
+        st.plotly_chart(views.get('map_regions'))
         st.markdown("&emsp;Fires do not have the same causes depending on whether you are in the east \
             or west of the country.\
             We can see that lightning is the main origin of fires in the West (Utah and Nevada). \
@@ -1449,41 +1674,54 @@ elif genre == 'Regional':
             it is certainly the drying out of the soil and vegetation that increases vulnerability \
             to fires.")
     with c2:
-        fig, ax = plt.subplots()
-        region_cause_df.plot(
-            kind='barh',
-            stacked=True,
-            color={'Criminal':'#44AA99',
-            "Individuals' mistake":'#332288',
-            'Infrastructure accident':'#AA3377',
-            'Natural (lightning)':'#CCBB44',
-            'Other/Unknown':'grey'},
-            alpha = 0.8, ax = ax
-        )
-        plt.ylabel('')
-        ax.tick_params(axis='both', color = 'black', labelsize=12)
-        ax.spines['top'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-        plt.xlabel('% of total fires reported from 1992 to 2018', fontsize = 14, labelpad=15)
-        plt.legend(labels=['Criminal',"Individuals'\nmistake",
-                           "Infrastructure \naccident",
-                           "Natural \n(lightning)",
-                           'Other/Unknown'],
-                   bbox_to_anchor=(1.02, 0.8),
-                   fontsize = 14, ncol = 1 )
-        plt.title('Wildfire origins depending on the region', fontsize=15);
-        st.pyplot(fig, use_container_width=True)
-
-
-        fig = px.line(region_fire_number.rolling(10).mean(),
-        color_discrete_map = dico_regions_colors,
-        template = 'simple_white',
-        labels = {'value' : 'Number of fires', 'DISC_YEAR' : ''})
-        fig.update_traces(line=dict(width=5))
-        fig.update_xaxes(range=[2002, 2018])
-        fig.update_yaxes(range=[0, 25000])
-        fig.update_layout(title_text='<b> Evolution of the number of fires in the main regions </b>',
-            title_x=0.5, legend=dict(font=dict(size= 14) ),
-            plot_bgcolor='white')
-        st.plotly_chart(fig, use_container_width=True)
+        @views.node(deps = ['region_cause_df'])
+        @figure_cache.cached
+        def bar_region_causes(region_cause_df):
+            fig, ax = plt.subplots()
+            region_cause_df.plot(
+                kind='barh',
+                stacked=True,
+                color={'Criminal':'#44AA99',
+                "Individuals' mistake":'#332288',
+                'Infrastructure accident':'#AA3377',
+                'Natural (lightning)':'#CCBB44',
+                'Other/Unknown':'grey'},
+                alpha = 0.8, ax = ax
+            )
+            plt.ylabel('')
+            ax.tick_params(axis='both', color = 'black', labelsize=12)
+            ax.spines['top'].set_visible(False)
+            ax.spines['right'].set_visible(False)
+            plt.xlabel('% of total fires reported from 1992 to 2018', fontsize = 14, labelpad=15)
+            plt.legend(labels=['Criminal',"Individuals'\nmistake",
+                               "Infrastructure \naccident",
+                               "Natural \n(lightning)",
+                               'Other/Unknown'],
+                       bbox_to_anchor=(1.02, 0.8),
+                       fontsize = 14, ncol = 1 )
+            plt.title('Wildfire origins depending on the region', fontsize=15);
+            return fig
+        st.image(views.get('bar_region_causes'), use_column_width=True)
+
+
+        @views.node(deps = ['region_fire_number'])
+        def line_region_number(region_fire_number):
+            fig = px.line(region_fire_number.rolling(10).mean(),
+            color_discrete_map = dico_regions_colors,
+            template = 'simple_white',
+            labels = {'value' : 'Number of fires', 'DISC_YEAR' : ''})
+            fig.update_traces(line=dict(width=5))
+            fig.update_xaxes(range=[2002, 2018])
+            fig.update_yaxes(range=[0, 25000])
+            fig.update_layout(title_text='<b> Evolution of the number of fires in the main regions </b>',
+                title_x=0.5, legend=dict(font=dict(size= 14) ),
+                plot_bgcolor='white')
+            return fig
+        st.plotly_chart(views.get('line_region_number'), use_container_width=True)
 
+
+# ------------------------------------------
+# ---------------------------- Profiling
+# ------------------------------------------
+if profiler.active():
+    profiling_panel()
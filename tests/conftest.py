@@ -0,0 +1,41 @@
+# Fixtures of the tests : a small synthetic dataset (see wildfires_benchmark.generate) and caches in
+# a temporary directory, so that the tests don't read or write the caches of the dashboard
+
+import os
+import sys
+
+# Charts drawn in the process of the tests, without pool of workers
+os.environ.setdefault('WILDFIRES_RENDER_WORKERS', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import wildfires_data
+from wildfires_benchmark import generate, reset_caches
+from wildfires_figures import plotly_cache
+from wildfires_registry import datasets
+
+
+test_rows = 20000
+test_state = 'Texas'
+
+
+@pytest.fixture(scope = 'session')
+def source(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('wildfires')
+    wildfires_data.cache_dir = str(directory / 'cache')
+    plotly_cache.directory = os.path.join(wildfires_data.cache_dir, 'figures')
+    path = generate(test_rows, str(directory / 'wildfires_synthetic.csv'))
+    # The dashboard reads this dataset
+    wildfires_data.data_filename = path
+    return path
+
+
+@pytest.fixture
+def fresh(source):
+    # Empty caches and registry before a test
+    datasets.clear()
+    reset_caches()
+    yield source
+    datasets.clear()
+    reset_caches()
@@ -0,0 +1,258 @@
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+import wildfires_aggregates
+from wildfires_data import load_prepared, source_fingerprint, read_cache
+from wildfires_aggregates import (materialize_cube, aggregate_frame, rollup, compare_engines, trends,
+    stream_aggregates, sketch_frame, cube_checksum, sketch_checksum, append_records, materialize_sketch,
+    count_of, sum_of, stats_of, min_max_of, sketch_quantiles, sketch_box_stats, sketch_accuracy, sketch_min,
+    doy_density, grid_aggregate, lod_resolutions, grouped_ci, ci_of, z_value)
+
+
+def test_trends_against_linregress(fresh):
+    data = load_prepared(fresh)
+    table = trends(materialize_cube(fresh, data = data), ['STATE_FULL']).set_index(['STATE_FULL', 'metric'])
+    # The families of the cube without year (missing_key) add no year to the series
+    assert table['years'].max() == data['DISC_YEAR'].nunique()
+    years = np.sort(data['DISC_YEAR'].unique())
+    for state in ['Texas', 'California', 'Georgia']:
+        rows = data[data['STATE_FULL'] == state]
+        # A year without fires of the state is a count and a surface of 0
+        yearly = rows['FIRE_SIZE'].astype('float64').groupby(rows['DISC_YEAR']).agg(
+            ['size', 'sum']).reindex(years, fill_value = 0)
+        for metric, col in [('count', 'size'), ('surface', 'sum')]:
+            line = stats.linregress(years.astype('float64'), yearly[col].astype('float64'))
+            actual = table.loc[(state, metric)]
+            np.testing.assert_allclose([actual['slope'], actual['intercept'], actual['r2'], actual['p_value']],
+                [line.slope, line.intercept, line.rvalue ** 2, line.pvalue], rtol = 1e-6)
+
+
+@pytest.mark.skipif(wildfires_aggregates.pl is None, reason = 'polars is not installed')
+def test_polars_engine_against_pandas(fresh, monkeypatch):
+    data = load_prepared(fresh)
+    frames = {}
+    for engine in ['pandas', 'polars']:
+        monkeypatch.setattr(wildfires_aggregates, 'aggregate_engine', engine)
+        cube = aggregate_frame(data)
+        frames[engine] = [cube] + [rollup(cube, keys) for keys in
+            [['DISC_YEAR'], ['DISC_MONTH', 'CAUSE'], ['STATE_FULL', 'DISC_YEAR'], ['Region', 'CAUSE']]]
+    # Same cells and types, sums up to the order of the additions
+    for expected, frame in zip(frames['pandas'], frames['polars']):
+        pd.testing.assert_frame_equal(frame, expected, rtol = 1e-9)
+    assert compare_engines(data)['equal']
+
+
+rollup_keys = [['DISC_YEAR'], ['DISC_DOW'], ['DISC_MONTH', 'CAUSE'], ['STATE_FULL', 'DISC_YEAR'],
+               ['Region', 'CAUSE'], ['FIRE_SIZE_CLASS', 'CAUSE']]
+
+
+def test_rollups_against_groupbys_of_the_rows(fresh):
+    # Each roll-up of the cube gives the groupby of the rows it replaces in the dashboard
+    data = load_prepared(fresh)
+    cube = aggregate_frame(data)
+    # The cube sums the float32 columns in float64 : the groupbys of reference too
+    data = data.astype({'FIRE_SIZE' : 'float64', 'DURATION' : 'float64'})
+    for keys in rollup_keys:
+        groups = data.groupby(keys, observed = True)
+        expected = groups['FIRE_SIZE'].agg(['size', 'mean', 'std', 'min', 'max'])
+        expected['DURATION'] = groups['DURATION'].sum()
+        frames = [count_of(cube, keys), stats_of(cube, keys, 'FIRE_SIZE'), min_max_of(cube, keys, 'FIRE_SIZE'),
+                  sum_of(cube, keys, 'DURATION')]
+        rolled = pd.concat([frame.set_index(keys) for frame in frames], axis = 1).reindex(expected.index)
+        assert len(rolled) == len(count_of(cube, keys)) == len(expected), keys
+        np.testing.assert_array_equal(rolled['count'], expected['size'])
+        np.testing.assert_array_equal(rolled['FIRE_SIZE_count'], expected['size'])
+        np.testing.assert_allclose(rolled['FIRE_SIZE_mean'], expected['mean'], rtol = 1e-9)
+        np.testing.assert_allclose(rolled['FIRE_SIZE_std'], expected['std'], rtol = 1e-6)
+        np.testing.assert_array_equal(rolled['FIRE_SIZE_min'], expected['min'])
+        np.testing.assert_array_equal(rolled['FIRE_SIZE_max'], expected['max'])
+        np.testing.assert_allclose(rolled['DURATION'], expected['DURATION'], rtol = 1e-9)
+
+
+def test_rollups_from_concurrent_sessions(fresh, monkeypatch):
+    # A cache smaller than the roll-ups asked : the sessions evict the entries of each other
+    monkeypatch.setattr(wildfires_aggregates, 'rollup_cache_size', 2)
+    cube = aggregate_frame(load_prepared(fresh))
+    expected = [rollup(cube, keys) for keys in rollup_keys]
+    errors = []
+
+    def session():
+        try:
+            for i in range(20):
+                for keys, frame in zip(rollup_keys, expected):
+                    pd.testing.assert_frame_equal(rollup(cube, keys), frame)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target = session) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(wildfires_aggregates.rollup_cache) <= 2
+
+
+def test_streaming_ingest_against_the_frame(fresh):
+    # Chunks of 3001 rows : the cells of the cube and the bins of the sketches are split between chunks
+    data = load_prepared(fresh)
+    cube, sketch = stream_aggregates(fresh, chunk_size = 3001, sketches = True)
+    expected_cube, expected_sketch = aggregate_frame(data), sketch_frame(data)
+    assert cube_checksum(cube) == cube_checksum(expected_cube)
+    pd.testing.assert_frame_equal(cube, expected_cube, rtol = 1e-9)
+    assert sketch_checksum(sketch) == sketch_checksum(expected_sketch)
+    assert cube['n'].sum() == len(data) * len(wildfires_aggregates.cube_families)
+
+
+def test_append_equals_a_full_rebuild(fresh, tmp_path):
+    source = str(tmp_path / 'fires.csv')
+    rows = pd.read_csv(fresh)
+    rows.iloc[:-500].to_csv(source, index = False)
+    load_prepared(source)
+    # Rows of every state and year, and a new cause : categories of the delta unknown to the frame
+    delta = rows.iloc[-500:].assign(CAUSE = lambda df : df['CAUSE'].where(df.index % 9 != 0, 'New cause'))
+    delta.to_csv(str(tmp_path / 'delta.csv'), index = False)
+    data, cube, report = append_records(source, str(tmp_path / 'delta.csv'), verify = True)
+    assert report['new rows'] == 500 and report['rows'] == len(rows)
+    assert report['data equal'] and report['cube equal'] and report['sketch equal'], report
+    # The key of the caches is the hash of the new csv : the next load reads them, not the csv
+    fingerprint = source_fingerprint(source)
+    with open(source, 'rb') as f:
+        assert fingerprint['sha1'] == hashlib.sha1(f.read()).hexdigest()
+    assert read_cache(fingerprint) is not None
+    pd.testing.assert_frame_equal(load_prepared(source), load_prepared(source, use_cache = False))
+    assert cube_checksum(materialize_cube(source)) == cube_checksum(cube)
+    assert sketch_checksum(materialize_sketch(source)) == sketch_checksum(sketch_frame(data))
+
+
+def sketch_groups(seed = 0):
+    # Values of FIRE_SIZE by group : spread over many bins, with zeros (durations of 0 days), in a
+    # single bin, a single value
+    rng = np.random.default_rng(seed)
+    return {'AA' : rng.lognormal(0, 2, 5000),
+            'BB' : np.where(rng.random(3000) < 0.6, 0, rng.lognormal(1, 1, 3000)),
+            'CC' : 5 * (1 + rng.random(1000) * sketch_accuracy / 2),
+            'DD' : np.array([42.0])}
+
+
+def sketch_of(groups):
+    values = np.concatenate(list(groups.values()))
+    states = np.repeat(list(groups), [len(group) for group in groups.values()])
+    data = pd.DataFrame({'STATE' : states, 'STATE_FULL' : states, 'Region' : 'South', 'DISC_MONTH' : 1,
+                         'CAUSE' : 'Arson', 'FIRE_SIZE' : values, 'DURATION' : values})
+    return sketch_frame(data)
+
+
+def test_sketch_quantiles_within_the_accuracy():
+    # Bound of the sketch : a relative error of sketch_accuracy on the value of rank floor(q * (n - 1)),
+    # the values at or below sketch_min are read as 0
+    groups = sketch_groups()
+    quantiles = [0, 0.01, 0.25, 0.5, 0.75, 0.9, 0.99, 1]
+    table = sketch_quantiles(sketch_of(groups), ['STATE'], 'FIRE_SIZE', quantiles).set_index('STATE')
+    for state, values in groups.items():
+        values = np.sort(values)
+        assert table.loc[state, 'n'] == len(values)
+        for q in quantiles:
+            exact = values[int(np.floor(q * (len(values) - 1)))]
+            estimate = table.loc[state, 'P{:g}'.format(q * 100)]
+            if exact <= sketch_min:
+                assert estimate == 0, (state, q)
+            else :
+                assert abs(estimate - exact) <= sketch_accuracy * exact * (1 + 1e-9), (state, q)
+    # A single bin : every quantile is its middle
+    assert table.loc['CC', ['P0', 'P50', 'P100']].nunique() == 1
+
+
+def test_sketch_box_stats_within_the_accuracy():
+    groups = sketch_groups(1)
+    boxes = sketch_box_stats(sketch_of(groups), 'STATE', 'FIRE_SIZE')
+    for state, values in groups.items():
+        box, values = boxes[state], np.sort(values)
+        for stat, q in [('q1', 0.25), ('med', 0.5), ('q3', 0.75)]:
+            exact = values[int(np.floor(q * (len(values) - 1)))]
+            assert abs(box[stat] - exact) <= sketch_accuracy * exact * (1 + 1e-9), (state, stat)
+        # Whiskers and fliers are values of the group, within the accuracy
+        for value in [box['whislo'], box['whishi']] + list(box['fliers']):
+            assert np.min(np.abs(values - value) - sketch_accuracy * values) <= 1e-9, (state, value)
+        assert box['whislo'] <= box['q1'] <= box['med'] <= box['q3'] <= box['whishi']
+    # Mostly zeros : the box starts at 0. One bin or one value : a flat box without fliers
+    assert boxes['BB']['q1'] == boxes['BB']['med'] == boxes['BB']['whislo'] == 0
+    for state in ['CC', 'DD']:
+        box = boxes[state]
+        assert box['q1'] == box['q3'] == box['whislo'] == box['whishi'] and box['fliers'] == []
+
+
+def test_doy_density_against_gaussian_kde(fresh):
+    # The kernels of the Fourier product wrap around the padding of cut bandwidths : on the days
+    # of the year the densities are the sums of the kernels, a 1e-3 of the peak at the ends
+    data = load_prepared(fresh)
+    density = doy_density(data)
+    assert list(density.index) == sorted(data['DISC_YEAR'].unique())
+    for year, group in data.groupby('DISC_YEAR'):
+        curve = density.loc[year].dropna()
+        expected = stats.gaussian_kde(group['DISC_DOY'].values.astype('float64'))(curve.index.values.astype('float64'))
+        error = np.abs(curve.values - expected) / expected.max()
+        days = (curve.index >= 1) & (curve.index <= 366)
+        assert error[days].max() < 1e-8 and error.max() < 1e-3, year
+        assert abs(curve.sum() - 1) < 1e-3
+    # One fire, or fires of a single day : no density, as kdeplot
+    single = data.iloc[:3].assign(DISC_YEAR = np.int16(1900), DISC_DOY = np.int16(10))
+    assert doy_density(pd.concat([data, single])).loc[1900].isna().all()
+
+
+def test_grid_markers_of_a_state(fresh):
+    data = load_prepared(fresh)
+    rows = data[data['STATE_FULL'] == 'Texas'].reset_index(drop = True)
+    # Fires without position : not on the map, whatever the resolution
+    rows.loc[::50, 'lat'] = np.nan
+    rows.loc[::70, 'lon'] = np.nan
+    located = rows.dropna(subset = ['lat', 'lon'])
+    expected = located.groupby(['DISC_YEAR', 'CAUSE'], observed = True).agg(
+        FIRE_SIZE = ('FIRE_SIZE', 'sum'), count = ('FIRE_SIZE', 'size'))
+    for resolution in [None] + lod_resolutions:
+        markers = grid_aggregate(rows, resolution)
+        assert markers[['lat', 'lon']].notna().all().all(), resolution
+        totals = markers.groupby(['DISC_YEAR', 'CAUSE'], observed = True)[['FIRE_SIZE', 'count']].sum()
+        np.testing.assert_allclose(totals.reindex(expected.index).values, expected.values, rtol = 1e-5)
+        if resolution is not None:
+            # One marker per cell : coarser cells, fewer markers
+            assert len(markers) <= len(located)
+    assert len(grid_aggregate(rows, None)) == len(located)
+    counts = [len(grid_aggregate(rows, resolution)) for resolution in lod_resolutions]
+    assert counts == sorted(counts, reverse = True)
+    # The finest grid within the budget
+    budget = counts[2]
+    assert len(grid_aggregate(rows, 'auto', budget = budget)) == budget
+    assert len(grid_aggregate(rows, 'auto', budget = len(located))) == len(located)
+
+
+def test_grouped_ci_against_the_formula_and_a_loop(fresh):
+    data = load_prepared(fresh)
+    ci = grouped_ci(data, ['DISC_MONTH', 'CAUSE'], 'DURATION').set_index(['DISC_MONTH', 'CAUSE'])
+    grouped = data['DURATION'].astype('float64').groupby([data['DISC_MONTH'], data['CAUSE']], observed = True)
+    half = z_value(0.95) * grouped.std() / np.sqrt(grouped.count())
+    np.testing.assert_allclose(ci['DURATION'], grouped.mean(), rtol = 1e-9)
+    np.testing.assert_allclose(ci['DURATION_low'], grouped.mean() - half, rtol = 1e-9)
+    np.testing.assert_allclose(ci['DURATION_high'], grouped.mean() + half, rtol = 1e-9)
+    # The same intervals from the sums of the cube
+    cube = ci_of(aggregate_frame(data), ['DISC_MONTH', 'CAUSE'], 'DURATION')
+    np.testing.assert_allclose(cube[['DURATION', 'DURATION_low', 'DURATION_high']].values,
+        ci.reset_index()[['DURATION', 'DURATION_low', 'DURATION_high']].values, rtol = 1e-4)
+    # Bootstrap : the bounds of a loop of resamples by group, up to the noise of the draws
+    # (DURATION : the few huge fires of FIRE_SIZE make the upper bounds move with the seed)
+    rows = data[data['STATE_FULL'].isin(['Texas', 'California', 'Georgia'])]
+    boot = grouped_ci(rows, ['DISC_MONTH'], 'DURATION', method = 'bootstrap', n_boot = 2000, seed = 0)
+    rng = np.random.default_rng(1)
+    for (month, group), low, high in zip(rows.groupby('DISC_MONTH', observed = True),
+                                         boot['DURATION_low'], boot['DURATION_high']):
+        values = group['DURATION'].astype('float64').dropna().values
+        means = [rng.choice(values, len(values)).mean() for i in range(2000)]
+        bounds = np.percentile(means, [2.5, 97.5])
+        assert max(abs(bounds[0] - low), abs(bounds[1] - high)) <= 0.15 * (bounds[1] - bounds[0])
+    with pytest.raises(ValueError):
+        grouped_ci(rows, ['DISC_MONTH'], 'DURATION', method = 'jackknife')
@@ -0,0 +1,116 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import wildfires_data
+from wildfires_data import (load_prepared, source_fingerprint, read_cache, cache_paths, prepare_data,
+    date_format, sort_layout, RowLayout)
+
+needs_feather = pytest.mark.skipif(wildfires_data.feather is None, reason = 'the cache needs pyarrow')
+
+
+@pytest.fixture
+def copy(fresh, tmp_path):
+    # Copy of the csv of the tests, which the tests change
+    path = str(tmp_path / 'fires.csv')
+    with open(fresh, 'rb') as f, open(path, 'wb') as out:
+        out.write(f.read())
+    return path
+
+
+def parsed_only(monkeypatch):
+    # The csv can't be parsed any more : the frames come from the cache
+    def refused(source, typed = True):
+        raise AssertionError('the csv was parsed')
+    monkeypatch.setattr(wildfires_data, 'read_source', refused)
+
+
+@needs_feather
+def test_cache_is_read_until_the_csv_changes(copy, monkeypatch):
+    expected = load_prepared(copy, use_cache = False)
+    pd.testing.assert_frame_equal(load_prepared(copy), expected)
+    with monkeypatch.context() as patch:
+        parsed_only(patch)
+        pd.testing.assert_frame_equal(load_prepared(copy), expected)
+    # New rows : the key changes, the csv is parsed again and its entry replaces the old one
+    rows = pd.read_csv(copy, nrows = 10)
+    rows.to_csv(copy, mode = 'a', header = False, index = False)
+    data = load_prepared(copy)
+    assert len(data) == len(expected) + 10
+    paths = [os.path.basename(path) for path in cache_paths(source_fingerprint(copy))]
+    prefix = paths[0].split('.')[0]
+    assert sorted(name for name in os.listdir(wildfires_data.cache_dir) if name.startswith(prefix)) == sorted(paths)
+
+
+@needs_feather
+def test_cache_version_and_uploads(copy, monkeypatch):
+    load_prepared(copy)
+    # A new version of the preparation doesn't read the frames of the old one
+    monkeypatch.setattr(wildfires_data, 'cache_version', wildfires_data.cache_version + 1)
+    assert read_cache(source_fingerprint(copy)) is None
+    # An upload is keyed by its name and content
+    with open(copy, 'rb') as f:
+        upload = io.BytesIO(f.read())
+    upload.name = 'fires.csv'
+    data = load_prepared(upload)
+    with monkeypatch.context() as patch:
+        parsed_only(patch)
+        pd.testing.assert_frame_equal(load_prepared(upload), data)
+    other = io.BytesIO(upload.getvalue().replace(b'Texas', b'Texaz', 1))
+    other.name = 'fires.csv'
+    assert source_fingerprint(other)['sha1'] != source_fingerprint(upload)['sha1']
+    assert read_cache(source_fingerprint(other)) is None
+
+
+@needs_feather
+def test_edit_in_place_is_not_served_from_the_cache(copy):
+    source = copy
+    with open(source, 'rb') as f:
+        content = f.read()
+    stat = os.stat(source)
+    before = load_prepared(source)
+    # Same size and mtime, another discovery year for a fire : a new key, the csv is parsed again
+    start = content.index(b',2002-') + 1
+    with open(source, 'r+b') as f:
+        f.seek(start)
+        f.write(b'2003')
+    os.utime(source, ns = (stat.st_atime_ns, stat.st_mtime_ns))
+    assert os.stat(source).st_size == stat.st_size
+    assert read_cache(source_fingerprint(source)) is None
+    after = load_prepared(source)
+    years = [(frame['DISCOVERY_DATE'].dt.year == 2003).sum() for frame in [before, after]]
+    assert years[1] == years[0] + 1
+    pd.testing.assert_frame_equal(after, load_prepared(source, use_cache = False))
+
+
+def test_dates_are_parsed_with_their_format(fresh):
+    rows = pd.read_csv(fresh, nrows = 1000)
+    data = prepare_data(rows.copy())
+    assert data['DISCOVERY_DATE'].dtype == 'datetime64[ns]'
+    assert list(data['DISCOVERY_DATE'].dt.strftime(date_format)) == list(rows['DISCOVERY_DATE'])
+    # A csv with another format is refused, not parsed date by date
+    with pytest.raises(ValueError):
+        prepare_data(rows.assign(DISCOVERY_DATE = '02/02/2005'))
+
+
+def test_row_layout_against_the_filters(fresh):
+    data = load_prepared(fresh)
+    layout = RowLayout(data)
+    for state in ['Texas', 'California', 'Georgia']:
+        rows = layout.rows(state)
+        pd.testing.assert_frame_equal(rows, data[data['STATE_FULL'] == state])
+        # A slice of the frame, not a copy of its rows
+        assert np.shares_memory(rows['FIRE_SIZE'].values, data['FIRE_SIZE'].values)
+        for year in [1992, 2005, 2015]:
+            pd.testing.assert_frame_equal(layout.rows(state, year),
+                data[(data['STATE_FULL'] == state) & (data['DISC_YEAR'] == year)])
+    assert layout.rows('Atlantis').empty and layout.rows('Texas', 1800).empty
+    # The same rows in another order : refused, not sliced wrong
+    with pytest.raises(ValueError):
+        RowLayout(data.sample(frac = 1, random_state = 0))
+    resorted = RowLayout(sort_layout(data.sample(frac = 1, random_state = 0)))
+    assert resorted.years == layout.years
+    assert set(resorted.rows('Texas', 2005)['FPA_ID']) == set(layout.rows('Texas', 2005)['FPA_ID'])
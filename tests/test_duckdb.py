@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import wildfires_duckdb
+from wildfires_duckdb import DuckBackend, write_parquet, compare_backends
+
+pytestmark = pytest.mark.skipif(wildfires_duckdb.duckdb is None, reason = 'duckdb and pyarrow are not installed')
+
+
+@pytest.fixture
+def source(fresh, tmp_path):
+    # The first chunk of 3001 rows has no cause classification and no containment date : columns of
+    # missing values only, strings in the next chunks
+    path = str(tmp_path / 'fires.csv')
+    rows = pd.read_csv(fresh)
+    rows.loc[:3000, ['NWCG_CAUSE_CLASSIFICATION', 'CONT_DATE']] = np.nan
+    rows.to_csv(path, index = False)
+    return path
+
+
+def test_parquet_types_do_not_depend_on_the_first_chunk(source):
+    data_path, meta = write_parquet(source, chunk_size = 3001)
+    schema = wildfires_duckdb.pq.read_schema(data_path)
+    assert str(schema.field('NWCG_CAUSE_CLASSIFICATION').type) == 'string'
+    assert str(schema.field('CONT_DATE').type) == 'string'
+    assert str(schema.field('FIRE_SIZE').type) == 'float'
+    assert meta['rows'] == len(pd.read_csv(source))
+
+
+def test_duckdb_against_pandas(source):
+    write_parquet(source, chunk_size = 3001)
+    report = compare_backends(source, states = ['Texas', 'California', 'Alaska'])
+    assert report['cube cells equal'] and report['cube sums max relative error'] < 1e-9, report
+    assert report['sketch equal'], report
+    assert report['rollups compared'] > 0 and report['rollups different'] == [], report
+    assert report['states different'] == [], report
+    assert DuckBackend(source).grouped(['CAUSE'])['n'].sum() == len(pd.read_csv(source))
@@ -0,0 +1,135 @@
+import json
+import os
+import threading
+import time
+
+import matplotlib.pyplot as plt
+import pandas as pd
+import pytest
+
+import wildfires_figures
+
+from wildfires_benchmark import leak_check
+from wildfires_figures import render_figure, FigureCache, PlotlyCache, render_pool, drop_pool
+
+from conftest import test_state
+
+
+def test_render_closes_the_figure():
+    fig, ax = plt.subplots()
+    ax.plot([0, 1], [1, 0])
+    assert render_figure(fig).startswith(b'\x89PNG')
+    assert plt.get_fignums() == []
+
+
+def test_render_closes_the_figure_on_error():
+    fig, ax = plt.subplots()
+    with pytest.raises(ValueError):
+        render_figure(fig, format = 'unknown')
+    assert plt.get_fignums() == []
+
+
+def test_cached_chart_is_drawn_once():
+    cache = FigureCache(max_mb = 1)
+    calls = []
+
+    @cache.cached
+    def chart(values):
+        calls.append(values)
+        fig, ax = plt.subplots()
+        ax.plot(values)
+        return fig
+
+    assert chart([1, 2, 3]) == chart([1, 2, 3])
+    assert len(calls) == 1
+    assert plt.get_fignums() == []
+
+
+needs_plotly = pytest.mark.skipif(wildfires_figures.plotly is None, reason = 'plotly is not installed')
+
+
+def bar_chart(data, title = ''):
+    return wildfires_figures.go.Figure(wildfires_figures.go.Bar(x = data['x'], y = data['y']),
+                                       layout = {'title' : title})
+
+
+@needs_plotly
+def test_plotly_json_round_trip(tmp_path):
+    calls = []
+
+    def chart(data, title = ''):
+        calls.append(title)
+        return bar_chart(data, title)
+
+    data = pd.DataFrame({'x' : ['a', 'b', 'c'], 'y' : [1.5, 2, 3]})
+    cache = PlotlyCache(str(tmp_path), max_mb = 1)
+    fig = cache.cached(chart)(data, title = 'Fires')
+    again = cache.cached(chart)(data.copy(), title = 'Fires')
+    assert calls == ['Fires'] and json.loads(again.to_json()) == json.loads(fig.to_json())
+    # After a restart of the server : read from the file
+    restarted = PlotlyCache(str(tmp_path), max_mb = 1)
+    assert json.loads(restarted.cached(chart)(data, title = 'Fires').to_json()) == json.loads(fig.to_json())
+    assert calls == ['Fires'] and restarted.stats()['hits'] == 1
+    # Other values or arguments : drawn again
+    restarted.cached(chart)(data.assign(y = [1.5, 2, 4]), title = 'Fires')
+    restarted.cached(chart)(data, title = 'Other')
+    assert len(calls) == 3 and restarted.stats()['entries'] == 3
+
+
+@needs_plotly
+def test_plotly_cache_prunes_the_least_recently_used(tmp_path):
+    cache = PlotlyCache(str(tmp_path), max_mb = 1)
+    data = pd.DataFrame({'x' : range(2000), 'y' : range(2000)})
+    size = len(bar_chart(data).to_json())
+    cache.max_bytes = 3 * size + size // 2
+    keys = [('chart', i) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, bar_chart(data, str(i)))
+        os.utime(cache.path(key), (i, i))
+    # The first one is read : the second one is now the least recently used
+    assert cache.get(keys[0]) is not None
+    cache.put(('chart', 3), bar_chart(data, '3'))
+    assert [cache.get(key) is not None for key in keys] == [True, False, True]
+    assert cache.stats()['entries'] == 3
+    # A figure above the budget is kept alone, the last one written
+    cache.max_bytes = size // 2
+    cache.put(('chart', 4), bar_chart(data, '4'))
+    assert [os.path.basename(file[2]) for file in cache.files()] == [os.path.basename(cache.path(('chart', 4)))]
+
+
+def test_one_pool_for_concurrent_sessions(monkeypatch):
+    # Pools which take time to start : the sessions asking for one meanwhile wait for it
+    class SlowPool:
+        def __init__(self, *args, **kwargs):
+            time.sleep(0.05)
+            created.append(self)
+
+        def shutdown(self, wait = True):
+            pass
+
+    created, pools = [], []
+    monkeypatch.setattr(wildfires_figures, 'render_workers', 2)
+    monkeypatch.setattr(wildfires_figures, 'ProcessPoolExecutor', SlowPool)
+    monkeypatch.setattr(wildfires_figures, 'pool', None)
+    threads = [threading.Thread(target = lambda : pools.append(render_pool())) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1 and pools == created * 8
+    # A pool already replaced by another session is not dropped again
+    drop_pool(SlowPool())
+    assert render_pool() is created[0]
+    drop_pool(created[0])
+    assert render_pool() is created[-1] and len(created) == 3
+
+
+def test_reruns_leave_no_figure_and_flat_memory(fresh):
+    # The charts of the By State page are drawn again at each rerun (caches emptied)
+    reruns = 12
+    leak = leak_check(fresh, reruns = reruns, state = test_state)
+    assert 'error' not in leak, leak['error']
+    assert leak['open_figures'] == [0] * reruns
+    assert plt.get_fignums() == []
+    # Resident memory after the warm-up : bounded growth, as checked by leak_check
+    assert leak['ok'], leak['rss_MB']
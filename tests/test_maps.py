@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+import pytest
+
+from wildfires_benchmark import (HeadlessStreamlit, run_script, genre_label, state_label, map_label,
+    variable_label)
+from wildfires_views import views
+
+from conftest import test_state
+
+
+causes_label = 'Which causes to add :'
+frames_label, year_label = 'Frames :', 'Year :'
+
+
+def test_cause_map_sends_the_causes_shown(fresh):
+    st = HeadlessStreamlit()
+    choices = {genre_label : 'By State', state_label : test_state, map_label : 'All years'}
+    script = run_script(st, choices)
+    causes = script['causes_labels']
+    points = views.get('state_points', state = test_state)
+    df_sub = views.get('df_sub', state = test_state)
+    assert sum(len(records) for records in points['records']) == len(df_sub)
+    for shown in [causes, causes[:1], causes[1:3], []]:
+        layer = json.loads(script['cause_map'](points, shown, 2000).to_json())['layers'][0]
+        expected = df_sub['CAUSE'].isin(shown).sum()
+        assert len(layer['data']) == expected
+        assert {record['c'] for record in layer['data']} <= {causes.index(cause) for cause in shown}
+    # The page sends a smaller deck when a cause is toggled off
+    full = st.payloads
+    run_script(st, dict(choices, **{causes_label : causes[:1]}))
+    assert sum(st.payloads) < sum(full)
+
+
+@pytest.mark.parametrize('variable, node, column, decimals', [
+    ('Number of wildfires', 'map_fires_year', 'Number of fires', 0),
+    ('Surface of wildfires', 'map_surf_year', 'Total burnt area (ha)', 1),
+    ('Duration of wildfires', 'map_duration_year', 'Avg duration of a fire (days)', 2)])
+def test_year_maps_send_the_year_selected(fresh, variable, node, column, decimals):
+    st = HeadlessStreamlit()
+    choices = {genre_label : 'Global', variable_label : variable, map_label : 'Year by year'}
+    run_script(st, dict(choices, **{frames_label : 'Animation'}))
+    animation = views.get(node, map_year = None)
+    years = views.get('fires_years')
+    assert [int(frame.name) for frame in animation.frames] == years
+    year = years[len(years) // 2]
+    run_script(st, dict(choices, **{year_label : year}))
+    fig = views.get(node, map_year = year)
+    # One choropleth of the year, without frames, then the labels of the states once each
+    assert len(fig.frames) == 0 and len(fig.data) == 2
+    frame = [f for f in animation.frames if int(f.name) == year][0]
+    assert list(fig.data[0].locations) == list(frame.data[0].locations)
+    z = np.asarray(fig.data[0].z, dtype = 'float64')
+    np.testing.assert_allclose(z, np.asarray(frame.data[0].z, dtype = 'float64'))
+    np.testing.assert_array_equal(z, np.round(z, decimals))
+    labels = list(fig.data[1].text)
+    assert len(labels) == len(set(labels))
+    # The figure of the page is the one of the year
+    assert len(fig.to_json()) in st.payloads and len(fig.to_json()) * 3 < len(animation.to_json())
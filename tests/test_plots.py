@@ -0,0 +1,36 @@
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib import cbook
+
+from wildfires_benchmark import HeadlessStreamlit, run_script
+from wildfires_data import load_prepared
+from wildfires_plots import box_stats, make_countplot_from_counts, levels_of
+from wildfires_views import views
+
+
+def test_box_stats_against_matplotlib(fresh):
+    data = load_prepared(fresh)
+    counts = data.groupby(['DISC_YEAR', 'DISC_MONTH'], as_index = False, observed = True).agg({'STATE' : 'count'})
+    for frame, x, y in [(counts, 'DISC_MONTH', 'STATE'), (data, 'CAUSE', 'DURATION')]:
+        stats = box_stats(frame.dropna(subset = [y]), x, y)
+        for key, group in frame.dropna(subset = [y]).groupby(x, observed = True):
+            expected = cbook.boxplot_stats(group[y].astype('float64').values)[0]
+            actual = stats[key]
+            for name in ['q1', 'med', 'q3', 'whislo', 'whishi']:
+                np.testing.assert_allclose(actual[name], expected[name], rtol = 1e-6)
+            np.testing.assert_allclose(np.sort(actual['fliers']), np.sort(expected['fliers']), rtol = 1e-6)
+
+
+def test_counts_of_the_cube_against_the_rows(fresh):
+    # The bars drawn from the roll-ups of the cube : the counts of the rows
+    run_script(HeadlessStreamlit())
+    data = load_prepared(fresh)
+    for node, x in [('fires_year_count', 'DISC_YEAR'), ('size_class_count', 'FIRE_SIZE_CLASS'),
+                    ('causes_count', 'CAUSE')]:
+        counts = views.get(node)
+        expected = data[x].value_counts()
+        assert dict(zip(counts[x], counts['count'])) == {key : n for key, n in expected.items() if n}
+        fig = make_countplot_from_counts(counts, x)
+        heights = [bar.get_height() for bar in fig.axes[0].patches]
+        plt.close(fig)
+        assert heights == [expected.get(key, 0) for key in levels_of(counts[x])]
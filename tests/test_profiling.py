@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+
+import pytest
+
+from wildfires_benchmark import HeadlessStreamlit, run_script, genre_label, state_label, map_label, cause_label
+from wildfires_profiling import Profiler, profiler, no_span
+
+from conftest import test_state
+
+
+def test_spans_are_off_by_default():
+    tracer = Profiler()
+    assert not tracer.start_rerun(False)
+    assert tracer.span('load') is no_span
+    with tracer.span('load'):
+        pass
+    assert tracer.end_rerun() is None and tracer.breakdown() == []
+    assert json.loads(tracer.chrome_trace())['traceEvents'] == []
+
+
+def test_nested_spans_and_their_trace(tmp_path):
+    tracer = Profiler()
+
+    @tracer.traced(category = 'chart')
+    def draw():
+        time.sleep(0.02)
+
+    assert tracer.start_rerun(True, label = 'page')
+    with tracer.span('node', 'node'):
+        time.sleep(0.01)
+        draw()
+        draw()
+    with pytest.raises(KeyError):
+        with tracer.span('failed'):
+            raise KeyError('STATE')
+    rerun = tracer.end_rerun()
+    spans = {span['name'] : span for span in rerun['spans']}
+    assert [span['name'] for span in rerun['spans']] == ['draw', 'draw', 'node', 'failed']
+    # The time of a span itself excludes the time of its children
+    node = spans['node']
+    assert node['depth'] == 0 and spans['draw']['depth'] == 1
+    children = sum(span['duration'] for span in rerun['spans'] if span['name'] == 'draw')
+    assert node['self'] == pytest.approx(node['duration'] - children)
+    assert children >= 40e3 and node['self'] >= 10e3
+    assert spans['failed']['error'] == repr(KeyError('STATE'))
+    rows = {row['span'] : row for row in tracer.breakdown(rerun)}
+    assert rows['draw']['calls'] == 2 and rows['draw']['category'] == 'chart'
+    assert rows['node']['total ms'] >= rows['draw']['total ms']
+    # Chrome trace : one complete event by rerun and by span, the spans within their rerun
+    with open(tracer.write_trace(str(tmp_path / 'trace.json'))) as f:
+        events = json.load(f)['traceEvents']
+    assert [event['name'] for event in events] == ['page', 'draw', 'draw', 'node', 'failed']
+    assert all(event['ph'] == 'X' and event['tid'] == threading.get_ident() for event in events)
+    page = events[0]
+    for event in events[1:]:
+        assert page['ts'] <= event['ts'] and event['ts'] + event['dur'] <= page['ts'] + page['dur']
+    assert events[-1]['args']['error'] == repr(KeyError('STATE'))
+
+
+def test_reruns_of_each_session():
+    tracer = Profiler(max_reruns = 3)
+    labels = {}
+
+    def session(i):
+        tracer.start_rerun(True, label = 'session {}'.format(i))
+        with tracer.span('work {}'.format(i)):
+            pass
+        tracer.end_rerun()
+        labels[i] = tracer.last_rerun()['label']
+
+    threads = [threading.Thread(target = session, args = (i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+        thread.join()
+    # Each session finds its own rerun, the trace keeps the last ones
+    assert labels == {i : 'session {}'.format(i) for i in range(5)}
+    events = json.loads(tracer.chrome_trace())['traceEvents']
+    assert [event['name'] for event in events if event['cat'] == 'rerun'] == ['session 2', 'session 3', 'session 4']
+
+
+def test_profiled_page(fresh):
+    # ?profile=1 : the data, the nodes of the view graph and the outputs of the page are spans
+    st = HeadlessStreamlit()
+    st.experimental_get_query_params = lambda : {'profile' : ['1']}
+    run_script(st, {genre_label : 'By State', state_label : test_state, map_label : 'All years',
+                    cause_label : 'No'})
+    rerun = profiler.last_rerun()
+    assert rerun is not None and rerun['end'] is not None
+    categories = {span['name'] : span['category'] for span in rerun['spans']}
+    assert categories['load_dataset'] == 'data'
+    assert categories['df_sub'] == 'node' and categories['state_charts'] == 'node'
+    assert 'output' in categories.values()
+    names = {event['name'] for event in json.loads(profiler.chrome_trace())['traceEvents']}
+    assert {'load_dataset', 'df_sub', 'state_charts'} <= names
+    # The next runs without the parameter are not profiled
+    run_script(HeadlessStreamlit(), {genre_label : 'Regional'})
+    assert not profiler.active() and profiler.last_rerun() is rerun
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from wildfires_benchmark import (HeadlessStreamlit, run_script, genre_label, state_label, map_label,
+    cause_label)
+from wildfires_registry import datasets, freeze
+from wildfires_views import views, value_size
+
+from conftest import test_state
+
+
+def test_frozen_frame_is_read_only(fresh):
+    data = datasets.get(fresh).data
+    with pytest.raises(ValueError):
+        data['FIRE_SIZE'].values[0] = 0
+    for col in ['DISC_YEAR', 'DISCOVERY_DATE', 'FPA_ID']:
+        assert not np.asarray(data[col]).flags.writeable, col
+    with pytest.raises(ValueError):
+        data.loc[0, 'CAUSE'] = data['CAUSE'].cat.categories[-1]
+    # The object columns are measured without writing to their arrays
+    assert value_size(data) > data.memory_usage().sum()
+
+
+def test_freeze_fails_closed(fresh):
+    # A frame whose arrays can't be reached is not handed out writable
+    class Unknown:
+        pass
+
+    data = datasets.get(fresh).data.copy(deep = False)
+    data._mgr.blocks[0].values = Unknown()
+    with pytest.raises(TypeError):
+        freeze(data)
+
+
+@pytest.mark.parametrize('map_type', ['Year by year', 'All years'])
+def test_state_page_on_frozen_frame(fresh, map_type):
+    # The nodes of the state (df_sub, state_doy_density, state_points) are memoized from slices of
+    # the frozen frame of the registry
+    st = HeadlessStreamlit()
+    run_script(st, {genre_label : 'By State', state_label : test_state, map_label : map_type,
+                    cause_label : 'Yes'})
+    assert st.payloads
+    df_sub = views.get('df_sub', state = test_state)
+    assert len(df_sub) and np.all(df_sub['STATE_FULL'] == test_state)
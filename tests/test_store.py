@@ -0,0 +1,98 @@
+import os
+import shutil
+import threading
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import wildfires_store
+from wildfires_data import load_prepared
+from wildfires_store import attach, publish, prune, versions, store_name, read_current, pin_version
+
+pytestmark = pytest.mark.skipif(wildfires_store.pa is None or wildfires_store.fcntl is None,
+                                reason = 'the store needs pyarrow and a posix system')
+
+
+@pytest.fixture
+def store(fresh, tmp_path, monkeypatch):
+    # Empty store, and a copy of the csv with missing durations (NaN in a float column)
+    monkeypatch.setattr(wildfires_store, 'store_dir', str(tmp_path / 'store'))
+    monkeypatch.setattr(wildfires_store, 'attached', {})
+    monkeypatch.setattr(wildfires_store, 'checked', {})
+    source = str(tmp_path / 'fires.csv')
+    rows = pd.read_csv(fresh)
+    rows.loc[::7, 'DURATION'] = np.nan
+    rows.to_csv(source, index = False)
+    yield source
+    for entry in wildfires_store.attached.values():
+        entry[4].close()
+
+
+def test_attach_publishes_then_maps_read_only(store):
+    data, cube, sketch, token = attach(store)
+    assert len(versions(store_name(store))) == 1
+    expected = load_prepared(store)
+    pd.testing.assert_frame_equal(data, expected)
+    # The numbers, NaN included, are the pages of the file : read-only, not copied by to_pandas
+    assert data['DURATION'].isna().any()
+    for col in ['DURATION', 'FIRE_SIZE', 'DISC_YEAR', 'DISCOVERY_DATE']:
+        assert not data[col].values.flags.writeable, col
+    with pytest.raises(ValueError):
+        data['DURATION'].values[0] = 0
+    # The next reruns map nothing again
+    assert attach(store)[0] is data and attach(store)[3] == token
+
+
+def test_attach_publishes_once_for_concurrent_sessions(store):
+    results = []
+    threads = [threading.Thread(target = lambda : results.append(attach(store)[3])) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(results)) == 1
+    assert len(versions(store_name(store))) == 1
+
+
+def test_attach_publishes_once_for_concurrent_processes(store):
+    # Processes starting on an empty store : one publication, mapped by all of them
+    code = ('import sys, wildfires_store; wildfires_store.store_dir = sys.argv[1]; '
+            'print(wildfires_store.attach(sys.argv[2])[3][2])')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH = root, WILDFIRES_CACHE_DIR = os.path.join(os.path.dirname(store), 'cache'))
+    processes = [subprocess.Popen([sys.executable, '-W', 'ignore', '-c', code, wildfires_store.store_dir, store],
+                                  stdout = subprocess.PIPE, env = env) for i in range(3)]
+    outputs = [process.communicate(timeout = 300)[0].decode().strip() for process in processes]
+    assert all(process.returncode == 0 for process in processes)
+    assert len(set(outputs)) == 1
+    assert versions(store_name(store)) == [outputs[0]]
+
+
+def test_changed_source_is_published_again(store):
+    version = attach(store)[3][2]
+    # Same content, new mtime : hashed once, still the current version
+    os.utime(store, ns = (1, 1))
+    assert attach(store)[3][2] == version
+    rows = pd.read_csv(store)
+    rows.iloc[:100].to_csv(store, mode = 'a', header = False, index = False)
+    data, cube, sketch, token = attach(store)
+    assert token[2] != version and len(data) == len(rows) + 100
+    assert read_current(store_name(store))['version'] == token[2]
+
+
+def test_prune_spares_the_mapped_versions(store):
+    name = store_name(store)
+    first = publish(store)['version']
+    # Another process maps the first version
+    pinned = pin_version(name, first)
+    later = [publish(store)['version'] for i in range(3)]
+    # The first one is mapped, the second one is removed, the last two ones are kept
+    assert versions(name) == [first] + later[1:]
+    pinned.close()
+    assert prune(name) == 3
+    assert first not in versions(name)
+    assert len(versions(name)) == wildfires_store.store_versions
+    assert read_current(name)['version'] in versions(name)
@@ -0,0 +1,738 @@
+# Aggregate cube of the wildfires data used by the plots of the dashboard.
+# The rows are folded into tables of counts, sums, sums of squares, min and max per cell, one by
+# family of views (see cube_families), the frames of the plots are roll-ups of these tables. The
+# statistics drawn by the charts (confidence intervals, densities, markers of the maps) are
+# computed here too.
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+try:
+    import polars as pl
+except ImportError: # The aggregates are computed by pandas only
+    pl = None
+
+from wildfires_data import (read_source, read_chunks, prepare_data, sort_layout, load_prepared,
+    source_fingerprint, content_digest, read_cache, write_cache, append_source, append_fingerprint, append_prepared,
+    frame_checksum, Pinned)
+
+
+agg_keys = ['DISC_YEAR', 'DISC_MONTH', 'DISC_DOW', 'STATE', 'STATE_FULL', 'Region',
+    'CAUSE', 'NWCG_GENERAL_CAUSE', 'FIRE_SIZE_CLASS']
+# Keys of the cells of each family of views. One cube of all the keys has almost a cell by fire
+# (1,064,494 cells for the 2,166,369 rows of the full dataset) : the cube is the union of the
+# cubes of the families (about 29,000 cells), its column family is the index of the family of
+# a cell. The keys of the other families are missing (NaN, -1 for the numbers). A roll-up is made
+# from the smallest family having all its keys
+cube_families = [
+    ['DISC_YEAR', 'DISC_MONTH', 'CAUSE', 'NWCG_GENERAL_CAUSE'],   # Calendar of the causes
+    ['DISC_YEAR', 'DISC_DOW', 'CAUSE'],                           # Days of the week
+    ['DISC_YEAR', 'STATE', 'STATE_FULL', 'Region', 'CAUSE'],      # States and regions by year
+    ['DISC_YEAR', 'DISC_MONTH', 'STATE', 'STATE_FULL'],           # States by month
+    ['CAUSE', 'FIRE_SIZE_CLASS']]                                 # Size classes
+missing_key = -1
+agg_values = ['FIRE_SIZE', 'DURATION', 'lat', 'lon']
+# Squares are only needed for the standard deviations, extrema for the ranges of the plots
+agg_squares = ['FIRE_SIZE', 'DURATION']
+agg_extrema = ['FIRE_SIZE', 'DURATION']
+# How each column of the cube is combined when cells are merged
+agg_functions = dict([('n', 'sum')] + [(col, 'sum') for col in agg_values] +
+    [(col + '_sq', 'sum') for col in agg_squares] +
+    [(col + '_min', 'min') for col in agg_extrema] + [(col + '_max', 'max') for col in agg_extrema])
+# pandas, or polars (multi-threaded, see POLARS_MAX_THREADS) for the folding and the roll-ups
+aggregate_engine = os.environ.get('WILDFIRES_ENGINE', 'pandas')
+
+
+# ------------------------------------------
+# ---------------------------- Folding of the rows
+# ------------------------------------------
+def family_cube(parts, reference):
+    # Cubes of the families in one frame : the keys of the other families are missing. Each key has
+    # the type of the reference frame (rows or cells) in every part, before the concat : a key
+    # missing from a part (all NA) then has the type of the other parts
+    for family, part in enumerate(parts):
+        for col in agg_keys:
+            if col not in cube_families[family]:
+                part[col] = missing_key if reference[col].dtype.kind in 'iu' else np.nan
+            part[col] = part[col].astype(reference[col].dtype)
+        part.insert(0, 'family', np.int8(family))
+    return pd.concat(parts, ignore_index = True)[['family'] + agg_keys + list(agg_functions)]
+
+
+def aggregate_frame(data):
+    # Sums are accumulated in float64, whatever the type of the columns
+    if polars_enabled():
+        return family_cube([polars_aggregate(data, keys, from_rows = True) for keys in cube_families], data)
+    values = data[agg_values].astype('float64')
+    for col in agg_squares:
+        values[col + '_sq'] = values[col] ** 2
+    for col in agg_extrema:
+        values[col + '_min'] = values[col]
+        values[col + '_max'] = values[col]
+    values['n'] = 1
+    values[agg_keys] = data[agg_keys]
+    return family_cube([values.groupby(keys, as_index = False, observed = True).agg(agg_functions)
+                        for keys in cube_families], data)
+
+
+def family_cells(agg, family):
+    return agg[agg['family'].values == family]
+
+
+def merge_aggregates(agg1, agg2):
+    # The chunks don't share their categories : the keys are merged as strings then typed again
+    agg = pd.concat([agg1, agg2], ignore_index = True)
+    return family_cube([family_cells(agg, family).groupby(keys, as_index = False, observed = True).agg(agg_functions)
+                        for family, keys in enumerate(cube_families)], agg)
+
+
+def type_keys(agg, keys = agg_keys):
+    # Same types as the prepared frame (see wildfires_data.prepare_data)
+    for col in keys:
+        if agg[col].dtype.kind in 'iu':
+            agg[col] = agg[col].astype('int16' if col == 'DISC_YEAR' else 'int8')
+        else :
+            agg[col] = pd.Categorical(agg[col], categories = sorted(agg[col].dropna().unique()), ordered = True)
+    return agg
+
+
+def stream_aggregates(source, chunk_size = 250000, progress = None, sketches = False):
+    # Peak memory depends on chunk_size and on the number of groups, not on the size of the file.
+    # sketches : the quantile sketches are folded in the same pass, (cube, sketch) is returned
+    agg, sketch = None, None
+    rows = 0
+    for chunk in read_chunks(source, chunk_size):
+        chunk_agg = aggregate_frame(chunk)
+        agg = chunk_agg if agg is None else merge_aggregates(agg, chunk_agg)
+        if sketches:
+            chunk_sketch = sketch_frame(chunk)
+            sketch = chunk_sketch if sketch is None else merge_sketches(sketch, chunk_sketch)
+        rows += len(chunk)
+        if progress:
+            progress(rows)
+    if sketches:
+        return type_keys(agg), type_keys(sketch, sketch_keys)
+    return type_keys(agg)
+
+
+def materialize_cube(source, fingerprint = None, data = None):
+    # The cube is stored next to the cached frame, with the same key (see wildfires_data).
+    # data : prepared frame of the source, when it is already loaded
+    fingerprint = fingerprint or source_fingerprint(source)
+    cube = read_cache(fingerprint, kind = 'cube')
+    if cube is None:
+        cube = aggregate_frame(data if data is not None else load_prepared(source, fingerprint = fingerprint))
+        write_cache(fingerprint, cube, kind = 'cube')
+    return cube
+
+
+# ------------------------------------------
+# ---------------------------- Polars engine
+# ------------------------------------------
+# The groupbys of the folding and of the roll-ups as lazy polars queries, run on all the cores
+# (WILDFIRES_ENGINE=polars). The results are pandas frames with the types of the pandas path :
+# the plots and the view graph don't change
+def polars_enabled():
+    return aggregate_engine == 'polars' and pl is not None
+
+
+def polars_frame(data, keys, columns):
+    # The category keys are passed as their codes : the categories are sorted, so the order of the
+    # codes is the order of pandas. The other columns are numpy arrays, not copied by polars
+    arrays = {}
+    for col in keys:
+        arrays[col] = data[col].cat.codes.values if hasattr(data[col], 'cat') else data[col].values
+    for col in columns:
+        arrays[col] = data[col].values
+    return pl.DataFrame(arrays)
+
+
+def polars_expressions(keys, columns, from_rows):
+    # Columns of the cube : from the rows (sums, squares and extrema of agg_values, count of the rows)
+    # or from the cells of a cube (agg_functions)
+    expressions = []
+    for col, function in agg_functions.items():
+        if from_rows:
+            if col == 'n':
+                expressions.append(pl.col(keys[0]).count().cast(pl.Int64).alias('n'))
+                continue
+            value = pl.col(col.rsplit('_', 1)[0] if col.endswith(('_sq', '_min', '_max')) else col).cast(pl.Float64)
+            if col.endswith('_sq'):
+                expressions.append((value * value).sum().alias(col))
+            else :
+                expressions.append(getattr(value, function)().alias(col))
+        elif col in columns:
+            expressions.append(getattr(pl.col(col), function)().alias(col))
+    return expressions
+
+
+def polars_aggregate(data, keys, from_rows = False):
+    columns = agg_values if from_rows else [col for col in agg_functions if col in data.columns]
+    lazy = polars_frame(data, keys, columns).lazy()
+    # Missing categories (code -1) are in no group, as with observed = True
+    for col in keys:
+        if hasattr(data[col], 'cat'):
+            lazy = lazy.filter(pl.col(col) >= 0)
+    group_by = getattr(lazy, 'group_by', None) or lazy.groupby
+    result = (group_by(keys).agg(polars_expressions(keys, columns, from_rows)).sort(keys)
+              .select(keys + [col for col in agg_functions if from_rows or col in columns]).collect())
+    # Conversion to pandas, the categories of the keys are the ones of the data
+    rolled = pd.DataFrame({col : result[col].to_numpy() for col in result.columns})
+    for col in keys:
+        if hasattr(data[col], 'cat'):
+            rolled[col] = pd.Categorical.from_codes(rolled[col], categories = data[col].cat.categories,
+                                                    ordered = data[col].cat.ordered)
+        else :
+            rolled[col] = rolled[col].astype(data[col].dtype)
+    return rolled
+
+
+def compare_engines(data):
+    # Cube and roll-ups of the polars engine against the ones of pandas : same cells, counts and
+    # extrema, sums up to the order of the additions
+    global aggregate_engine
+    engine = aggregate_engine
+    rollup_keys = [['DISC_YEAR'], ['DISC_MONTH', 'CAUSE'], ['STATE_FULL', 'DISC_YEAR'],
+                   ['FIRE_SIZE_CLASS', 'CAUSE'], ['DISC_YEAR', 'Region']]
+    try:
+        aggregate_engine = 'pandas'
+        expected = aggregate_frame(data)
+        expected_rollups = [family_cells(expected, rollup_family(expected, keys)).groupby(
+            keys, as_index = False, observed = True).agg(agg_functions) for keys in rollup_keys]
+        aggregate_engine = 'polars'
+        cube = aggregate_frame(data)
+        rollups = [polars_aggregate(family_cells(cube, rollup_family(cube, keys)), keys) for keys in rollup_keys]
+    finally:
+        aggregate_engine = engine
+    report = {'equal' : True, 'sums max relative error' : 0.0}
+    sums = [col for col, function in agg_functions.items() if function == 'sum' and col != 'n']
+    for expected_frame, frame in zip([expected] + expected_rollups, [cube] + rollups):
+        if cube_checksum(frame) != cube_checksum(expected_frame):
+            report['equal'] = False
+            continue
+        values = expected_frame[sums].values
+        error = (np.abs(frame[sums].values - values) / np.maximum(np.abs(values), 1)).max(initial = 0)
+        report['sums max relative error'] = max(report['sums max relative error'], float(error))
+    report['equal'] = report['equal'] and report['sums max relative error'] < 1e-9
+    return report
+
+
+# ------------------------------------------
+# ---------------------------- Appending new records
+# ------------------------------------------
+# The cells of the cube are sums, so the cube of the csv with a delta file is the merge of the cube
+# of the csv and the cube of the delta, as are the counts of the quantile sketches. The roll-ups
+# (counts, means and variances by year, crosstabs, series of the regions) are computed again from
+# the new cube by the dashboard
+def append_records(source, delta, verify = False):
+    # The delta is parsed and folded alone, then added to the csv and to its cached frame, cube and
+    # sketches.
+    # verify : compare with a full rebuild of the csv (the cost of a complete load)
+    # The csv is read once, by the hash of its content
+    digest = content_digest(source)[0]
+    fingerprint = source_fingerprint(source, digest.copy())
+    data = load_prepared(source, fingerprint = fingerprint)
+    cube = materialize_cube(source, fingerprint = fingerprint, data = data)
+    sketch = materialize_sketch(source, fingerprint = fingerprint, data = data)
+    new_data = prepare_data(read_source(delta))
+    data = append_prepared(data, new_data)
+    cube = type_keys(merge_aggregates(cube, aggregate_frame(new_data)))
+    sketch = type_keys(merge_sketches(sketch, sketch_frame(new_data)), sketch_keys)
+    # The csv is changed first : if the cache can't be written, the next load parses the new csv
+    fingerprint = append_fingerprint(source, digest, append_source(source, delta))
+    write_cache(fingerprint, data)
+    write_cache(fingerprint, cube, kind = 'cube')
+    write_cache(fingerprint, sketch, kind = 'sketch')
+    report = {'rows' : len(data), 'new rows' : len(new_data), 'cells' : len(cube),
+              'sketch bins' : len(sketch), 'checksum' : frame_checksum(data)}
+    if verify:
+        report.update(compare_rebuild(source, data, cube, sketch))
+    return data, cube, report
+
+
+def cube_checksum(cube):
+    # Keys, counts and extrema of the cells : the sums depend on the order of the additions
+    exact = [col for col in cube.columns if col in agg_keys or col in ('family', 'n') or col.endswith(('_min', '_max'))]
+    return frame_checksum(cube[exact])
+
+
+def sketch_checksum(sketch):
+    # Bins in the order of the keys as text : the categories of the merged sketches are the ones seen
+    rows = sketch.astype({col : str for col in sketch_keys}).sort_values(sketch_keys + ['bin'])
+    return frame_checksum(rows.reset_index(drop = True))
+
+
+def compare_rebuild(source, data, cube, sketch):
+    rebuilt = sort_layout(prepare_data(read_source(source)))
+    rebuilt_cube = aggregate_frame(rebuilt)
+    rebuilt_sketch = sketch_frame(rebuilt)
+    sums = [col for col in cube.columns if agg_functions.get(col) == 'sum' and col != 'n']
+    error = np.abs(cube[sums].values - rebuilt_cube[sums].values) / np.maximum(np.abs(rebuilt_cube[sums].values), 1)
+    return {'rebuild checksum' : frame_checksum(rebuilt),
+            'data equal' : frame_checksum(data) == frame_checksum(rebuilt),
+            'cube equal' : cube_checksum(cube) == cube_checksum(rebuilt_cube) and float(error.max(initial = 0)) < 1e-9,
+            'cube sums max relative error' : float(error.max(initial = 0)),
+            'sketch equal' : sketch_checksum(sketch) == sketch_checksum(rebuilt_sketch)}
+
+
+# ------------------------------------------
+# ---------------------------- Roll-ups
+# ------------------------------------------
+# Last roll-ups computed, by (cube, keys) : a rerun of the dashboard gets them without any groupby.
+# Shared by the sessions (one thread each) : read and changed under rollup_lock
+rollup_cache = OrderedDict()
+rollup_cache_size = 256
+rollup_lock = threading.Lock()
+
+
+def rollup_family(agg, keys):
+    # Smallest family of the cube with all the keys
+    sizes = np.bincount(agg['family'].values, minlength = len(cube_families))
+    found = [family for family, family_keys in enumerate(cube_families) if set(keys) <= set(family_keys)]
+    if not found:
+        raise ValueError('No family of the cube has the keys {}'.format(list(keys)))
+    return min(found, key = lambda family : sizes[family])
+
+
+def rollup(agg, keys):
+    # agg : cube (the cells of one family are grouped) or quantile sketches
+    key = (Pinned(agg), tuple(keys))
+    with rollup_lock:
+        if key in rollup_cache:
+            rollup_cache.move_to_end(key)
+            return rollup_cache[key].copy()
+    # The groupby runs outside the lock : two sessions may compute the same roll-up, not wait for it
+    cells = family_cells(agg, rollup_family(agg, keys)) if 'family' in agg.columns else agg
+    if polars_enabled():
+        rolled = polars_aggregate(cells, keys)
+    else :
+        rolled = cells.groupby(keys, as_index = False, observed = True).agg(
+            {col : func for col, func in agg_functions.items() if col in cells.columns})
+    with rollup_lock:
+        rollup_cache[key] = rolled
+        rollup_cache.move_to_end(key)
+        if len(rollup_cache) > rollup_cache_size:
+            rollup_cache.popitem(last = False)
+    return rolled.copy()
+
+
+def clear_rollups():
+    with rollup_lock:
+        rollup_cache.clear()
+
+
+def count_of(agg, keys, name = 'count'):
+    rolled = rollup(agg, keys)
+    return rolled[keys + ['n']].rename(columns = {'n' : name})
+
+
+def sum_of(agg, keys, col):
+    return rollup(agg, keys)[keys + [col]]
+
+
+def mean_of(agg, keys, col):
+    rolled = rollup(agg, keys)
+    rolled[col] = rolled[col] / rolled['n']
+    return rolled[keys + [col]]
+
+
+def min_max_of(agg, keys, col):
+    return rollup(agg, keys)[keys + [col + '_min', col + '_max']]
+
+
+def stats_of(agg, keys, col):
+    # Mean, standard deviation (ddof = 1, as pandas) and count of col
+    rolled = rollup(agg, keys)
+    n = rolled['n']
+    var = (rolled[col + '_sq'] - rolled[col] ** 2 / n) / (n - 1)
+    rolled[col + '_mean'] = rolled[col] / n
+    rolled[col + '_std'] = np.sqrt(var.clip(lower = 0)).where(n > 1)
+    rolled[col + '_count'] = n
+    return rolled[keys + [col + '_mean', col + '_std', col + '_count']]
+
+
+def crosstab_of(agg, index, columns):
+    # Same output as pd.crosstab on the rows : combinations without fires are 0
+    rolled = rollup(agg, [index, columns])
+    ct = rolled.pivot(index = index, columns = columns, values = 'n').fillna(0).astype('int64')
+    ct.columns = ct.columns.astype(str)
+    ct.columns.name = columns
+    return ct
+
+
+def for_state(frame, state):
+    # Rows of one state in a roll-up made by STATE_FULL
+    return frame[frame.STATE_FULL == state].drop(columns = 'STATE_FULL').reset_index(drop = True)
+
+
+# ------------------------------------------
+# ---------------------------- Quantile sketches
+# ------------------------------------------
+# Distributions of FIRE_SIZE and DURATION by state, month and cause, as counts of the values in
+# logarithmic bins : the bin of a value v is ceil(log(v) / log(gamma)), gamma = (1 + a) / (1 - a),
+# and any value of a bin is within a relative error a of its middle. The values at or below
+# sketch_min (durations of 0 days) are in one bin, of value 0. The counts of two sketches add up,
+# so a sketch is merged by the roll-ups of the cube (sums of the counts by key and bin) : across
+# states, months or causes, by chunks of a file, or with the rows of a delta file. The quartiles,
+# whiskers and percentiles then come from the bins, not from a sort of the rows.
+sketch_keys = ['STATE', 'STATE_FULL', 'Region', 'DISC_MONTH', 'CAUSE']
+sketch_values = ['FIRE_SIZE', 'DURATION']
+sketch_accuracy = float(os.environ.get('WILDFIRES_SKETCH_ACCURACY', 0.01))
+sketch_min = 1e-6
+sketch_gamma = (1 + sketch_accuracy) / (1 - sketch_accuracy)
+# The bins are int32 : with a = 1%, the bin of the largest float64 is about 35,500, above the
+# range of int16. The accuracy is checked so that the bins of all the finite values fit
+zero_bin = np.iinfo(np.int32).min
+if not 0 < sketch_accuracy < 1 or np.log(np.finfo(np.float64).max) / np.log(sketch_gamma) >= np.iinfo(np.int32).max:
+    raise ValueError('WILDFIRES_SKETCH_ACCURACY must be between 2e-7 and 1, got {}'.format(sketch_accuracy))
+
+
+def sketch_bins(values):
+    # Bins of the values (finite float64, without NaN)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        bins = np.ceil(np.log(values) / np.log(sketch_gamma))
+    return np.where(values > sketch_min, bins, zero_bin).astype(np.int32)
+
+
+def bin_values(bins):
+    # Middle of the bins (within a relative error a of all their values)
+    values = np.exp(bins.astype('float64') * np.log(sketch_gamma) + np.log(2 / (sketch_gamma + 1)))
+    return np.where(bins == zero_bin, 0, values)
+
+
+def sketch_frame(data):
+    # Sketches of the rows : one row per key and bin, the columns of sketch_values are the numbers
+    # of values of this column in the bin
+    parts = []
+    for col in sketch_values:
+        values = data[col].values.astype('float64')
+        kept = ~np.isnan(values)
+        part = data.loc[kept, sketch_keys].reset_index(drop = True)
+        part['bin'] = sketch_bins(values[kept])
+        for other in sketch_values:
+            part[other] = np.int64(other == col)
+        parts.append(part)
+    rows = pd.concat(parts, ignore_index = True)
+    return rows.groupby(sketch_keys + ['bin'], as_index = False, observed = True)[sketch_values].sum()
+
+
+def merge_sketches(sketch1, sketch2):
+    # As merge_aggregates : the keys of the chunks are merged as strings then typed again
+    sketch = pd.concat([sketch1, sketch2], ignore_index = True)
+    return sketch.groupby(sketch_keys + ['bin'], as_index = False, observed = True)[sketch_values].sum()
+
+
+def materialize_sketch(source, fingerprint = None, data = None):
+    # Stored next to the cached frame and cube, with the same key (see materialize_cube)
+    fingerprint = fingerprint or source_fingerprint(source)
+    sketch = read_cache(fingerprint, kind = 'sketch')
+    if sketch is None:
+        sketch = sketch_frame(data if data is not None else load_prepared(source, fingerprint = fingerprint))
+        write_cache(fingerprint, sketch, kind = 'sketch')
+    return sketch
+
+
+def sketch_bins_of(sketch, keys, col):
+    # Bins of col with values by group of keys, in the order of the keys then of the values.
+    # The counts of the roll-up are sums, as the ones of the cube (see rollup)
+    rolled = rollup(sketch, keys + ['bin'])
+    rolled = rolled.loc[rolled[col] > 0, keys + ['bin', col]].reset_index(drop = True)
+    return rolled.rename(columns = {col : 'count'})
+
+
+def sketch_quantiles(sketch, keys, col, quantiles = [0.25, 0.5, 0.75]):
+    # One row per group : number of values n, then one column per quantile (P25, P50...). The
+    # quantile q is the value of rank floor(q * (n - 1)) in the sorted values of the group (numpy's
+    # method 'lower'), within the relative error of the sketch
+    bins = sketch_bins_of(sketch, keys, col)
+    counts = bins['count'].values.astype(np.int64)
+    cumulated = np.cumsum(counts)
+    groups = bins.groupby(keys, observed = True, sort = False).ngroup().values
+    firsts = np.flatnonzero(np.diff(groups, prepend = -1))
+    result = bins.loc[firsts, keys].reset_index(drop = True)
+    before = cumulated[firsts] - counts[firsts]
+    n = np.add.reduceat(counts, firsts) if len(firsts) else counts[:0]
+    result['n'] = n
+    for q in quantiles:
+        # First bin of the group whose cumulated count is above the rank
+        rank = before + np.floor(q * (n - 1)).astype(np.int64)
+        found = np.searchsorted(cumulated, rank, side = 'right')
+        result['P{:g}'.format(q * 100)] = bin_values(bins['bin'].values[found])
+    return result
+
+
+def sketch_box_stats(sketch, x, col, whis = 1.5):
+    # Statistics of the boxes of col by value of x, in the format of box_stats (Axes.bxp) : whiskers
+    # at the last bins within whis x IQR of the box, one flier per bin outside
+    quartiles = sketch_quantiles(sketch, [x], col).set_index(x)
+    bins = sketch_bins_of(sketch, [x], col)
+    bins['value'] = bin_values(bins['bin'].values)
+    values = bins.join(quartiles, on = x)
+    iqr = values['P75'] - values['P25']
+    inside = values['value'].between(values['P25'] - whis*iqr, values['P75'] + whis*iqr)
+    whiskers = values[inside].groupby(x, observed = True)['value'].agg(['min', 'max'])
+    fliers = values[~inside].groupby(x, observed = True)['value'].apply(list)
+    return {key : {'label' : key, 'q1' : row.P25, 'med' : row.P50, 'q3' : row.P75,
+                   'whislo' : whiskers.loc[key, 'min'], 'whishi' : whiskers.loc[key, 'max'],
+                   'fliers' : fliers.get(key, [])}
+            for key, row in quartiles.iterrows()}
+
+
+# ------------------------------------------
+# ---------------------------- Confidence intervals
+# ------------------------------------------
+# Confidence intervals of the mean of a column by group, for all the groups at once.
+# analytic : mean +/- z * std / sqrt(n) (normal approximation), from the rows or from the cube.
+# bootstrap : percentiles of the means of n_boot resamples of each group, all the resamples are
+# drawn by one numpy operation (by blocks of boot_block_size values) instead of one loop by group
+boot_block_size = 1 << 24
+
+
+def z_value(level = 0.95):
+    # 1.96 for a 95% interval, the rounded value of the original charts (the quantile of the normal
+    # law is 1.959964), so that their error bars don't change
+    if level == 0.95:
+        return 1.96
+    return stats.norm.ppf(0.5 + level / 2)
+
+
+def conf_int(std, count, level = 0.95):
+    # Half width of the interval of a mean, NaN with less than 2 values
+    return z_value(level) * np.divide(std, np.sqrt(count))
+
+
+def bootstrap_means(values, groups, n_groups, n_boot = 1000, seed = None):
+    # Means of n_boot resamples (with replacement, within its group) of each group : n_boot x n_groups.
+    # groups are the codes 0..n_groups-1 of the values
+    order = np.argsort(groups, kind = 'stable')
+    values, groups = values[order], groups[order]
+    sizes = np.bincount(groups, minlength = n_groups)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    # Each value of a resample is drawn among the values of its group : start + [0, size)
+    first, size = np.repeat(starts, sizes), np.repeat(sizes, sizes)
+    filled = sizes > 0
+    means = np.full((n_boot, n_groups), np.nan)
+    if not filled.any():
+        return means
+    rng = np.random.default_rng(seed)
+    block = max(1, boot_block_size // max(len(values), 1))
+    for start in range(0, n_boot, block):
+        n = min(block, n_boot - start)
+        drawn = values[first + (rng.random((n, len(values))) * size).astype(np.int64)]
+        sums = np.add.reduceat(drawn, starts[filled], axis = 1)
+        means[start:start + n, filled] = sums / sizes[filled]
+    return means
+
+
+def grouped_ci(data, keys, col, level = 0.95, method = 'analytic', n_boot = 1000, seed = None):
+    # One row per group of keys : mean of col, bounds col_low and col_high of its interval
+    # (NaN without interval : one value in the group, or method None).
+    # Means and deviations in float64, as the sums of the cube
+    values = data[col].astype('float64')
+    grouped = values.groupby([data[key] for key in keys], observed = True, sort = True)
+    ci = grouped.agg(['mean', 'std', 'count'])
+    low, high = np.full(len(ci), np.nan), np.full(len(ci), np.nan)
+    if method == 'analytic':
+        half = conf_int(ci['std'], ci['count'], level).values
+        low, high = ci['mean'].values - half, ci['mean'].values + half
+    elif method == 'bootstrap':
+        values = values.values
+        codes = grouped.ngroup().values
+        kept = ~np.isnan(values) & (codes >= 0)
+        means = bootstrap_means(values[kept], codes[kept], len(ci), n_boot, seed)
+        low, high = np.nanpercentile(means, [50 - level * 50, 50 + level * 50], axis = 0)
+        low[ci['count'].values < 2], high[ci['count'].values < 2] = np.nan, np.nan
+    elif method is not None:
+        raise ValueError('Unknown method of confidence interval : {}'.format(method))
+    ci = ci.drop(columns = ['std', 'count']).rename(columns = {'mean' : col})
+    ci[col + '_low'], ci[col + '_high'] = low, high
+    return ci.reset_index()
+
+
+def ci_of(agg, keys, col, level = 0.95):
+    # Analytic interval of the mean of col from the cube (sums and sums of squares), without the rows
+    ci = stats_of(agg, keys, col)
+    half = conf_int(ci[col + '_std'], ci[col + '_count'], level)
+    ci = ci[keys + [col + '_mean']].rename(columns = {col + '_mean' : col})
+    ci[col + '_low'], ci[col + '_high'] = ci[col] - half, ci[col] + half
+    return ci
+
+
+# ------------------------------------------
+# ---------------------------- Trends
+# ------------------------------------------
+# Least squares lines of the yearly series of every group (state, region, cause...) and metric,
+# computed together : the series are the rows of a matrix (groups x years, NaN for a year without
+# value), the sums of the closed form are reductions along the years. Same results as
+# scipy.stats.linregress on each series, without a call by series. A line through fewer than 3
+# years has no p-value nor standard errors (NaN)
+trend_metrics = ['count', 'surface', 'mean surface', 'mean duration']
+
+
+def yearly_metrics(agg, keys):
+    # Groups of keys (one row each), years, and the series of each metric as a matrix groups x years.
+    # A year without fires is a count and a surface of 0, and has no mean
+    rolled = rollup(agg, keys + ['DISC_YEAR'])
+    # Years of the family rolled up : the other families of the cube have no year (missing_key)
+    years = np.sort(rolled['DISC_YEAR'].unique())
+    # The roll-up is sorted by the keys then the years : the rows of a group are contiguous
+    codes = (rolled.groupby(keys, observed = True, sort = False).ngroup().values if keys
+             else np.zeros(len(rolled), dtype = np.int64))
+    firsts = np.flatnonzero(np.diff(codes, prepend = -1))
+    groups = rolled.loc[firsts, keys].reset_index(drop = True)
+    position = np.searchsorted(years, rolled['DISC_YEAR'].values)
+    values = {'count' : rolled['n'].values, 'surface' : rolled['FIRE_SIZE'].values,
+              'mean surface' : rolled['FIRE_SIZE'].values / rolled['n'].values,
+              'mean duration' : rolled['DURATION'].values / rolled['n'].values}
+    series = {}
+    for metric in trend_metrics:
+        series[metric] = np.full((len(groups), len(years)), 0.0 if metric in ['count', 'surface'] else np.nan)
+        series[metric][codes, position] = values[metric]
+    return groups, years, series
+
+
+def ols_lines(x, y):
+    # Slope, intercept, r, p-value of the slope and standard errors (as linregress) of each row of y
+    # against x. The sums are taken on the centered values of the years with a value
+    valid = ~np.isnan(y)
+    n = valid.sum(axis = 1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        x_mean = (valid * x).sum(axis = 1) / n
+        y_mean = np.where(valid, y, 0).sum(axis = 1) / n
+        dx = np.where(valid, x[None, :] - x_mean[:, None], 0)
+        dy = np.where(valid, y - y_mean[:, None], 0)
+        sxx, syy, sxy = (dx * dx).sum(axis = 1), (dy * dy).sum(axis = 1), (dx * dy).sum(axis = 1)
+        slope = sxy / sxx
+        intercept = y_mean - slope * x_mean
+        # A constant series has r = 0, as in linregress
+        r = np.where(syy > 0, sxy / np.sqrt(sxx * syy), 0).clip(-1, 1)
+        df = n - 2
+        t = r * np.sqrt(df / ((1 - r) * (1 + r)))
+        p_value = np.where(df > 0, 2 * stats.t.sf(np.abs(t), np.maximum(df, 1)), np.nan)
+        stderr = np.where(df > 0, np.sqrt((1 - r ** 2) * syy / sxx / df), np.nan)
+        intercept_stderr = stderr * np.sqrt(sxx / n + x_mean ** 2)
+    return {'slope' : slope, 'intercept' : intercept, 'r' : r, 'p_value' : p_value,
+            'stderr' : stderr, 'intercept_stderr' : intercept_stderr, 'years' : n, 'mean' : y_mean}
+
+
+def trends(agg, keys):
+    # One row per group of keys (no keys : all the fires) and metric : slope by year, intercept,
+    # r2, p-value, standard error, number of years and mean of the series. 'change %' is the slope
+    # relative to the mean, to compare groups of different sizes
+    groups, years, series = yearly_metrics(agg, keys)
+    lines = ols_lines(years.astype('float64'), np.concatenate([series[metric] for metric in trend_metrics]))
+    result = pd.concat([groups] * len(trend_metrics), ignore_index = True)
+    result['metric'] = np.repeat(trend_metrics, len(groups))
+    for col in ['slope', 'intercept', 'stderr', 'intercept_stderr', 'p_value', 'years', 'mean']:
+        result[col] = lines[col]
+    result.insert(len(keys) + 2, 'r2', lines['r'] ** 2)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        result['change %'] = 100 * lines['slope'] / np.abs(lines['mean'])
+    return result
+
+
+def trend_leaderboard(agg, by, metric = 'count', level = 0.05):
+    # Groups of by (a key or several ones) whose metric grows the fastest (relative to its mean)
+    # first, with the significance of the slope at level
+    board = trends(agg, [by] if isinstance(by, str) else list(by))
+    board = board[board['metric'] == metric].drop(columns = 'metric')
+    board['significant'] = board['p_value'] < level
+    board = board.sort_values('change %', ascending = False, na_position = 'last', ignore_index = True)
+    board.index = pd.RangeIndex(1, len(board) + 1, name = 'rank')
+    return board
+
+
+# ------------------------------------------
+# ---------------------------- Densities
+# ------------------------------------------
+# Gaussian kernel densities of the day of the year, one per year, as seaborn's kdeplot (Scott's
+# bandwidth, cut = 3) but without summing one kernel per fire : the days are counted in a
+# histogram of 366 bins per year by one bincount, then all the years are smoothed together by a
+# product with the transform of their kernel in the Fourier space. The days being integers,
+# the densities at the integer days are the ones of the direct sums
+def doy_density(data, bw_adjust = 1, cut = 3, x = 'DISC_DOY', by = 'DISC_YEAR'):
+    # Frame of the densities : one row per year, one column per day (beyond the days of the year
+    # up to cut bandwidths), NaN outside of the support of the year as in kdeplot
+    codes, years = pd.factorize(data[by], sort = True)
+    days = data[x].values.astype(np.int64) - 1
+    counts = np.bincount(codes * 366 + days, minlength = len(years) * 366).reshape(len(years), 366)
+    counts = counts.astype('float64')
+    n = counts.sum(axis = 1)
+    grid = np.arange(1, 367)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        mean = counts @ grid / n
+        var = (counts @ grid.astype('float64') ** 2 - n * mean ** 2) / (n - 1)
+        bw = np.sqrt(var.clip(0)) * n ** (-1 / 5) * bw_adjust
+    # A year with one fire, or all its fires the same day, has no density (as kdeplot)
+    valid = np.isfinite(bw) & (bw > 0)
+    pad = int(np.ceil(cut * bw[valid].max())) + 1 if valid.any() else 1
+    size = 366 + 2 * pad
+    padded = np.zeros((len(years), size))
+    padded[:, pad:pad + 366] = counts
+    freqs = np.fft.rfftfreq(size)
+    kernels = np.exp(-2 * (np.pi * freqs[None, :] * np.where(valid, bw, 0)[:, None]) ** 2)
+    density = np.fft.irfft(np.fft.rfft(padded, axis = 1) * kernels, n = size, axis = 1)
+    density = density.clip(0) / np.where(n > 0, n, 1)[:, None]
+    days = np.arange(1 - pad, 367 + pad)
+    low, high = (counts > 0).argmax(axis = 1) + 1, 366 - (counts[:, ::-1] > 0).argmax(axis = 1)
+    inside = ((days[None, :] >= (low - cut * bw)[:, None]) & (days[None, :] <= (high + cut * bw)[:, None]))
+    density[~(inside & valid[:, None])] = np.nan
+    return pd.DataFrame(density, index = pd.Index(np.asarray(years), name = by), columns = days)
+
+
+# ------------------------------------------
+# ---------------------------- Level of detail of the maps
+# ------------------------------------------
+# A map of the fires of a state can hold hundreds of thousands of markers. Above the budget, the
+# fires are snapped to a grid of lat / lon cells (by year and cause) : one marker per cell at the
+# mean position of its fires, with their total surface and their number
+lod_resolutions = [0.05, 0.1, 0.25, 0.5, 1, 2, 5] # Sides of the cells, in degrees
+marker_budget = int(os.environ.get('WILDFIRES_MARKER_BUDGET', 20000))
+
+
+def located_rows(data):
+    # Rows with a position : a fire without lat or lon has no cell, and no marker
+    located = data['lat'].notna().values & data['lon'].notna().values
+    return data if located.all() else data[located]
+
+
+def grid_codes(data, resolution, keys):
+    # Code of the cell (and group of keys) of each row, the rows have a position (see located_rows)
+    n_lat, n_lon = int(np.ceil(180 / resolution)) + 1, int(np.ceil(360 / resolution)) + 1
+    lat = np.floor((data['lat'].values + 90) / resolution).astype(np.int64)
+    lon = np.floor((data['lon'].values + 180) / resolution).astype(np.int64)
+    groups = data.groupby(keys, observed = True, sort = False).ngroup().values.astype(np.int64)
+    return (groups * n_lat + lat) * n_lon + lon
+
+
+def pick_resolution(data, budget = marker_budget, keys = ['DISC_YEAR', 'CAUSE']):
+    # Finest resolution with at most budget markers (None : one marker per fire)
+    data = located_rows(data)
+    if len(data) <= budget:
+        return None
+    for resolution in lod_resolutions:
+        if len(pd.unique(grid_codes(data, resolution, keys))) <= budget:
+            return resolution
+    return lod_resolutions[-1]
+
+
+def grid_aggregate(data, resolution = 'auto', budget = marker_budget, keys = ['DISC_YEAR', 'CAUSE']):
+    # Markers of the map : keys, lat, lon, FIRE_SIZE (sum) and count (number of fires).
+    # resolution : side of the cells in degrees, None for every fire, 'auto' to fit in budget
+    data = located_rows(data)
+    if resolution == 'auto':
+        resolution = pick_resolution(data, budget, keys)
+    if resolution is None:
+        markers = data[keys + ['lat', 'lon', 'FIRE_SIZE']].reset_index(drop = True)
+        markers['count'] = 1
+        return markers
+    cells = data[keys + ['lat', 'lon', 'FIRE_SIZE']].assign(cell = grid_codes(data, resolution, keys))
+    markers = cells.groupby(keys + ['cell'], observed = True, sort = True).agg(
+        lat = ('lat', 'mean'), lon = ('lon', 'mean'),
+        FIRE_SIZE = ('FIRE_SIZE', 'sum'), count = ('FIRE_SIZE', 'size'))
+    return markers.reset_index().drop(columns = 'cell')
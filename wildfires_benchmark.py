@@ -0,0 +1,819 @@
+# Headless benchmark of the dashboard : the streamlit script runs against a stand-in of the
+# streamlit module, on synthetic datasets with the schema of the real one. Each stage (loading,
+# aggregates, each node of the view graph, each run of the script) is measured in wall time, peak
+# memory and bytes sent to the browser, and the optimized frames are checked against the pandas
+# computations on the rows.
+#
+# Usage :
+#   python wildfires_benchmark.py run [--scales 5% 25% 100% 5x] [--report benchmark.json]
+#   python wildfires_benchmark.py generate 25% [output.csv]
+#   python wildfires_benchmark.py leak [--reruns 30] [source.csv]
+#   python wildfires_benchmark.py registry [--scales 5% 25%] [--report registry.json]
+
+import io
+import os
+import sys
+import json
+import time
+import types
+import runpy
+import argparse
+import platform
+import tempfile
+import warnings
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib import cbook
+from scipy import stats
+
+import wildfires_data
+import wildfires_aggregates
+from wildfires_data import dico_regions, load_prepared, source_fingerprint, RowLayout
+from wildfires_aggregates import (materialize_cube, grouped_ci, ci_of, doy_density, grid_aggregate,
+    z_value, compare_engines, sketch_quantiles, sketch_values, sketch_min, sketch_accuracy, trends)
+from wildfires_views import views
+from wildfires_figures import figure_cache, plotly_cache, render_figure, frame_fingerprint
+from wildfires_registry import datasets
+
+
+script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'streamlit_wildfires.py')
+# Rows of the complete dataset, the scales are relative to it
+full_rows = 2166369
+scales = {'5%' : 0.05, '25%' : 0.25, '100%' : 1, '5x' : 5}
+generate_chunk_size = 500000
+
+
+# ------------------------------------------
+# ---------------------------- Synthetic dataset
+# ------------------------------------------
+# Same columns and types as the final csv : a fire has a state (weighted by its number of fires,
+# around the center of the state), a discovery date with spring and summer peaks, a cause with its
+# general cause, a size in hectares with its class, and a duration of at most 200 days
+states_info = {
+'AL': ('Alabama', 32.8, -86.8, 3), 'AK': ('Alaska', 64.0, -152.0, 0.5), 'AZ': ('Arizona', 34.3, -111.7, 3.5),
+'AR': ('Arkansas', 34.9, -92.4, 1.5), 'CA': ('California', 37.2, -119.5, 8.5), 'CO': ('Colorado', 39.0, -105.5, 2),
+'CT': ('Connecticut', 41.6, -72.7, 0.3), 'DE': ('Delaware', 39.0, -75.5, 0.1), 'DC': ('District of Columbia', 38.9, -77.0, 0.02),
+'FL': ('Florida', 28.6, -82.4, 4.5), 'GA': ('Georgia', 32.7, -83.4, 7.5), 'HI': ('Hawaii', 20.8, -156.3, 0.2),
+'ID': ('Idaho', 44.4, -114.6, 2), 'IL': ('Illinois', 40.0, -89.2, 0.5), 'IN': ('Indiana', 39.9, -86.3, 0.3),
+'IA': ('Iowa', 42.1, -93.5, 0.5), 'KS': ('Kansas', 38.5, -98.4, 1), 'KY': ('Kentucky', 37.5, -85.3, 1.5),
+'LA': ('Louisiana', 31.1, -92.0, 2), 'ME': ('Maine', 45.4, -69.2, 0.5), 'MD': ('Maryland', 39.0, -76.8, 0.3),
+'MA': ('Massachusetts', 42.3, -71.8, 0.5), 'MI': ('Michigan', 44.3, -85.4, 0.8), 'MN': ('Minnesota', 46.3, -94.3, 2),
+'MS': ('Mississippi', 32.7, -89.7, 3.5), 'MO': ('Missouri', 38.4, -92.5, 1.5), 'MT': ('Montana', 47.0, -109.6, 2.5),
+'NE': ('Nebraska', 41.5, -99.8, 0.8), 'NV': ('Nevada', 39.3, -116.6, 1), 'NH': ('New Hampshire', 43.7, -71.6, 0.2),
+'NJ': ('New Jersey', 40.2, -74.7, 1), 'NM': ('New Mexico', 34.4, -106.1, 2.5), 'NY': ('New York', 42.9, -75.5, 2),
+'NC': ('North Carolina', 35.6, -79.4, 5), 'ND': ('North Dakota', 47.5, -100.5, 0.8), 'OH': ('Ohio', 40.3, -82.8, 0.5),
+'OK': ('Oklahoma', 35.6, -97.5, 2), 'OR': ('Oregon', 43.9, -120.6, 3), 'PA': ('Pennsylvania', 40.9, -77.8, 0.5),
+'PR': ('Puerto Rico', 18.2, -66.5, 0.3), 'RI': ('Rhode Island', 41.7, -71.5, 0.05), 'SC': ('South Carolina', 33.9, -80.9, 4.5),
+'SD': ('South Dakota', 44.4, -100.2, 1), 'TN': ('Tennessee', 35.9, -86.4, 1.5), 'TX': ('Texas', 31.5, -99.3, 7),
+'UT': ('Utah', 39.3, -111.7, 1.5), 'VT': ('Vermont', 44.1, -72.7, 0.1), 'VA': ('Virginia', 37.5, -78.9, 1),
+'WA': ('Washington', 47.4, -120.5, 2), 'WV': ('West Virginia', 38.6, -80.6, 1), 'WI': ('Wisconsin', 44.6, -89.9, 1.5),
+'WY': ('Wyoming', 43.0, -107.6, 1)}
+
+# Cause : (share of the fires, classification, general causes)
+causes_info = {
+"Individuals' mistake" : (0.35, 'Human', ['Debris and open burning', 'Equipment and vehicle use',
+    'Recreation and ceremony', 'Smoking', 'Fireworks', 'Firearms and explosives use',
+    'Misuse of fire by a minor', 'Other causes']),
+'Criminal' : (0.2, 'Human', ['Arson/incendiarism']),
+'Infrastructure accident' : (0.05, 'Human', ['Power generation/transmission/distribution',
+    'Railroad operations and maintenance']),
+'Natural (lightning)' : (0.15, 'Natural', ['Natural']),
+'Other/Unknown' : (0.25, 'Missing data/not specified/undetermined',
+    ['Missing data/not specified/undetermined'])}
+
+# Upper bounds of the size classes, in hectares
+size_classes = [(0.1, 'A'), (4, 'B'), (40, 'C'), (120, 'D'), (400, 'E'), (2000, 'F'), (np.inf, 'G')]
+seasons = {12 : 'Winter', 1 : 'Winter', 2 : 'Winter', 3 : 'Spring', 4 : 'Spring', 5 : 'Spring',
+    6 : 'Summer', 7 : 'Summer', 8 : 'Summer', 9 : 'Fall', 10 : 'Fall', 11 : 'Fall'}
+
+
+def synthetic_chunk(n, rng, first_id = 0):
+    codes = np.array(list(states_info))
+    weights = np.array([info[3] for info in states_info.values()])
+    state = rng.choice(codes, n, p = weights / weights.sum())
+    info = pd.DataFrame(states_info, index = ['full', 'lat', 'lon', 'weight']).T.loc[state]
+    # Discovery : year, then day of the year from a spring and a summer peak,
+    year = rng.integers(1992, 2019, n)
+    # and some fires all year long : every month has fires of each cause, even on small datasets
+    peak = rng.random(n)
+    doy = np.where(peak < 0.5, rng.normal(100, 40, n), rng.normal(200, 45, n))
+    doy = np.where(peak < 0.85, doy, rng.uniform(1, 366, n))
+    doy = np.clip(np.round(doy), 1, 365).astype(int)
+    discovery = pd.to_datetime(year * 1000 + doy, format = '%Y%j')
+    duration = np.minimum(np.floor(rng.exponential(1.5, n)), 200)
+    containment = discovery + pd.to_timedelta(duration, unit = 'D')
+    cause = rng.choice(list(causes_info), n, p = [info[0] for info in causes_info.values()])
+    general = np.empty(n, dtype = object)
+    classification = np.empty(n, dtype = object)
+    for name, (share, classif, generals) in causes_info.items():
+        rows = cause == name
+        general[rows] = rng.choice(generals, rows.sum())
+        classification[rows] = classif
+    size = rng.lognormal(-1.5, 2.2, n)
+    size_class = np.array([label for bound, label in size_classes])[
+        np.searchsorted([bound for bound, label in size_classes], size)]
+    lat = info['lat'].values.astype(float) + rng.normal(0, 1.2, n)
+    lon = info['lon'].values.astype(float) + rng.normal(0, 1.8, n)
+    ids = pd.Series(np.arange(first_id, first_id + n)).astype(str)
+    return pd.DataFrame({
+        'FPA_ID' : ('SYN-' + ids).values,
+        'NWCG_REPORTING_AGENCY' : rng.choice(['FS', 'BLM', 'ST/C&L', 'NPS', 'BIA', 'FWS'], n),
+        'DISCOVERY_DATE' : discovery.strftime('%Y-%m-%d'),
+        'NWCG_CAUSE_CLASSIFICATION' : classification,
+        'NWCG_GENERAL_CAUSE' : general,
+        'NWCG_CAUSE_AGE_CATEGORY' : np.where(rng.random(n) < 0.02, 'Minor', ''),
+        'CONT_DATE' : containment.strftime('%Y-%m-%d'),
+        'FIRE_SIZE' : size.round(2),
+        'FIRE_SIZE_CLASS' : size_class,
+        'LATITUDE' : lat.round(5), 'LONGITUDE' : lon.round(5),
+        'OWNER_DESCR' : rng.choice(['USFS', 'BLM', 'PRIVATE', 'STATE', 'MISSING/NOT SPECIFIED'], n),
+        'STATE' : state,
+        'COUNTY' : rng.integers(1, 200, n).astype(str),
+        'DISC_YEAR' : year, 'DISC_MONTH' : discovery.month, 'DISC_DOW' : discovery.dayofweek,
+        'DURATION' : duration,
+        'Season' : pd.Series(discovery.month).map(seasons).values,
+        'STATE_FULL' : info['full'].values,
+        'CAUSE' : cause,
+        'geometry' : ('POINT (' + pd.Series(lon.round(5)).astype(str) + ' ' +
+                      pd.Series(lat.round(5)).astype(str) + ')').values})
+
+
+def generate(rows, output, seed = 0, chunk_size = generate_chunk_size):
+    # Written by chunks : the 5x dataset doesn't have to fit in memory
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunk_size):
+        chunk = synthetic_chunk(min(chunk_size, rows - start), rng, start)
+        chunk.to_csv(output, mode = 'w' if start == 0 else 'a', header = start == 0, index = False)
+    return output
+
+
+def scale_rows(scale):
+    # '25%', '5x' or a number of rows
+    if scale in scales:
+        return int(round(full_rows * scales[scale]))
+    return int(scale)
+
+
+# ------------------------------------------
+# ---------------------------- Headless streamlit
+# ------------------------------------------
+# Stand-in of the streamlit module : the widgets return the values of choices (by label) or their
+# default, the cache decorators memoize by arguments, the outputs only count the bytes they would
+# send to the browser
+class Element:
+
+    def __init__(self, st):
+        self.st = st
+
+    def __getattr__(self, name):
+        # Widgets and outputs of a column, an expander or the sidebar are the ones of the page
+        if name in HeadlessStreamlit.forwarded:
+            return getattr(self.st, name)
+        return lambda *args, **kwargs : Element(self.st)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class HeadlessStreamlit(types.ModuleType):
+
+    forwarded = ('checkbox', 'radio', 'selectbox', 'select_slider', 'multiselect', 'button',
+        'file_uploader', 'image', 'plotly_chart', 'pydeck_chart', 'pyplot', 'dataframe', 'table')
+
+    def __init__(self, choices = None):
+        super().__init__('streamlit')
+        self.choices = choices or {}
+        self.payloads = []
+        self.memo = {}
+        self.sidebar = Element(self)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs : Element(self)
+
+    # ---- Cache
+    def cache(self, function = None, **options):
+        if function is None:
+            return lambda function : self.cache(function)
+        def wrapper(*args, **kwargs):
+            key = (function.__module__, function.__name__,
+                   tuple(id(arg) if hasattr(arg, 'read') else arg for arg in args))
+            if key not in self.memo:
+                self.memo[key] = function(*args, **kwargs)
+            return self.memo[key]
+        return wrapper
+
+    experimental_singleton = experimental_memo = cache
+
+    # ---- Widgets
+    def checkbox(self, label, value = False, **kwargs):
+        return self.choices.get(label, value)
+
+    def radio(self, label, options, index = 0, **kwargs):
+        return self.choices.get(label, list(options)[index])
+
+    def selectbox(self, label, options, index = 0, **kwargs):
+        return self.choices.get(label, list(options)[index])
+
+    def select_slider(self, label, options = (), value = None, **kwargs):
+        return self.choices.get(label, value if value is not None else list(options)[0])
+
+    def multiselect(self, label, options, default = None, **kwargs):
+        return self.choices.get(label, list(default or []))
+
+    def button(self, label, **kwargs):
+        return self.choices.get(label, False)
+
+    def file_uploader(self, label, **kwargs):
+        path = self.choices.get(label)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            uploaded = io.BytesIO(f.read())
+        # As streamlit : an id by upload, the same at each rerun
+        uploaded.name, uploaded.size = os.path.basename(path), len(uploaded.getvalue())
+        uploaded.id = os.stat(path).st_ino
+        return uploaded
+
+    def columns(self, spec):
+        return [Element(self) for i in range(spec if isinstance(spec, int) else len(spec))]
+
+    # ---- Outputs
+    def image(self, image, **kwargs):
+        if isinstance(image, bytes):
+            self.payloads.append(len(image))
+        elif hasattr(image, 'save'): # PIL image, sent as png
+            buffer = io.BytesIO()
+            image.save(buffer, format = 'png')
+            self.payloads.append(len(buffer.getvalue()))
+
+    def plotly_chart(self, figure, **kwargs):
+        self.payloads.append(len(figure.to_json()))
+
+    def pydeck_chart(self, deck, **kwargs):
+        self.payloads.append(len(deck.to_json()))
+
+    def pyplot(self, fig = None, **kwargs):
+        self.payloads.append(len(render_figure(fig if fig is not None else plt.gcf())))
+
+    def dataframe(self, data = None, **kwargs):
+        if hasattr(data, 'to_json'):
+            self.payloads.append(len(data.to_json()))
+
+    table = dataframe
+
+    def experimental_get_query_params(self):
+        return {}
+
+
+def run_script(st, choices = None):
+    # One run of the dashboard, as for a rerun of a session
+    st.choices = choices or {}
+    st.payloads = []
+    saved = sys.modules.get('streamlit')
+    sys.modules['streamlit'] = st
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return runpy.run_path(script_path, run_name = '__main__')
+    finally:
+        # Figures left open by the run, counted before the ones of a failed run are closed
+        st.open_figures = len(plt.get_fignums())
+        plt.close('all')
+        if saved is None:
+            del sys.modules['streamlit']
+        else :
+            sys.modules['streamlit'] = saved
+
+
+# Labels of the widgets of the script
+genre_label = 'What kind of analysis to you want to perform ?'
+variable_label = 'Which variable to plot ?'
+map_label = 'Map type :'
+state_label = 'Select the state you would like to analyse'
+cause_label = ("Do you want to visualize the data by separating the "
+    "                information according to the cause of the fires ?")
+
+
+def script_choices(state):
+    # Pages of the dashboard : every tab, map type and option
+    pages = {}
+    for variable in ['Number of wildfires', 'Causes of wildfires', 'Surface of wildfires', 'Duration of wildfires']:
+        for map_type in ['Year by year', 'Average over the years']:
+            pages['Global / {} / {}'.format(variable, map_type)] = {
+                genre_label : 'Global', variable_label : variable, map_label : map_type}
+    pages['Regional'] = {genre_label : 'Regional'}
+    pages['Our process'] = {genre_label : 'Our process'}
+    pages['By State / Rankings'] = {genre_label : 'By State'}
+    for map_type in ['Year by year', 'All years']:
+        for cause_on in ['No', 'Yes']:
+            pages['By State / {} / {} / cause {}'.format(state, map_type, cause_on)] = {
+                genre_label : 'By State', state_label : state, map_label : map_type, cause_label : cause_on}
+    return pages
+
+
+# ------------------------------------------
+# ---------------------------- Measures
+# ------------------------------------------
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError): # Not linux : peak of the process
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def payload_of(value):
+    # Bytes sent to the browser for an output (png, plotly or pydeck json), None for a frame
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, (list, tuple)) and value and all(isinstance(item, bytes) for item in value):
+        return sum(len(item) for item in value)
+    if hasattr(value, 'to_json') and not isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value.to_json())
+    return None
+
+
+def measure(stage, function, payload = payload_of):
+    # Wall time, peak of the memory allocated (tracemalloc : numpy and pandas buffers included,
+    # the wall time includes its overhead) and payload of one stage
+    tracemalloc.start()
+    start = time.perf_counter()
+    error = None
+    try:
+        value = function()
+    except Exception as e:
+        value, error = None, repr(e)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result = {'stage' : stage, 'seconds' : round(seconds, 4), 'peak_MB' : round(peak / 2**20, 2)}
+    if error is not None:
+        result['error'] = error
+    else :
+        size = payload(value)
+        if size is not None:
+            result['payload_bytes'] = size
+        if isinstance(value, pd.DataFrame):
+            result['rows'] = len(value)
+    return value, result
+
+
+def reset_caches():
+    views.clear()
+    wildfires_aggregates.clear_rollups()
+    figure_cache.clear()
+    plotly_cache.clear()
+
+
+# ------------------------------------------
+# ---------------------------- Reference outputs
+# ------------------------------------------
+# Frames of the dashboard computed by pandas on the rows, as in the first versions of the script
+def reference_frames(df_fires, months_labels, causes_labels):
+    frames = {}
+    frames['fires_months_tmp_df'] = df_fires.groupby(['DISC_YEAR', 'DISC_MONTH'],
+        as_index = False, observed = True).agg({'STATE' : 'count'})
+    frames['fires_days_tmp_df'] = df_fires.groupby(['DISC_DOW', 'DISC_YEAR'],
+        as_index = False, observed = True).agg({'STATE' : 'count'})
+    frames['surface_fires_tmp'] = df_fires.groupby('DISC_YEAR', as_index = False).agg({'FIRE_SIZE' : 'mean'})
+    frames['surface'] = df_fires.groupby('DISC_YEAR', as_index = False)['FIRE_SIZE'].sum()
+    surface_total_state = df_fires.groupby(['DISC_YEAR', 'STATE', 'STATE_FULL'],
+        as_index = False, observed = True)['FIRE_SIZE'].sum()
+    surface_total_state.columns = ['year', 'St', 'State', 'Total burnt area (ha)']
+    frames['surface_total_state'] = surface_total_state
+    for col, name in [('FIRE_SIZE', 'surface_months'), ('DURATION', 'duration_months')]:
+        frame = df_fires.groupby(['DISC_MONTH'], as_index = False).agg({col : ['mean', 'std', 'count']})
+        frame.columns = ['DISC_MONTH', col + '_avg', col + '_std', col + '_count']
+        frame['DISC_MONTH'] = months_labels
+        frame['conf_int'] = 1.96*np.divide(frame[col + '_std'], np.sqrt(frame[col + '_count']))
+        frames[name] = frame
+    for col, name in [('FIRE_SIZE', 'surface_months_cause'), ('DURATION', 'duration_months_cause')]:
+        frame = df_fires.groupby(['DISC_MONTH', 'CAUSE'], as_index = False, observed = True).agg(
+            {col : ['mean', 'std', 'count']})
+        frame.columns = ['DISC_MONTH', 'CAUSE', col + '_avg', col + '_std', col + '_count']
+        frame['DISC_MONTH'] = [j for j in months_labels for i in range(5)]
+        frame['conf_int'] = 1.96*np.divide(frame[col + '_std'], np.sqrt(frame[col + '_count']))
+        frames[name] = frame
+    cause_month_year = df_fires.groupby(['DISC_YEAR', 'DISC_MONTH', 'CAUSE'], as_index = False,
+        observed = True).agg({'STATE' : 'count'}).groupby(['DISC_MONTH', 'CAUSE'], as_index = False,
+        observed = True).agg({'STATE' : ['mean', 'std', 'count']})
+    cause_month_year.columns = ['DISC_MONTH', 'CAUSE', 'N_avg', 'N_std', 'N_count']
+    cause_month_year['DISC_MONTH'] = [j for j in months_labels for i in range(5)]
+    cause_month_year['conf_int'] = 1.96*np.divide(cause_month_year['N_std'], np.sqrt(cause_month_year['N_count']))
+    frames['cause_month_year'] = cause_month_year
+    frames['surface_avg'] = df_fires.groupby(['DISC_YEAR', 'CAUSE'], as_index = False, observed = True)['FIRE_SIZE'].mean()
+    duration_year_state = df_fires.groupby(['DISC_YEAR', 'STATE', 'STATE_FULL'], as_index = False,
+        observed = True).agg({'DURATION' : 'mean'})
+    duration_year_state.columns = ['Year', 'St', 'State', 'Avg duration of a fire (days)']
+    frames['duration_year_state'] = duration_year_state
+    frames['months_cause'] = df_fires.groupby(['DISC_MONTH', 'CAUSE'], as_index = False, observed = True).agg({'FIRE_SIZE' : 'mean'})
+    frames['months_cause_total'] = df_fires.groupby(['DISC_MONTH', 'CAUSE'], as_index = False, observed = True).agg({'FIRE_SIZE' : 'sum'})
+    frames['months_year_total'] = df_fires.groupby(['DISC_MONTH', 'DISC_YEAR'], as_index = False).agg({'FIRE_SIZE' : 'sum'})
+    frames['day_size'] = df_fires.groupby('DISC_DOW', as_index = False).agg({'FIRE_SIZE' : 'mean'})
+    frames['duration_causes'] = df_fires.groupby(['DISC_YEAR', 'CAUSE'], as_index = False, observed = True)['DURATION'].mean()
+    ct_classe_cause = pd.crosstab(df_fires.FIRE_SIZE_CLASS, df_fires.CAUSE)
+    ct_classe_cause.columns = ct_classe_cause.columns.astype(str)
+    frames['ct_classe_cause'] = ct_classe_cause
+    frames['ct_classe_cause_perc'] = ct_classe_cause.apply(lambda x : (x/x.sum()) *100, axis = 1)[causes_labels]
+    state_year_tmp_df = df_fires.groupby(['STATE', 'STATE_FULL', 'DISC_YEAR'], as_index = False,
+        observed = True).agg({'FPA_ID' : 'count', 'lat' : 'mean', 'lon' : 'mean', 'FIRE_SIZE' : 'sum'})
+    state_year_tmp_df.columns = ['St', 'State', 'Year', 'Number of fires', 'lat', 'lon', 'Surf']
+    frames['state_year_tmp_df'] = state_year_tmp_df
+    frames['region_fire_number'] = pd.crosstab(df_fires['DISC_YEAR'], df_fires['Region'])
+    return frames
+
+
+def normalized(frame):
+    # Categories as strings, numbers as float64 : only the values are compared
+    frame = frame.copy()
+    if isinstance(frame.index, pd.CategoricalIndex):
+        frame.index = frame.index.astype(object)
+    frame.columns = [str(col) for col in frame.columns]
+    for col in frame.columns:
+        if hasattr(frame[col], 'cat'):
+            frame[col] = frame[col].astype(str)
+        elif frame[col].dtype.kind in 'fiub':
+            frame[col] = frame[col].astype('float64')
+    return frame
+
+
+def max_error(expected, actual):
+    # Largest difference relative to the magnitude of the expected values
+    expected, actual = np.asarray(expected, dtype = 'float64'), np.asarray(actual, dtype = 'float64')
+    if expected.shape != actual.shape:
+        return np.inf
+    if np.any(np.isnan(expected) != np.isnan(actual)):
+        return np.inf
+    scale = np.maximum(np.abs(expected), 1e-9)
+    diff = np.abs(expected - actual) / scale
+    return float(np.nanmax(diff)) if diff.size and not np.all(np.isnan(diff)) else 0.0
+
+
+def check(name, function, tolerance):
+    try:
+        error = function()
+    except Exception as e:
+        return {'check' : name, 'ok' : False, 'error' : repr(e)}
+    return {'check' : name, 'ok' : bool(error <= tolerance), 'max_error' : error, 'tolerance' : tolerance}
+
+
+def compare_frames(expected, actual):
+    expected, actual = normalized(expected), normalized(actual)
+    pd.testing.assert_frame_equal(expected, actual, check_dtype = False, check_index_type = False,
+        check_names = False, check_column_type = False, rtol = 1e-4, atol = 1e-6)
+    numbers = [col for col in expected.columns if expected[col].dtype.kind == 'f']
+    return max_error(expected[numbers].values, actual[numbers].values) if numbers else 0.0
+
+
+def reference_checks(df_fires, script_globals, state):
+    # Each optimized path against its pandas (or scipy, matplotlib) reference
+    months_labels, causes_labels = script_globals['months_labels'], script_globals['causes_labels']
+    checks = []
+    for name, expected in reference_frames(df_fires, months_labels, causes_labels).items():
+        if name in views.nodes:
+            checks.append(check('frame ' + name,
+                lambda : compare_frames(expected, views.get(name, state = state)), 1e-4))
+    rows = df_fires[df_fires.STATE_FULL == state].sort_values('DISC_YEAR', kind = 'mergesort')
+
+    def layout_slice():
+        sliced = RowLayout(df_fires).rows(state)
+        pd.testing.assert_frame_equal(rows.reset_index(drop = True), sliced.reset_index(drop = True))
+        return 0.0
+    checks.append(check('RowLayout slice of ' + state, layout_slice, 0))
+
+    def analytic_ci():
+        ci = grouped_ci(df_fires, ['DISC_MONTH'], 'FIRE_SIZE')
+        grouped = df_fires['FIRE_SIZE'].astype('float64').groupby(df_fires['DISC_MONTH'])
+        half = z_value() * grouped.std() / np.sqrt(grouped.count())
+        return max(max_error(grouped.mean() - half, ci['FIRE_SIZE_low']),
+                   max_error(grouped.mean() + half, ci['FIRE_SIZE_high']))
+    checks.append(check('grouped_ci analytic', analytic_ci, 1e-6))
+
+    def cube_ci():
+        expected = grouped_ci(df_fires, ['DISC_MONTH', 'CAUSE'], 'DURATION')
+        actual = ci_of(views.get('cube'), ['DISC_MONTH', 'CAUSE'], 'DURATION')
+        return max_error(expected[['DURATION', 'DURATION_low', 'DURATION_high']].values,
+                         actual[['DURATION', 'DURATION_low', 'DURATION_high']].values)
+    checks.append(check('ci_of (cube) against grouped_ci (rows)', cube_ci, 1e-4))
+
+    def bootstrap_ci():
+        # Loop of resamples by group, with another generator : the bounds agree up to the noise
+        data = views.get('state_year_tmp_df')
+        ci = grouped_ci(data, ['State'], 'Number of fires', method = 'bootstrap', n_boot = 2000, seed = 0)
+        rng = np.random.default_rng(1)
+        errors = []
+        for (key, group), low, high in zip(data.groupby('State', observed = True),
+                ci['Number of fires_low'], ci['Number of fires_high']):
+            values = group['Number of fires'].values
+            means = [rng.choice(values, len(values)).mean() for i in range(2000)]
+            bounds = np.percentile(means, [2.5, 97.5])
+            errors.append(max(abs(bounds[0] - low), abs(bounds[1] - high)) / max(bounds[1] - bounds[0], 1))
+        return float(max(errors))
+    checks.append(check('grouped_ci bootstrap against a loop of resamples', bootstrap_ci, 0.15))
+
+    def density():
+        expected_max = 0.0
+        density = doy_density(rows)
+        for year, group in rows.groupby('DISC_YEAR'):
+            if group['DISC_DOY'].nunique() < 2:
+                continue
+            curve = density.loc[year].dropna()
+            kde = stats.gaussian_kde(group['DISC_DOY'].values.astype('float64'))
+            expected = kde(curve.index.values.astype('float64'))
+            expected_max = max(expected_max, float(np.max(np.abs(curve.values - expected)) / expected.max()))
+        return expected_max
+    checks.append(check('doy_density against gaussian_kde', density, 1e-2))
+
+    def markers():
+        cells = grid_aggregate(rows, resolution = 1)
+        expected = rows.groupby(['DISC_YEAR', 'CAUSE'], observed = True).agg(
+            FIRE_SIZE = ('FIRE_SIZE', 'sum'), count = ('FIRE_SIZE', 'size'))
+        actual = cells.groupby(['DISC_YEAR', 'CAUSE'], observed = True)[['FIRE_SIZE', 'count']].sum()
+        return max_error(expected.values, actual.reindex(expected.index).values)
+    checks.append(check('grid_aggregate totals by year and cause', markers, 1e-4))
+
+    def boxes():
+        from wildfires_plots import box_stats
+        counts = views.get('state_nb_month', state = state)
+        boxes = box_stats(counts, 'DISC_MONTH', 'FPA_ID')
+        errors = []
+        for month, group in counts.groupby('DISC_MONTH', observed = True):
+            expected = cbook.boxplot_stats(group['FPA_ID'].values)[0]
+            errors.append(max_error([expected[k] for k in ['q1', 'med', 'q3', 'whislo', 'whishi']],
+                                    [boxes[month][k] for k in ['q1', 'med', 'q3', 'whislo', 'whishi']]))
+        return max(errors)
+    checks.append(check('box_stats against matplotlib boxplot_stats', boxes, 1e-9))
+
+    def sketches():
+        # Percentiles of the sketches against the values of rank floor(q * (n - 1)) of the rows.
+        # The values at or below sketch_min are 0 in the sketches
+        quantiles = [0, 0.25, 0.5, 0.9, 0.99, 1]
+        errors = []
+        for col in sketch_values:
+            table = sketch_quantiles(views.get('sketch'), ['STATE_FULL', 'CAUSE'], col, quantiles)
+            table = table.set_index(['STATE_FULL', 'CAUSE'])
+            grouped = df_fires.groupby(['STATE_FULL', 'CAUSE'], observed = True)[col]
+            for q in quantiles:
+                expected = grouped.quantile(q, interpolation = 'lower').astype('float64')
+                expected = expected.where(expected > sketch_min, 0)
+                errors.append(max_error(expected.values, table['P{:g}'.format(q * 100)].reindex(expected.index).values))
+        return max(errors)
+    checks.append(check('quantile sketches against the percentiles of the rows', sketches, sketch_accuracy + 1e-6))
+
+    def trend_lines():
+        # Lines of the engine against one linregress by state and metric on the rows
+        expected, actual = [], []
+        table = trends(views.get('cube'), ['STATE_FULL']).set_index(['STATE_FULL', 'metric'])
+        years = np.sort(df_fires['DISC_YEAR'].unique()).astype('float64')
+        values = df_fires[['FIRE_SIZE', 'DURATION']].astype('float64').assign(
+            STATE_FULL = df_fires['STATE_FULL'], DISC_YEAR = df_fires['DISC_YEAR'])
+        for state, group in values.groupby('STATE_FULL', observed = True):
+            yearly = group.groupby('DISC_YEAR').agg(count = ('FIRE_SIZE', 'size'), surface = ('FIRE_SIZE', 'sum'),
+                mean_surface = ('FIRE_SIZE', 'mean'), mean_duration = ('DURATION', 'mean'))
+            yearly = yearly.reindex(years.astype(yearly.index.dtype))
+            yearly[['count', 'surface']] = yearly[['count', 'surface']].fillna(0)
+            for metric in ['count', 'surface', 'mean surface', 'mean duration']:
+                series = yearly[metric.replace(' ', '_')].dropna()
+                if len(series) < 3:
+                    continue
+                line = stats.linregress(series.index.values.astype('float64'), series.values)
+                expected.append([line.slope, line.intercept, line.rvalue ** 2, line.stderr])
+                actual.append(table.loc[(state, metric), ['slope', 'intercept', 'r2', 'stderr']].values)
+        return max_error(expected, actual)
+    checks.append(check('trends against scipy linregress', trend_lines, 1e-6))
+
+    def engines():
+        # Cube and roll-ups of the polars engine (when polars is installed)
+        report = compare_engines(df_fires)
+        return report['sums max relative error'] if report['equal'] else np.inf
+    if wildfires_aggregates.pl is not None:
+        checks.append(check('polars engine against pandas', engines, 1e-9))
+    return checks
+
+
+# ------------------------------------------
+# ---------------------------- Suite
+# ------------------------------------------
+def node_context(state):
+    # Values of the widgets read by the nodes
+    return {'state' : state, 'map_detail' : 'auto', 'map_year' : None, 'trend_by' : ('STATE_FULL', 'CAUSE'),
+            'trend_metric' : 'count'}
+
+
+def node_stages(context):
+    # Each node alone : its dependencies are computed first, the caches of the charts are emptied
+    stages = []
+    for name in sorted(views.nodes):
+        function, deps, widgets = views.nodes[name]
+        try:
+            for dep in deps:
+                views.get(dep, **context)
+        except Exception as e:
+            stages.append({'stage' : 'node ' + name, 'error' : repr(e)})
+            continue
+        views.discard(name, context)
+        figure_cache.clear()
+        plotly_cache.clear()
+        stages.append(measure('node ' + name, lambda : views.get(name, **context))[1])
+    return stages
+
+
+def benchmark_scale(scale, data_dir, state = 'Texas', seed = 0):
+    rows = scale_rows(scale)
+    source = os.path.join(data_dir, 'wildfires_synthetic_{}.csv'.format(rows))
+    stages = []
+    if not os.path.exists(source):
+        stages.append(measure('generate', lambda : generate(rows, source, seed), payload = lambda value : None)[1])
+        stages[-1]['file_MB'] = round(os.path.getsize(source) / 2**20, 1)
+    # Cold caches, in a directory of this scale
+    wildfires_data.cache_dir = os.path.join(data_dir, 'cache_{}'.format(rows))
+    plotly_cache.directory = os.path.join(wildfires_data.cache_dir, 'figures')
+    wildfires_data.clear_cache()
+    reset_caches()
+    df_fires, stage = measure('load_data (csv)', lambda : load_prepared(source, use_cache = False))
+    stages.append(stage)
+    stages.append(measure('load_data (csv, cache written)', lambda : load_prepared(source))[1])
+    stages.append(measure('load_data (cache)', lambda : load_prepared(source))[1])
+    stages.append(measure('aggregate cube', lambda : materialize_cube(source))[1])
+    # The script reads the generated dataset
+    wildfires_data.data_filename = source
+    st = HeadlessStreamlit()
+    script_globals = None
+    # A page that raises is a failed check : the report can't have zero failures with a broken page
+    checks = []
+    for page, choices in script_choices(state).items():
+        for run in ['first run', 'rerun']:
+            value, stage = measure('script {} : {}'.format(run, page),
+                lambda : run_script(st, choices), payload = lambda value : sum(st.payloads))
+            stages.append(stage)
+            if 'error' in stage:
+                checks.append({'check' : 'page ' + page, 'ok' : False, 'error' : stage['error']})
+            else :
+                script_globals = value
+    stages += node_stages(node_context(state))
+    if script_globals is None:
+        checks.append({'check' : 'reference checks', 'ok' : False, 'error' : 'no page of the script ran'})
+    else :
+        checks += reference_checks(df_fires, script_globals, state)
+    return {'scale' : scale, 'rows' : rows, 'source' : source, 'stages' : stages, 'checks' : checks}
+
+
+def leak_check(source = None, reruns = 30, state = 'Texas'):
+    # Charts drawn again at each rerun (caches emptied) : no figure stays open in pyplot and the
+    # resident memory stays flat after the first runs
+    if source is not None:
+        wildfires_data.data_filename = source
+    st = HeadlessStreamlit()
+    choices = {genre_label : 'By State', state_label : state, cause_label : 'No'}
+    open_figures, rss = [], []
+    for i in range(reruns):
+        reset_caches()
+        try:
+            run_script(st, choices)
+        except Exception as e: # As a page of the suite : reported as a failure, the report is written
+            return {'reruns' : i, 'open_figures' : open_figures, 'rss_MB' : rss, 'rss_growth_MB' : None,
+                    'ok' : False, 'error' : repr(e)}
+        open_figures.append(st.open_figures)
+        rss.append(round(rss_mb(), 1))
+    # Growth between the end of the warm-up (second quarter of the runs) and the last quarter, as
+    # medians : the RSS of one run varies by tens of megabytes with the allocator
+    window = max(1, reruns // 4)
+    warm = float(np.median(rss[window:2 * window] or rss[-1:]))
+    growth = float(np.median(rss[-window:])) - warm
+    return {'reruns' : reruns, 'open_figures' : open_figures, 'rss_MB' : rss,
+            'rss_growth_MB' : round(growth, 1),
+            'ok' : max(open_figures) == 0 and growth <= max(20, 0.05 * warm)}
+
+
+def median_seconds(function, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def registry_benchmark(scale_names, data_dir, repeat = 200):
+    # Cost of a rerun asking for the dataset : lookup in the registry (stat of the path, id of the
+    # upload) against the hashes done by st.cache at each rerun (the uploaded file as argument, the
+    # returned frame to detect its mutations)
+    results = []
+    for scale in scale_names:
+        rows = scale_rows(scale)
+        source = os.path.join(data_dir, 'wildfires_synthetic_{}.csv'.format(rows))
+        if not os.path.exists(source):
+            generate(rows, source)
+        wildfires_data.cache_dir = os.path.join(data_dir, 'cache_{}'.format(rows))
+        datasets.clear()
+        start = time.perf_counter()
+        dataset = datasets.get(source)
+        first = time.perf_counter() - start
+        with open(source, 'rb') as f:
+            upload = io.BytesIO(f.read())
+        upload.id, upload.name, upload.size = 'benchmark-{}'.format(rows), os.path.basename(source), len(upload.getvalue())
+        datasets.get(upload)
+        st_cache = median_seconds(lambda : (source_fingerprint(upload), frame_fingerprint(dataset.data)),
+                                  max(1, repeat // 50))
+        results.append({'scale' : scale, 'rows' : rows, 'file_MB' : round(os.path.getsize(source) / 2**20, 1),
+            'first load s' : round(first, 3),
+            'path lookup ms' : round(median_seconds(lambda : datasets.get(source), repeat) * 1e3, 4),
+            'upload lookup ms' : round(median_seconds(lambda : datasets.get(upload), repeat) * 1e3, 4),
+            'st.cache hashes ms' : round(st_cache * 1e3, 1), 'registry' : datasets.stats()})
+    datasets.clear()
+    return results
+
+
+def environment():
+    return {'python' : platform.python_version(), 'numpy' : np.__version__, 'pandas' : pd.__version__,
+            'matplotlib' : matplotlib.__version__, 'cpus' : os.cpu_count(), 'platform' : platform.platform()}
+
+
+def run_suite(scale_names, data_dir, state = 'Texas', reruns = 30):
+    report = {'environment' : environment(), 'scales' : []}
+    for scale in scale_names:
+        report['scales'].append(benchmark_scale(scale, data_dir, state))
+    report['leak'] = leak_check(reruns = reruns, state = state)
+    return report
+
+
+def summary(report):
+    lines = []
+    for result in report['scales']:
+        failed = [check['check'] for check in result['checks'] if not check['ok']]
+        slowest = sorted((stage for stage in result['stages'] if 'seconds' in stage),
+                         key = lambda stage : -stage['seconds'])[:5]
+        lines.append('{} ({:,} rows) : {} stages, {} checks failed {}'.format(result['scale'],
+            result['rows'], len(result['stages']), len(failed), failed if failed else ''))
+        errors = [stage['stage'] for stage in result['stages'] if 'error' in stage]
+        if errors:
+            lines.append('  errors : {}'.format(errors))
+        for stage in slowest:
+            lines.append('  {:>8.3f} s {:>9.1f} MB  {}'.format(stage['seconds'], stage['peak_MB'], stage['stage']))
+    if 'leak' in report:
+        leak = report['leak']
+        if 'error' in leak:
+            lines.append('leak check : FAILED at rerun {} ({})'.format(leak['reruns'] + 1, leak['error']))
+        else :
+            lines.append('leak check : {} (max open figures {}, RSS growth {} MB over {} reruns)'.format(
+                'ok' if leak['ok'] else 'FAILED', max(leak['open_figures']), leak['rss_growth_MB'], leak['reruns']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Headless benchmark of the wildfires dashboard')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    parser_run = subparsers.add_parser('run', help = 'Measure every stage on synthetic datasets')
+    parser_run.add_argument('--scales', nargs = '+', default = list(scales),
+        help = 'Sizes relative to the complete dataset (5%%, 25%%, 100%%, 5x) or numbers of rows')
+    parser_run.add_argument('--data-dir', default = os.path.join(tempfile.gettempdir(), 'wildfires_benchmark'))
+    parser_run.add_argument('--state', default = 'Texas')
+    parser_run.add_argument('--reruns', type = int, default = 30)
+    parser_run.add_argument('--report', default = 'benchmark.json')
+    parser_generate = subparsers.add_parser('generate', help = 'Write a synthetic dataset')
+    parser_generate.add_argument('scale', nargs = '?', default = '5%')
+    parser_generate.add_argument('output', nargs = '?', default = None)
+    parser_leak = subparsers.add_parser('leak', help = 'Open figures and memory over many reruns')
+    parser_leak.add_argument('source', nargs = '?', default = None)
+    parser_leak.add_argument('--reruns', type = int, default = 30)
+    parser_registry = subparsers.add_parser('registry', help = 'Lookup of the datasets against the hashes of st.cache')
+    parser_registry.add_argument('--scales', nargs = '+', default = ['5%', '25%'])
+    parser_registry.add_argument('--data-dir', default = os.path.join(tempfile.gettempdir(), 'wildfires_benchmark'))
+    parser_registry.add_argument('--report', default = 'registry.json')
+    args = parser.parse_args()
+    if args.command == 'run':
+        os.makedirs(args.data_dir, exist_ok = True)
+        report = run_suite(args.scales, args.data_dir, args.state, args.reruns)
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent = 1)
+        print(summary(report))
+        print('Report written to {}'.format(args.report))
+    elif args.command == 'generate':
+        rows = scale_rows(args.scale)
+        output = args.output or 'wildfires_synthetic_{}.csv'.format(rows)
+        generate(rows, output)
+        print('Wrote {:,} rows to {}'.format(rows, output))
+    elif args.command == 'registry':
+        os.makedirs(args.data_dir, exist_ok = True)
+        results = registry_benchmark(args.scales, args.data_dir)
+        with open(args.report, 'w') as f:
+            json.dump(results, f, indent = 1)
+        for result in results:
+            print('{} ({:,} rows, {} MB) : first load {} s, lookup {} ms (path) {} ms (upload), '
+                  'st.cache hashes {} ms'.format(result['scale'], result['rows'], result['file_MB'],
+                  result['first load s'], result['path lookup ms'], result['upload lookup ms'],
+                  result['st.cache hashes ms']))
+    else :
+        leak = leak_check(args.source, args.reruns)
+        print(json.dumps(leak, indent = 1))
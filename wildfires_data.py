@@ -0,0 +1,388 @@
+# Loading of the wildfires dataset, with an on-disk columnar cache of the prepared frame
+#
+# Usage of the cache from the command line :
+#   python wildfires_data.py rebuild [source.csv]
+#   python wildfires_data.py clear
+#   python wildfires_data.py memory [source.csv]
+#   python wildfires_data.py append source.csv delta.csv [--verify]
+
+import os
+import json
+import shutil
+import hashlib
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError: # No cache without pyarrow, the csv is parsed at each start
+    feather = None
+
+
+data_filename = 'wildfires_final_frac0.05.csv'
+cache_dir = os.environ.get('WILDFIRES_CACHE_DIR', '.wildfires_cache')
+# To increase each time prepare_data (or a frame cached with it : cube, sketches) changes, so that
+# the old cache files are not used
+cache_version = 5
+
+dico_regions = {
+'AL': 'South-East', 'AK': 'North', 'AZ': 'South-West', 'AR': 'Center', 'CA': 'South-West',
+'CO': 'Center','CT': 'North-East','DE': 'North-East','DC': 'North-East','FL': 'South-East',
+'GA': 'South-East','HI': 'Tropical','ID': 'North-West','IL': 'Center','IN': 'North-East',
+'IA': 'Center','KS': 'Center','KY': 'East','LA': 'South-East','ME': 'North-East',
+'MD': 'North-East','MA': 'North-East','MI': 'North-East','MN': 'North','MS': 'South-East',
+'MO': 'Center','MT': 'North-West','NE': 'Center','NV': 'West','NH': 'North-East',
+'NJ': 'North-East','NM': 'South','NY': 'North-East','NC': 'East','ND': 'North','OH': 'North-East',
+'OK': 'South','OR': 'North-West','PA': 'North-East','PR': 'Tropical','RI': 'North-East',
+'SC': 'East','SD': 'North','TN': 'East','TX': 'South','UT': 'West','VT': 'North-East','VA': 'East',
+'WA': 'North-West','WV': 'North-East','WI': 'North','WY': 'North-West'}
+
+# Columns of the csv which are never used : they are skipped when reading the file
+dropped_columns = ['COUNTY', 'OWNER_DESCR', 'NWCG_CAUSE_AGE_CATEGORY',
+    'NWCG_REPORTING_AGENCY', 'geometry']
+
+# Types of the columns read in the csv (columns not listed here keep the type inferred by pandas)
+data_schema = {
+    'STATE' : 'category', 'STATE_FULL' : 'category', 'CAUSE' : 'category',
+    'NWCG_GENERAL_CAUSE' : 'category', 'NWCG_CAUSE_CLASSIFICATION' : 'category',
+    'FIRE_SIZE_CLASS' : 'category', 'Season' : 'category',
+    'DISC_YEAR' : 'int16', 'DISC_MONTH' : 'int8', 'DISC_DOW' : 'int8',
+    'FIRE_SIZE' : 'float32', 'DURATION' : 'float32',
+    'LATITUDE' : 'float32', 'LONGITUDE' : 'float32'}
+
+# Types of the columns of the prepared frame (see prepare_data), for the files written chunk by chunk :
+# a chunk can't tell the type of a column whose values are all missing. The strings of the csv which
+# are not categories are objects
+prepared_schema = dict({{'LATITUDE' : 'lat', 'LONGITUDE' : 'lon'}.get(col, col) : dtype for col, dtype in data_schema.items()},
+    FPA_ID = 'object', CONT_DATE = 'object', DISCOVERY_DATE = 'datetime64[ns]', DISC_DOY = 'int16',
+    Region = 'category')
+
+# Format of the dates of the csv
+date_format = '%Y-%m-%d'
+
+# Physical order of the rows of the loaded frame : the rows of a state, and of a year of a state,
+# are contiguous (see RowLayout)
+layout_keys = ['STATE', 'DISC_YEAR']
+
+
+# ------------------------------------------
+# ---------------------------- Preparation of the raw csv
+# ------------------------------------------
+def read_source(source, typed = True):
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    if not typed: # Default types of pandas, only used to compare the memory footprint
+        return pd.read_csv(source)
+    return pd.read_csv(source, dtype = data_schema,
+        usecols = lambda column : column not in dropped_columns)
+
+
+def read_chunks(source, chunk_size = 250000):
+    # Prepared frames of at most chunk_size rows, the whole file is never in memory
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    reader = pd.read_csv(source, dtype = data_schema, chunksize = chunk_size,
+        usecols = lambda column : column not in dropped_columns)
+    for chunk in reader:
+        yield prepare_data(chunk)
+
+
+def prepare_data(data):
+    # The dates of the csv are ISO days (2005-02-02). Given their format, pandas 1.x parses them with
+    # its ISO parser : without it, pandas 1.x parses each date with dateutil (pandas 2 infers the
+    # format from the first date)
+    data['DISCOVERY_DATE'] = pd.to_datetime(data['DISCOVERY_DATE'], format = date_format)
+    data['DISC_DOY'] = data['DISCOVERY_DATE'].dt.dayofyear.astype('int16')
+    data['Region'] = data.STATE.map(dico_regions).astype('category')
+    data.rename(columns = {'LATITUDE':'lat', 'LONGITUDE':'lon'}, inplace = True)
+    data.drop([col for col in dropped_columns if col in data.columns], axis = 1, inplace = True)
+    # Sorted and ordered categories : with observed = True, pandas only sorts the groups of
+    # ordered categoricals, the groupbys then keep the alphabetical order of the string columns
+    for col in data.select_dtypes('category').columns:
+        data[col] = data[col].cat.reorder_categories(sorted(data[col].cat.categories), ordered = True)
+    return data
+
+
+def sort_layout(data):
+    # Stable sort : within a year of a state, the rows keep the order of the file
+    return data.sort_values(layout_keys, kind = 'mergesort', ignore_index = True)
+
+
+def memory_report(data):
+    # Resident size of each column (strings included), in megabytes
+    report = pd.DataFrame({'dtype' : data.dtypes.astype(str),
+        'MB' : data.memory_usage(index = False, deep = True) / 2**20})
+    report.loc['Total'] = ['', report['MB'].sum()]
+    return report.round(2)
+
+
+def compare_memory(source = data_filename):
+    # Footprint of the frame read with the default types of pandas against the declared schema
+    untyped = prepare_data(read_source(source, typed = False))
+    typed = prepare_data(read_source(source))
+    report = pd.concat([memory_report(untyped), memory_report(typed)],
+        axis = 1, keys = ['default', 'schema'])
+    ratio = report.loc['Total', ('default', 'MB')] / report.loc['Total', ('schema', 'MB')]
+    return report, ratio
+
+
+# ------------------------------------------
+# ---------------------------- Cache of the prepared frame
+# ------------------------------------------
+def content_digest(source, chunk_size = 1 << 20):
+    # sha1 of the content of a path or a file-like object (streamlit UploadedFile), and its size
+    digest, size = hashlib.sha1(), 0
+    f = open(source, 'rb') if isinstance(source, (str, os.PathLike)) else source
+    try:
+        f.seek(0)
+        for chunk in iter(lambda : f.read(chunk_size), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    finally:
+        if f is not source:
+            f.close()
+        else :
+            f.seek(0)
+    return digest, size
+
+
+def source_fingerprint(source, digest = None):
+    # Key of a source : path, size, mtime and hash of the content. The content is always hashed : a
+    # file edited in place with the same size, or with an mtime restored by a copy, gets a new key.
+    # digest : sha1 of the content when it is already known (see append_fingerprint)
+    if digest is None:
+        digest, size = content_digest(source)
+    if isinstance(source, (str, os.PathLike)):
+        path = os.path.abspath(source)
+        stat = os.stat(path)
+        size, mtime = stat.st_size, stat.st_mtime_ns
+    else :
+        path, mtime = getattr(source, 'name', ''), None
+    return {'path' : path, 'size' : size, 'mtime' : mtime,
+            'sha1' : digest.hexdigest(), 'version' : cache_version}
+
+
+def append_fingerprint(source, digest, appended):
+    # Key of a source after the bytes appended were written at its end : the sha1 of its old content
+    # goes on with these bytes, it is the hash of the new content. The csv is not read again
+    digest.update(appended)
+    return source_fingerprint(source, digest)
+
+
+def cache_paths(fingerprint, kind = 'data'):
+    # One cache entry per source path (or upload name) and kind of frame (prepared data,
+    # aggregate cube...) : a new version of a file replaces the old one
+    name = hashlib.sha1(fingerprint['path'].encode()).hexdigest()[:16] + '.' + kind
+    return (os.path.join(cache_dir, name + '.feather'),
+            os.path.join(cache_dir, name + '.json'))
+
+
+def read_cache(fingerprint, kind = 'data'):
+    if feather is None:
+        return None
+    data_path, meta_path = cache_paths(fingerprint, kind)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta != fingerprint or not os.path.exists(data_path):
+        return None
+    # The file is memory-mapped, the columns are only copied once by to_pandas
+    return feather.read_table(data_path, memory_map = True).to_pandas()
+
+
+def temporary_path(path):
+    # Temporary file of this process and thread : the servers sharing the cache directory don't
+    # write to the same one
+    return '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+
+
+def write_cache(fingerprint, data, kind = 'data'):
+    if feather is None:
+        return
+    os.makedirs(cache_dir, exist_ok = True)
+    data_path, meta_path = cache_paths(fingerprint, kind)
+    # Write to temporary files then rename, so that a concurrent process never reads half a file
+    temporary = temporary_path(data_path)
+    data.reset_index(drop = True).to_feather(temporary)
+    os.replace(temporary, data_path)
+    temporary = temporary_path(meta_path)
+    with open(temporary, 'w') as f:
+        json.dump(fingerprint, f)
+    os.replace(temporary, meta_path)
+
+
+def load_prepared(source = data_filename, use_cache = True, fingerprint = None):
+    # fingerprint : key of the source when it is already known (the source is then not hashed again)
+    fingerprint = fingerprint or source_fingerprint(source)
+    if use_cache:
+        data = read_cache(fingerprint)
+        if data is not None:
+            return data
+    data = sort_layout(prepare_data(read_source(source)))
+    if use_cache:
+        write_cache(fingerprint, data)
+    return data
+
+
+def rebuild_cache(source = data_filename):
+    fingerprint = source_fingerprint(source)
+    data = sort_layout(prepare_data(read_source(source)))
+    write_cache(fingerprint, data)
+    return data
+
+
+def clear_cache():
+    removed = 0
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if os.path.isdir(path): # Json of the plotly figures (see wildfires_figures)
+                removed += len(os.listdir(path))
+                shutil.rmtree(path)
+            else :
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+class Pinned:
+    # Key of an object by its identity, for the caches of values computed from a frame (roll-ups,
+    # fingerprints, memo of the view graph). The key holds the object : while the key is in a cache,
+    # the object stays alive, so its id can't be given to another frame
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __hash__(self):
+        return id(self.value)
+
+    def __eq__(self, other):
+        return isinstance(other, Pinned) and other.value is self.value
+
+    def __repr__(self):
+        return 'Pinned({:#x})'.format(id(self.value))
+
+
+# ------------------------------------------
+# ---------------------------- Appending new records
+# ------------------------------------------
+# A delta file (new years of FPA_FOD...) is added to the csv and to its cached frame without parsing
+# the csv again (see wildfires_aggregates.append_records for the aggregate cube)
+def append_source(source, delta):
+    # The rows of the delta are written at the end of the csv, with the columns of the csv.
+    # They are read as text, so the csv gets the same values as the delta. Returns the bytes written
+    columns = list(pd.read_csv(source, nrows = 0).columns)
+    if hasattr(delta, 'seek'):
+        delta.seek(0)
+    new_rows = pd.read_csv(delta, dtype = str, keep_default_na = False)
+    missing = [col for col in columns if col not in new_rows.columns]
+    if missing:
+        raise ValueError('Columns missing from the delta file : {}'.format(missing))
+    with open(source, 'rb') as f:
+        f.seek(max(os.path.getsize(source) - 1, 0))
+        newline = f.read(1) in (b'\n', b'')
+    appended = ('' if newline else os.linesep) + new_rows[columns].to_csv(header = False, index = False)
+    appended = appended.encode()
+    with open(source, 'ab') as f:
+        f.write(appended)
+    return appended
+
+
+def union_categories(data, new_data):
+    # Categories of the columns of both frames, sorted and ordered as in prepare_data
+    categories = {}
+    for col in data.select_dtypes('category').columns:
+        values = set(data[col].cat.categories) | set(new_data[col].cat.categories)
+        categories[col] = sorted(values)
+    return ({col : data[col].cat.set_categories(values, ordered = True) for col, values in categories.items()},
+            {col : new_data[col].cat.set_categories(values, ordered = True) for col, values in categories.items()})
+
+
+def append_prepared(data, new_data):
+    # Prepared frame of the csv with the rows of the delta, in the layout of sort_layout. The rows of
+    # the delta come after the ones of a same state and year, as in the csv. data is not modified
+    if set(new_data.columns) != set(data.columns):
+        raise ValueError('The delta file does not have the columns of the dataset')
+    new_data = new_data[list(data.columns)]
+    categories, new_categories = union_categories(data, new_data)
+    combined = pd.concat([data.assign(**categories), new_data.assign(**new_categories)], ignore_index = True)
+    return sort_layout(combined)
+
+
+def frame_checksum(data):
+    # Hash of the columns, types, categories and values in the order of the rows : two frames with
+    # the same checksum are equal
+    digest = hashlib.sha1()
+    digest.update(repr(list(data.columns)).encode())
+    digest.update(repr(list(data.dtypes.astype(str))).encode())
+    for col in data.select_dtypes('category').columns:
+        digest.update(repr(list(data[col].cat.categories)).encode())
+    digest.update(pd.util.hash_pandas_object(data, index = False).values.tobytes())
+    return digest.hexdigest()
+
+
+# ------------------------------------------
+# ---------------------------- Offsets of the states
+# ------------------------------------------
+class RowLayout:
+    # Range of rows of each state and of each (state, year) in a frame sorted by sort_layout :
+    # the rows of a state are a slice of the frame (a view, no scan nor copy of the other rows).
+    # by : column naming the states (STATE, or STATE_FULL which has the same runs of rows)
+
+    def __init__(self, data, by = 'STATE_FULL'):
+        self.data = data
+        states = data[by].values
+        years = data['DISC_YEAR'].values
+        change = np.flatnonzero((states[1:] != states[:-1]) | (years[1:] != years[:-1])) + 1
+        starts = np.concatenate([[0], change]).astype(np.int64) if len(data) else np.array([], np.int64)
+        stops = np.append(change, len(data)).astype(np.int64) if len(data) else starts
+        self.states = {}
+        self.years = {}
+        for start, stop in zip(starts, stops):
+            state, year = states[start], int(years[start])
+            if (state, year) in self.years or (state in self.states and self.states[state][1] != start):
+                raise ValueError('The rows are not sorted by state and year (see sort_layout)')
+            self.years[(state, year)] = (start, stop)
+            self.states[state] = (self.states.get(state, (start,))[0], stop)
+
+    def rows(self, state, year = None):
+        # Rows of a state, or of one year of a state (empty frame when there is none)
+        start, stop = (self.states.get(state, (0, 0)) if year is None
+                       else self.years.get((state, year), (0, 0)))
+        return self.data.iloc[start:stop]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Manage the cache of the prepared wildfires data')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    parser_rebuild = subparsers.add_parser('rebuild', help = 'Parse the csv again and rewrite its cache')
+    parser_rebuild.add_argument('source', nargs = '?', default = data_filename)
+    subparsers.add_parser('clear', help = 'Remove every cached file')
+    parser_memory = subparsers.add_parser('memory', help = 'Memory footprint with and without the schema')
+    parser_memory.add_argument('source', nargs = '?', default = data_filename)
+    parser_append = subparsers.add_parser('append', help = 'Add the records of a delta file to the csv and its cache')
+    parser_append.add_argument('source')
+    parser_append.add_argument('delta')
+    parser_append.add_argument('--verify', action = 'store_true',
+        help = 'Compare the result with a full rebuild (parses the whole csv)')
+    args = parser.parse_args()
+    if args.command == 'rebuild':
+        df = rebuild_cache(args.source)
+        print('Cached {} rows of {} in {}'.format(len(df), args.source, cache_dir))
+    elif args.command == 'memory':
+        report, ratio = compare_memory(args.source)
+        print(report.to_string())
+        print('The schema divides the memory footprint by {:.1f}'.format(ratio))
+    elif args.command == 'append':
+        # The cube is updated too : wildfires_aggregates imports this module
+        from wildfires_aggregates import append_records
+        data, cube, report = append_records(args.source, args.delta, verify = args.verify)
+        print(json.dumps(report, indent = 1))
+    else :
+        print('Removed {} files from {}'.format(clear_cache(), cache_dir))
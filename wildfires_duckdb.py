@@ -0,0 +1,342 @@
+# Out-of-core backend of the dashboard : the prepared rows are kept in a Parquet file of the cache
+# and queried by DuckDB, only the results (aggregate cube, quantile sketches, rows of a state) are
+# pandas frames.
+# Only the cube, the sketches and the rows of a state are computed in SQL. The roll-ups of the
+# charts (wildfires_aggregates.rollup, count_of...) stay in pandas : they group the cube, whose
+# size depends on the number of keys, not on the number of rows. compare_backends checks them
+# against the same groupbys run in SQL on the rows (DuckBackend.grouped).
+# The Parquet file is written chunk by chunk and DuckDB spills its groupbys to disk above
+# WILDFIRES_DUCKDB_MEMORY : the memory of the server doesn't grow with the size of the rows.
+# Used instead of the pandas frame with WILDFIRES_BACKEND=duckdb.
+#
+# Usage from the command line :
+#   python wildfires_duckdb.py build [source.csv]
+#   python wildfires_duckdb.py parity [source.csv]
+
+import os
+import json
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    import duckdb
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # The dashboard keeps the rows in pandas
+    duckdb = None
+
+import wildfires_data
+from wildfires_data import (data_filename, read_chunks, load_prepared, source_fingerprint,
+    cache_paths, read_cache, write_cache, frame_checksum, temporary_path, prepared_schema)
+from wildfires_aggregates import (agg_keys, agg_functions, aggregate_frame, type_keys, cube_families, rollup,
+    missing_key, cube_checksum, sketch_frame, sketch_keys, sketch_values, sketch_min, sketch_gamma, zero_bin)
+
+
+query_backend = os.environ.get('WILDFIRES_BACKEND', 'pandas')
+duckdb_memory = os.environ.get('WILDFIRES_DUCKDB_MEMORY', '1GB')
+duckdb_threads = int(os.environ.get('WILDFIRES_DUCKDB_THREADS', os.cpu_count() or 1))
+# Position of the row in the csv : the rows of a state come back in the order of sort_layout
+row_column = 'ROW_ID'
+
+
+def duckdb_enabled():
+    return query_backend == 'duckdb' and duckdb is not None
+
+
+# ------------------------------------------
+# ---------------------------- Parquet file of the rows
+# ------------------------------------------
+def parquet_paths(fingerprint):
+    data_path, meta_path = cache_paths(fingerprint, kind = 'rows')
+    return os.path.splitext(data_path)[0] + '.parquet', meta_path
+
+
+def parquet_schema(chunk):
+    # Types of the file, from prepared_schema and not from the first chunk : a column without any
+    # value in it (null for arrow) would refuse the values of the next chunks. The categories and
+    # the objects are strings
+    fields = []
+    for col in chunk.columns:
+        dtype = prepared_schema.get(col)
+        if dtype in ('category', 'object'):
+            fields.append(pa.field(col, pa.string()))
+        elif dtype is not None:
+            fields.append(pa.field(col, pa.from_numpy_dtype(np.dtype(dtype))))
+        else : # Column unknown to wildfires_data : the type of its values, strings if there are none
+            field = pa.Schema.from_pandas(chunk[[col]], preserve_index = False).field(col)
+            fields.append(pa.field(col, pa.string()) if pa.types.is_null(field.type) else field)
+    return pa.schema(fields)
+
+
+def write_parquet(source, chunk_size = 250000, fingerprint = None):
+    # The prepared chunks are appended to the file, the whole csv is never in memory. The
+    # categories are written as strings (dictionary encoded by Parquet), their names in the json
+    fingerprint = fingerprint or source_fingerprint(source)
+    data_path, meta_path = parquet_paths(fingerprint)
+    os.makedirs(wildfires_data.cache_dir, exist_ok = True)
+    writer = None
+    temporary = temporary_path(data_path)
+    categories = []
+    rows = 0
+    try:
+        for chunk in read_chunks(source, chunk_size):
+            categories = list(chunk.select_dtypes('category').columns)
+            chunk[row_column] = np.arange(rows, rows + len(chunk), dtype = np.int64)
+            if writer is None:
+                writer = pq.ParquetWriter(temporary, parquet_schema(chunk))
+            # Missing strings are None for arrow, whatever the type pandas gave to the column
+            for col, field in zip(writer.schema.names, writer.schema):
+                if pa.types.is_string(field.type):
+                    chunk[col] = chunk[col].astype(object).where(chunk[col].notna(), None)
+            writer.write_table(pa.Table.from_pandas(chunk, schema = writer.schema, preserve_index = False))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(temporary, data_path)
+    meta = dict(fingerprint, categories = categories, rows = rows)
+    temporary = temporary_path(meta_path)
+    with open(temporary, 'w') as f:
+        json.dump(meta, f)
+    os.replace(temporary, meta_path)
+    return data_path, meta
+
+
+def load_parquet(source, fingerprint = None):
+    # Path of the Parquet file of the source, written again when the source changed
+    fingerprint = fingerprint or source_fingerprint(source)
+    data_path, meta_path = parquet_paths(fingerprint)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = None
+    if (meta is None or {key : meta.get(key) for key in fingerprint} != fingerprint
+            or not os.path.exists(data_path)):
+        return write_parquet(source, fingerprint = fingerprint)
+    return data_path, meta
+
+
+# ------------------------------------------
+# ---------------------------- Queries
+# ------------------------------------------
+def cell_expression(col, function):
+    # Column of the cube (see wildfires_aggregates.agg_functions) as SQL, in float64 as aggregate_frame
+    if col == 'n':
+        return 'COUNT(*)'
+    value = col.rsplit('_', 1)[0] if col.endswith(('_sq', '_min', '_max')) else col
+    value = 'CAST("{}" AS DOUBLE)'.format(value)
+    if col.endswith('_sq'):
+        return 'SUM({0} * {0})'.format(value)
+    return '{}({})'.format(function.upper(), value)
+
+
+def bin_expression(col):
+    # Bin of the quantile sketches (see wildfires_aggregates.sketch_bins)
+    value = 'CAST("{}" AS DOUBLE)'.format(col)
+    return 'CASE WHEN {0} > {1!r} THEN CAST(CEIL(LN({0}) / {2!r}) AS INTEGER) ELSE {3} END'.format(
+        value, sketch_min, float(np.log(sketch_gamma)), zero_bin)
+
+
+class DuckBackend:
+    # Same interface as RowLayout for the rows of a state, plus the aggregate cube and the first rows
+
+    def __init__(self, source = data_filename):
+        self.source = source
+        self.fingerprint = source_fingerprint(source)
+        self.path, meta = load_parquet(source, self.fingerprint)
+        self.category_columns = meta['categories']
+        # The connection is shared by the sessions of the server
+        self.lock = threading.Lock()
+        self.connection = duckdb.connect()
+        self.connection.execute("SET memory_limit = '{}'".format(duckdb_memory))
+        self.connection.execute('SET threads = {}'.format(duckdb_threads))
+        self.connection.execute("SET temp_directory = '{}'".format(
+            os.path.join(wildfires_data.cache_dir, 'duckdb').replace("'", "''")))
+        self.connection.execute("CREATE VIEW fires AS SELECT * FROM read_parquet('{}')".format(
+            self.path.replace("'", "''")))
+        self.columns = [col for col in self.query('SELECT * FROM fires LIMIT 0').columns if col != row_column]
+        self.categories = {}
+        self.cube_frame = None
+        self.sketch_frame = None
+
+    def query(self, sql, parameters = ()):
+        with self.lock:
+            return self.connection.execute(sql, list(parameters)).df()
+
+    def categories_of(self, col):
+        # All the values of a category column, as in the categories of the pandas frame
+        if col not in self.categories:
+            values = self.query('SELECT DISTINCT "{0}" FROM fires WHERE "{0}" IS NOT NULL'.format(col))[col]
+            self.categories[col] = sorted(values)
+        return self.categories[col]
+
+    def typed(self, data):
+        # Types of prepare_data : sorted and ordered categories of the whole dataset
+        for col in self.category_columns:
+            data[col] = pd.Categorical(data[col], categories = self.categories_of(col), ordered = True)
+        return data
+
+    def cube(self):
+        # Aggregate cube of the rows computed by DuckDB, kept with the cube of the pandas path.
+        # The same object is returned at each call, so its roll-ups are computed only once
+        if self.cube_frame is not None:
+            return self.cube_frame
+        cube = read_cache(self.fingerprint, kind = 'cube')
+        if cube is None:
+            cells = ', '.join('{} AS "{}"'.format(cell_expression(col, function), col)
+                              for col, function in agg_functions.items())
+            # One select by family of the cube (see wildfires_aggregates.cube_families), the keys of
+            # the other families are missing. Rows with a missing key are not in any group of pandas
+            parts = []
+            for family, family_keys in enumerate(cube_families):
+                keys = ', '.join('"{}"'.format(col) if col in family_keys else
+                                 'NULL AS "{}"'.format(col) if col in self.category_columns else
+                                 '{} AS "{}"'.format(missing_key, col) for col in agg_keys)
+                grouped = ', '.join('"{}"'.format(col) for col in family_keys)
+                observed = ' AND '.join('"{}" IS NOT NULL'.format(col) for col in family_keys)
+                parts.append('SELECT CAST({} AS TINYINT) AS family, {}, {} FROM fires WHERE {} GROUP BY {}'.format(
+                    family, keys, cells, observed, grouped))
+            cube = type_keys(self.query('{} ORDER BY family, {}'.format(' UNION ALL '.join(parts),
+                ', '.join('"{}"'.format(col) for col in agg_keys))))
+            write_cache(self.fingerprint, cube, kind = 'cube')
+        self.cube_frame = cube
+        return cube
+
+    def sketch(self):
+        # Quantile sketches of the rows : one count per key, bin and value, as sketch_frame
+        if self.sketch_frame is not None:
+            return self.sketch_frame
+        sketch = read_cache(self.fingerprint, kind = 'sketch')
+        if sketch is None:
+            keys = ', '.join('"{}"'.format(col) for col in sketch_keys)
+            observed = ' AND '.join('"{}" IS NOT NULL'.format(col) for col in sketch_keys)
+            # One select by value : its bin, and a count of 1 in its column
+            parts = []
+            for col in sketch_values:
+                ones = ', '.join('{:d} AS "{}"'.format(other == col, other) for other in sketch_values)
+                parts.append('SELECT {}, {} AS bin, {} FROM fires WHERE {} AND "{}" IS NOT NULL'.format(
+                    keys, bin_expression(col), ones, observed, col))
+            counts = ', '.join('CAST(SUM("{0}") AS BIGINT) AS "{0}"'.format(col) for col in sketch_values)
+            sketch = type_keys(self.query('SELECT {0}, bin, {1} FROM ({2}) GROUP BY {0}, bin ORDER BY {0}, bin'.format(
+                keys, counts, ' UNION ALL '.join(parts))), sketch_keys)
+            sketch['bin'] = sketch['bin'].astype(np.int32)
+            write_cache(self.fingerprint, sketch, kind = 'sketch')
+        self.sketch_frame = sketch
+        return sketch
+
+    def grouped(self, keys):
+        # Groupby of the rows in SQL, with the columns of rollup(cube, keys). The charts use the
+        # roll-ups of the cube (see the top of the module) : this one checks them, see compare_backends
+        names = ', '.join('"{}"'.format(col) for col in keys)
+        cells = ', '.join('{} AS "{}"'.format(cell_expression(col, function), col)
+                          for col, function in agg_functions.items())
+        observed = ' AND '.join('"{}" IS NOT NULL'.format(col) for col in keys)
+        return type_keys(self.query('SELECT {0}, {1} FROM fires WHERE {2} GROUP BY {0} ORDER BY {0}'.format(
+            names, cells, observed)), keys)
+
+    def rows(self, state, year = None):
+        # Rows of a state (STATE_FULL), or of one of its years, in the order of sort_layout
+        columns = ', '.join('"{}"'.format(col) for col in self.columns)
+        sql = 'SELECT {} FROM fires WHERE STATE_FULL = ?'.format(columns)
+        parameters = [state]
+        if year is not None:
+            sql += ' AND DISC_YEAR = ?'
+            parameters.append(int(year))
+        return self.typed(self.query(sql + ' ORDER BY DISC_YEAR, {}'.format(row_column), parameters))
+
+    def head(self, n = 5):
+        columns = ', '.join('"{}"'.format(col) for col in self.columns)
+        return self.typed(self.query('SELECT {} FROM fires ORDER BY {} LIMIT {}'.format(
+            columns, row_column, int(n))))
+
+
+# Backends opened by the server, by path of the csv : (size and mtime of the csv, backend)
+backends = {}
+backends_lock = threading.Lock()
+backend_locks = {}
+
+
+def open_backend(source = data_filename):
+    # Backend shared by the sessions, opened again when the csv changes (size or mtime) : its
+    # fingerprint, Parquet file and cube are then those of the new csv. A backend is opened under
+    # the lock of its path only, the other paths are served meanwhile
+    path = os.path.abspath(source)
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime_ns)
+    with backends_lock:
+        entry = backends.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        lock = backend_locks.setdefault(path, threading.Lock())
+    with lock:
+        entry = backends.get(path)
+        if entry is None or entry[0] != key:
+            entry = backends[path] = (key, DuckBackend(source))
+    return entry[1]
+
+
+# ------------------------------------------
+# ---------------------------- Parity with the pandas path
+# ------------------------------------------
+# Keys of the roll-ups of the dashboard (state_year_tmp_df, surface_avg_state, cause_month_year,
+# region_cause_df...), grouped in SQL from the rows by compare_backends
+backend_rollups = [['STATE', 'STATE_FULL', 'DISC_YEAR'], ['DISC_YEAR', 'STATE', 'STATE_FULL'],
+                   ['DISC_YEAR', 'DISC_MONTH', 'CAUSE'], ['Region', 'CAUSE'], ['DISC_DOW', 'CAUSE'],
+                   ['FIRE_SIZE_CLASS', 'CAUSE']]
+
+
+def compare_backends(source = data_filename, states = None):
+    # Cube and rows of the states queried by DuckDB against the pandas frame of the same csv
+    backend = DuckBackend(source)
+    data = load_prepared(source)
+    expected_cube = aggregate_frame(data)
+    cube = backend.cube()
+    report = {'cube cells equal' : cube_checksum(cube) == cube_checksum(expected_cube)}
+    if report['cube cells equal']:
+        sums = [col for col, function in agg_functions.items() if function == 'sum' and col != 'n']
+        expected = expected_cube[sums].values
+        report['cube sums max relative error'] = float(
+            (np.abs(cube[sums].values - expected) / np.maximum(np.abs(expected), 1)).max(initial = 0))
+    report['sketch equal'] = frame_checksum(backend.sketch()) == frame_checksum(sketch_frame(data))
+    different = []
+    for keys in backend_rollups:
+        try:
+            pd.testing.assert_frame_equal(backend.grouped(keys), rollup(expected_cube, keys),
+                                          check_categorical = False, rtol = 1e-9)
+        except AssertionError:
+            different.append(keys)
+    report['rollups compared'] = len(backend_rollups)
+    report['rollups different'] = different
+    layout = wildfires_data.RowLayout(data)
+    states = states or sorted(layout.states)
+    different = []
+    for state in states:
+        expected_rows = layout.rows(state).reset_index(drop = True)
+        try:
+            pd.testing.assert_frame_equal(backend.rows(state), expected_rows)
+        except AssertionError:
+            different.append(state)
+    report['states compared'] = len(states)
+    report['states different'] = different
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'DuckDB backend of the wildfires dashboard')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    parser_build = subparsers.add_parser('build', help = 'Write the Parquet file of the csv and its cube')
+    parser_build.add_argument('source', nargs = '?', default = data_filename)
+    parser_parity = subparsers.add_parser('parity', help = 'Compare the queries with the pandas frame')
+    parser_parity.add_argument('source', nargs = '?', default = data_filename)
+    args = parser.parse_args()
+    if duckdb is None:
+        parser.error('duckdb and pyarrow are needed by this backend')
+    if args.command == 'build':
+        backend = DuckBackend(args.source)
+        print('{} cells in the cube of {}, rows in {}'.format(len(backend.cube()), args.source, backend.path))
+    else :
+        print(json.dumps(compare_backends(args.source), indent = 1))
@@ -0,0 +1,342 @@
+# Rendering and memoization of the matplotlib charts of the dashboard (make_countplot, ridgeplot...)
+# A chart is drawn once to PNG (or SVG) bytes with the Agg canvas and its figure is closed right away :
+# pyplot keeps no figure between two reruns. The bytes are keyed by the name of the chart, a fingerprint
+# of its data and its other arguments. The cache is bounded by the size of the bytes, the least
+# recently used ones are dropped.
+# The plotly figures (choropleths...) are kept on disk as json by PlotlyCache, for all the sessions
+# and across the restarts of the server. The cache saves the plotly express calls only : st.plotly_chart
+# takes a figure (a dict is validated again into one) and serializes it at each rerun, so the json read
+# is turned back into a figure, without validation, before being serialized again by streamlit.
+
+import io
+import os
+import json
+import hashlib
+import functools
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from wildfires_data import cache_dir, temporary_path, Pinned
+from wildfires_profiling import profiler
+
+try:
+    import plotly
+    import plotly.graph_objects as go
+except ImportError: # No plotly figure to cache
+    plotly = None
+
+
+# Memory bound of the cache, in megabytes
+figure_cache_mb = float(os.environ.get('WILDFIRES_FIGURE_CACHE_MB', 256))
+# Number of frames whose fingerprint is remembered
+fingerprint_entries = 64
+# Same output as st.pyplot
+render_options = {'dpi' : 200, 'bbox_inches' : 'tight'}
+# Directory and memory bound (megabytes) of the json of the plotly figures
+plotly_cache_dir = os.path.join(cache_dir, 'figures')
+plotly_cache_mb = float(os.environ.get('WILDFIRES_PLOTLY_CACHE_MB', 256))
+# To increase each time a cached plotly chart changes, so that its old json is not used
+plotly_cache_version = 1
+# Worker processes drawing the independent charts of a page, no pool with 0 or 1. The ridgeplot
+# takes about 70% of the time of the five charts of a state : it is drawn by one worker while the
+# other one draws the four other charts, more workers only cost their start and their memory
+render_workers = int(os.environ.get('WILDFIRES_RENDER_WORKERS', min(2, os.cpu_count() or 1)))
+
+
+def frame_fingerprint(data):
+    # Hash of the values, index, columns and types of a frame (or series, index)
+    digest = hashlib.sha1()
+    if isinstance(data, pd.DataFrame):
+        digest.update(repr(list(data.columns)).encode())
+        digest.update(repr(list(data.dtypes.astype(str))).encode())
+    else :
+        digest.update(repr(data.dtype).encode())
+    if isinstance(data, pd.Index):
+        data = data.to_series()
+    digest.update(pd.util.hash_pandas_object(data, index = True).values.tobytes())
+    return digest.hexdigest()
+
+
+def figure_of(output):
+    # The helpers return a figure, or a seaborn grid (ridgeplot)
+    return getattr(output, 'fig', output)
+
+
+def render_figure(output, format = 'png'):
+    # Bytes of the figure drawn by the Agg canvas, whatever the backend of pyplot. The figure is
+    # closed even if the drawing fails, it is no longer usable afterwards
+    fig = figure_of(output)
+    try:
+        FigureCanvasAgg(fig)
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format = format, **render_options)
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def render_chart(chart, args, kwargs, format = 'png'):
+    # The style changes made by a chart (sns.set_theme in ridgeplot...) don't leak to the next ones
+    with plt.rc_context():
+        return render_figure(chart(*args, **kwargs), format)
+
+
+def init_worker(rc):
+    # The plotting helpers are imported once by worker, before its first chart
+    import wildfires_plots
+    plt.rcParams.update(rc)
+
+
+pool = None
+# The sessions (one thread each) create and drop the pool under this lock : one pool for the server
+pool_lock = threading.Lock()
+
+def render_pool():
+    # Created at the first use, after the script has set the style of the plots : the workers start
+    # with the same rcParams. They are started by a forkserver (spawn where there is none) : a fork
+    # of the server would copy the locks held by its other threads and the memory of the datasets
+    global pool
+    with pool_lock:
+        if pool is None and render_workers > 1:
+            rc = {key : value for key, value in plt.rcParams.items() if key != 'backend'}
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('forkserver')
+                # The workers are forks of a server which imported the plots once
+                context.set_forkserver_preload(['wildfires_plots'])
+            else :
+                context = multiprocessing.get_context('spawn')
+            pool = ProcessPoolExecutor(render_workers, mp_context = context,
+                                       initializer = init_worker, initargs = (rc,))
+        return pool
+
+
+def drop_pool(broken = None):
+    # A broken pool is replaced at the next use. broken : the pool which failed, kept if another
+    # session already replaced it
+    global pool
+    with pool_lock:
+        if pool is not None and (broken is None or pool is broken):
+            pool.shutdown(wait = False)
+            pool = None
+
+
+class FigureCache:
+
+    def __init__(self, max_mb = figure_cache_mb):
+        self.max_bytes = int(max_mb * 2**20)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # Fingerprints of the last frames seen, by id : a frame memoized upstream is only hashed once
+        self.fingerprints = OrderedDict()
+
+    def fingerprint(self, data):
+        key = Pinned(data)
+        with self.lock:
+            fingerprint = self.fingerprints.get(key)
+            if fingerprint is not None:
+                self.fingerprints.move_to_end(key)
+                return fingerprint
+        # Hashed outside the lock, the other sessions are not blocked meanwhile
+        fingerprint = frame_fingerprint(data)
+        with self.lock:
+            self.fingerprints[key] = fingerprint
+            if len(self.fingerprints) > fingerprint_entries:
+                self.fingerprints.popitem(last = False)
+        return fingerprint
+
+    def key_of(self, value):
+        if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+            return ('frame', self.fingerprint(value))
+        if isinstance(value, (list, tuple, range)):
+            return tuple(self.key_of(item) for item in value)
+        if isinstance(value, dict):
+            return tuple(sorted((key, self.key_of(item)) for key, item in value.items()))
+        return repr(value)
+
+    def key(self, name, args, kwargs):
+        return (name, self.key_of(args), self.key_of(kwargs))
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+
+    def put(self, key, image):
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = image
+            self.size += len(image)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                self.size -= len(self.entries.popitem(last = False)[1])
+
+    def cached(self, chart = None, format = 'png'):
+        # Decorator of the functions drawing a chart (with the plot helpers, then plt.title...) :
+        # the function returns its figure, the decorated one returns the bytes of the figure
+        if chart is None:
+            return lambda chart : self.cached(chart, format)
+        @functools.wraps(chart)
+        def wrapper(*args, **kwargs):
+            key = self.key(chart.__name__, args, dict(kwargs, format = format))
+            image = self.get(key)
+            if image is None:
+                # Drawing (seaborn, matplotlib) and encoding are separate spans
+                with profiler.span('draw ' + chart.__name__, 'chart'):
+                    fig = chart(*args, **kwargs)
+                with profiler.span('savefig ' + chart.__name__, 'chart'):
+                    image = render_figure(fig, format)
+                self.put(key, image)
+            return image
+        return wrapper
+
+    def render_many(self, jobs, format = 'png'):
+        # jobs : (chart, args, kwargs) with chart a function of a module (wildfires_plots), the charts
+        # missing from the cache are drawn at the same time by the workers.
+        # The bytes are returned in the order of the jobs
+        keys = [self.key(chart.__name__, args, dict(kwargs, format = format))
+                for chart, args, kwargs in jobs]
+        images = [self.get(key) for key in keys]
+        missing = [i for i, image in enumerate(images) if image is None]
+        futures = {}
+        executor = render_pool() if len(missing) > 1 else None
+        if executor is not None:
+            futures = {i : executor.submit(render_chart, *jobs[i], format) for i in missing}
+        for i in missing:
+            # With the pool : waiting time for the chart drawn by a worker
+            with profiler.span('render ' + jobs[i][0].__name__, 'chart'):
+                try:
+                    images[i] = futures[i].result() if i in futures else render_chart(*jobs[i], format)
+                except BrokenProcessPool: # A worker died (out of memory...) : drawn here
+                    drop_pool(executor)
+                    images[i] = render_chart(*jobs[i], format)
+            self.put(keys[i], images[i])
+        return images
+
+    def stats(self):
+        return {'hits' : self.hits, 'misses' : self.misses, 'entries' : len(self.entries),
+                'MB' : round(self.size / 2**20, 1), 'max MB' : round(self.max_bytes / 2**20, 1)}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.fingerprints.clear()
+            self.size = 0
+
+
+figure_cache = FigureCache()
+
+
+class PlotlyCache(FigureCache):
+    # json of the plotly figures in files named by the hash of their key : name of the chart,
+    # fingerprints of its frames (so of the dataset) and its other arguments. A new session, or a
+    # restart of the server, reads the json instead of running plotly express again. The files
+    # are written atomically, the oldest ones are removed above max_mb
+
+    def __init__(self, directory = plotly_cache_dir, max_mb = plotly_cache_mb):
+        super().__init__(max_mb)
+        self.directory = directory
+
+    def path(self, key):
+        key = (key, plotly_cache_version, getattr(plotly, '__version__', None))
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + '.json')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                spec = f.read()
+            os.utime(path) # Most recently used : removed last by prune
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        # The json was written from a valid figure : it is not validated again. The figure is still
+        # built, st.plotly_chart can't be given the json as is
+        return go.Figure(json.loads(spec), _validate = False)
+
+    def put(self, key, fig):
+        os.makedirs(self.directory, exist_ok = True)
+        path = self.path(key)
+        # Temporary file of this process : the sessions of several servers can share the directory
+        temporary = temporary_path(path)
+        with open(temporary, 'w') as f:
+            f.write(fig.to_json())
+        os.replace(temporary, path)
+        self.prune()
+
+    def files(self):
+        if not os.path.isdir(self.directory):
+            return []
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError: # Removed by another process
+                continue
+            if name.endswith('.json'):
+                files.append((stat.st_mtime, stat.st_size, path))
+        return sorted(files)
+
+    def prune(self):
+        files = self.files()
+        size = sum(file[1] for file in files)
+        for mtime, file_size, path in files[:-1]:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= file_size
+
+    def cached(self, chart):
+        # Decorator of the functions returning a plotly figure
+        if plotly is None:
+            return chart
+        @functools.wraps(chart)
+        def wrapper(*args, **kwargs):
+            key = self.key(chart.__name__, args, kwargs)
+            with profiler.span('read json ' + chart.__name__, 'cache'):
+                fig = self.get(key)
+            if fig is None:
+                with profiler.span('plotly ' + chart.__name__, 'chart'):
+                    fig = chart(*args, **kwargs)
+                with profiler.span('write json ' + chart.__name__, 'cache'):
+                    self.put(key, fig)
+            return fig
+        return wrapper
+
+    def stats(self):
+        files = self.files()
+        return {'hits' : self.hits, 'misses' : self.misses, 'entries' : len(files),
+                'MB' : round(sum(file[1] for file in files) / 2**20, 1),
+                'max MB' : round(self.max_bytes / 2**20, 1)}
+
+    def clear(self):
+        for mtime, size, path in self.files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self.lock:
+            self.fingerprints.clear()
+
+
+plotly_cache = PlotlyCache()
@@ -0,0 +1,424 @@
+# Plot helpers of the dashboard, and the charts drawn in worker processes (see wildfires_figures).
+# They live in a module of their own so that the workers can import them : a function defined in
+# the streamlit script can't be sent to another process.
+
+import colorsys
+
+import numpy as np
+import pandas as pd
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+import seaborn as sns
+from pandas.api.types import is_numeric_dtype as is_numeric
+
+from wildfires_aggregates import grouped_ci, doy_density
+
+
+# ------------------------------------ Countplots
+def make_countplot(data, x, title = '',
+    xtitle ='', ytitle = 'Number of \nevents',
+    x_rot = 0, rm_legend = False,
+    color_plot = None, palette = None,
+    order = None, xlabels = None,
+    hue = None, hue_order = None, edgecolor = 'black',
+    linewidth = 0.8, width = 8, height = 2.5):
+    fig, ax = plt.subplots(figsize = (width, height))
+    sns.countplot(x = x, data = data,
+            hue = hue, hue_order = hue_order, order = order, edgecolor = edgecolor,
+            color = color_plot, palette = palette, linewidth = linewidth,
+            ax = ax)
+    plt.xlabel(xtitle)
+    plt.ylabel(ytitle)
+    plt.title(title, y = 1.1)
+    ax.tick_params(axis='x', labelrotation= x_rot)
+    if xlabels :
+        ax.set_xticklabels(labels = xlabels, rotation = x_rot, ha = 'center')
+    if rm_legend :
+        ax.get_legend().remove()
+    else :
+        plt.legend(ncol=2, title = '', fontsize = 9)
+    return(fig)
+
+
+def make_countplot_with_annot(data, x, title = '',
+    xtitle ='', ytitle = 'Number of \nevents',
+    x_rot = 0, xlabels = None,
+    color_plot = None, palette = None,
+    order = None, linewidth = 0.8, edgecolor = 'black',
+    width = 8, height = 2.5, rm_legend = False):
+# Work only for dataframe with CAUSE
+    fig, ax = plt.subplots(figsize = (width, height))
+    sns.countplot(x = x, data = data,
+            order = order, edgecolor = edgecolor,
+            color = color_plot, palette = palette, linewidth = linewidth,
+            ax = ax)
+    if xlabels :
+        ax.set_xticklabels(labels = xlabels, rotation = x_rot, ha = 'center')
+    ax.set_xlabel('')
+    ax.set_ylim(0, max(data.CAUSE.value_counts()) + max(data.CAUSE.value_counts())*0.3)
+    ax.set_ylabel(ytitle)
+    ax.set_title(title, y = 1.1);
+    for i in range(len(order)) :
+        ax.annotate(str(round((data[x] == order[i]).sum() *100/data.shape[0], 1) ) + '%',
+            xy = (i, (data[x] == order[i]).sum() + max(data.CAUSE.value_counts())*0.1),
+            ha = 'center' )
+    if rm_legend :
+        ax.get_legend().remove()
+    return(fig)
+
+# ------------------------------------ Boxplot
+def make_boxplot(data, x, y, title = '',
+    xtitle ='', ytitle = 'Number of \nevents',
+    x_rot = 0, xlabels = None,
+    color_plot = None, palette = None,
+    hue = None, hue_order = None,
+    width = 8, height = 2.5):
+    fig, ax = plt.subplots(figsize = (width, height))
+    sns.boxplot(x = x, y = y,
+            data = data,
+            hue = hue, hue_order = hue_order,
+            color = color_plot, palette = palette,
+            ax = ax)
+    if xlabels :
+        ax.set_xticklabels(xlabels)
+    ax.tick_params(axis='x', labelrotation= x_rot)
+    ax.set_xlabel(xtitle)
+    ax.set_ylabel(ytitle)
+    plt.title(title, y = 1.1)
+    return(fig)
+
+# ------------------------------------ Barplot
+def make_barplot(data, x, y, title = '',
+    xtitle = '', x_rot = 0, order = None,
+    hue = None, hue_order = None,
+    xlabels = None, ytitle = '',
+    palette = None, color_plot = None, linewidth = 0.8,
+    errcolor='.26', errwidth=None, edgecolor = 'black',
+    width = 8, height = 2.5, rm_legend = False, ncol = 3,
+    ci_method = 'analytic', n_boot = 1000):
+    # Mean of the numeric variable by category (and hue), with its 95% confidence interval
+    # (analytic, or bootstrap drawn at once for all the bars, see grouped_ci)
+    value, category = (x, y) if is_numeric(data[x]) and not is_numeric(data[y]) else (y, x)
+    keys = [category] + ([hue] if hue else [])
+    stats = grouped_ci(data, keys, value, method = ci_method, n_boot = n_boot)
+    return make_barplot_from_stats(stats, x, y,
+        ci = (value + '_low', value + '_high') if ci_method else None,
+        title = title, xtitle = xtitle, x_rot = x_rot,
+        order = levels_of(data[category], order), hue = hue,
+        hue_order = levels_of(data[hue], hue_order) if hue else None,
+        xlabels = xlabels, ytitle = ytitle, palette = palette, color_plot = color_plot,
+        linewidth = linewidth, errcolor = errcolor, errwidth = errwidth,
+        width = width, height = height, rm_legend = rm_legend, ncol = ncol)
+
+def ridgeplot(data, title = 'Distribution of wildfires \nalong a year') :
+    return ridgeplot_from_density(doy_density(data), title)
+
+def ridgeplot_from_density(density, title = 'Distribution of wildfires \nalong a year') :
+    # density : one row per year, one column per day (see doy_density)
+    sns.set_theme(style="white", rc={"axes.facecolor": (0, 0, 0, 0)})
+    g = sns.FacetGrid(pd.DataFrame({'DISC_YEAR' : density.index}),
+                      row = 'DISC_YEAR', aspect=10, height=0.4)
+    days = density.columns.values
+    for i, ax in enumerate(g.axes.flat):
+        curve = density.iloc[i].values
+        ax.fill_between(days, curve, clip_on=True, color = '#BCC6D1',
+                        alpha=1, linewidth=1.5)
+        ax.plot(days, curve, clip_on=False, color="w", lw=3) # White contour
+        ax.axhline(y=0, color =  '#BCC6D1', lw=2, clip_on=False)
+    g.fig.subplots_adjust(hspace=-0.5)
+    for i, ax in enumerate(g.axes.flat):
+        ax.text(-60, 0.0005,
+                density.index[i],
+                fontweight='bold', fontsize=15,
+                color= 'grey')
+    g.set_titles("")
+    g.set(yticks=[])
+    g.despine(bottom=True, left=True)
+    axes = g.axes.flatten()
+    for ax in axes:
+        ax.set_ylabel("")
+    plt.xlim(-5, 365)
+    plt.xticks(ticks = [0, 181, 360], labels=['Jan', 'Jun','Dec'])
+    plt.setp(ax.get_xticklabels(), fontsize=15)
+    plt.xlabel('', fontsize=15)
+    g.fig.suptitle(title,
+                   ha='center',
+                   y=1.05,
+                   fontsize=18, fontweight='bold')
+    return(g)
+
+# ------------------------------------ Lineplot
+def make_lineplot(data, x, y, title = '',
+    xtitle ='', ytitle = 'Number of \nevents',
+    x_rot = 0, xlabels = None,
+    color_plot = None, palette = None,
+    marker = 'o', hue = None, hue_order = None,
+    width = 8, height = 2.5, ci_method = 'analytic', n_boot = 1000):
+    # Mean of y by x (and hue) with the band of its 95% confidence interval (see grouped_ci)
+    stats = grouped_ci(data, [x] + ([hue] if hue else []), y, method = ci_method, n_boot = n_boot)
+    fig = make_lineplot_from_stats(stats, x, y,
+        ci = (y + '_low', y + '_high') if ci_method else None,
+        title = title, xtitle = xtitle, ytitle = ytitle, x_rot = x_rot, xlabels = xlabels,
+        color_plot = color_plot, palette = palette, marker = marker,
+        hue = hue, hue_order = levels_of(data[hue], hue_order) if hue else None,
+        width = width, height = height)
+    if not hue :
+        plt.legend(ncol=3, bbox_to_anchor=(1, -0.2))
+    return(fig)
+
+
+# ------------------------------------------
+# ---------------------------- Helpers drawing aggregates
+# ------------------------------------------
+# Counterparts of the helpers above for frames already aggregated (roll-ups of the cube) :
+# the bars, boxes and lines are drawn from one row per category, whatever the number of fires.
+# They keep the look of seaborn (saturation of the colors, gray lines of the boxes...)
+def levels_of(values, order = None):
+    # Order of the categories as seaborn : categories of a categorical, sorted numbers, else appearance
+    if order is not None:
+        return list(order)
+    if hasattr(values, 'cat'):
+        return list(values.cat.categories)
+    levels = list(pd.unique(values))
+    if np.issubdtype(np.asarray(levels).dtype, np.number):
+        levels = sorted(levels)
+    return levels
+
+
+def colors_of(n, color_plot = None, palette = None, saturation = 0.75):
+    if palette is not None:
+        colors = sns.color_palette(palette, n)
+    else :
+        colors = [color_plot if color_plot is not None else 'C0'] * n
+    return [sns.desaturate(color, saturation) for color in colors]
+
+
+def make_countplot_from_counts(counts, x, y = 'count', title = '',
+    xtitle ='', ytitle = 'Number of \nevents',
+    x_rot = 0, color_plot = None, palette = None,
+    order = None, xlabels = None, edgecolor = 'black',
+    linewidth = 0.8, width = 8, height = 2.5):
+    # counts : one row per value of x, with its number of fires in y
+    order = levels_of(counts[x], order)
+    heights = counts.set_index(x)[y].reindex(order).fillna(0).values
+    fig, ax = plt.subplots(figsize = (width, height))
+    ax.bar(np.arange(len(order)), heights, width = 0.8,
+        color = colors_of(len(order), color_plot, palette),
+        edgecolor = edgecolor, linewidth = linewidth)
+    ax.set_xticks(np.arange(len(order)))
+    ax.set_xticklabels([str(value) for value in order])
+    ax.set_xlim(-0.5, len(order) - 0.5)
+    plt.xlabel(xtitle)
+    plt.ylabel(ytitle)
+    plt.title(title, y = 1.1)
+    ax.tick_params(axis='x', labelrotation= x_rot)
+    if xlabels :
+        ax.set_xticklabels(labels = xlabels, rotation = x_rot, ha = 'center')
+    return(fig)
+
+
+def make_countplot_with_annot_from_counts(counts, x, y = 'count', title = '',
+    xtitle ='', ytitle = 'Number of \nevents',
+    x_rot = 0, xlabels = None,
+    color_plot = None, palette = None,
+    order = None, linewidth = 0.8, edgecolor = 'black',
+    width = 8, height = 2.5):
+    # Same annotations as make_countplot_with_annot : share of each bar in the total number of fires
+    fig = make_countplot_from_counts(counts, x, y, xtitle = xtitle, ytitle = ytitle,
+        x_rot = x_rot, color_plot = color_plot, palette = palette, order = order,
+        xlabels = xlabels, edgecolor = edgecolor, linewidth = linewidth, width = width, height = height)
+    ax = fig.axes[0]
+    order = levels_of(counts[x], order)
+    heights = counts.set_index(x)[y].reindex(order).fillna(0).values
+    total, top = counts[y].sum(), counts[y].max()
+    ax.set_xlabel('')
+    ax.set_ylim(0, top + top*0.3)
+    ax.set_title(title, y = 1.1);
+    for i in range(len(order)) :
+        ax.annotate(str(round(heights[i] *100/total, 1) ) + '%',
+            xy = (i, heights[i] + top*0.1),
+            ha = 'center' )
+    return(fig)
+
+
+def make_barplot_from_stats(stats, x, y, ci = None, title = '',
+    xtitle = '', x_rot = 0, order = None,
+    hue = None, hue_order = None,
+    xlabels = None, ytitle = '',
+    palette = None, color_plot = None, linewidth = 0.8,
+    errcolor='.26', errwidth=None,
+    width = 8, height = 2.5, rm_legend = False, ncol = 3):
+    # stats : one row per category (and hue), with the height of its bar. The bars are horizontal
+    # when x is the numeric column. ci : columns of the bounds (low, high) of the error bars
+    horizontal = is_numeric(stats[x]) and not is_numeric(stats[y])
+    value, category = (x, y) if horizontal else (y, x)
+    order = levels_of(stats[category], order)
+    levels = levels_of(stats[hue], hue_order) if hue else [None]
+    if hue :
+        colors = [sns.desaturate(color, 0.75) for color in sns.color_palette(palette, len(levels))]
+    else :
+        colors = colors_of(len(order), color_plot, palette)
+    errwidth = errwidth if errwidth is not None else mpl.rcParams['lines.linewidth'] * 1.8
+    bar_width = 0.8 / len(levels)
+    fig, ax = plt.subplots(figsize = (width, height))
+    positions = np.arange(len(order))
+    for j, level in enumerate(levels):
+        bars = stats if level is None else stats[stats[hue] == level]
+        bars = bars.set_index(category).reindex(order)
+        offsets = positions - 0.4 + bar_width * (j + 0.5) if hue else positions
+        color = colors[j] if hue else colors
+        draw = ax.barh if horizontal else ax.bar
+        draw(offsets, bars[value].values, bar_width, color = color,
+            linewidth = linewidth, label = level)
+        if ci is not None:
+            for offset, low, high in zip(offsets, bars[ci[0]].values, bars[ci[1]].values):
+                bounds = ([low, high], [offset, offset]) if horizontal else ([offset, offset], [low, high])
+                ax.plot(*bounds, color = errcolor, linewidth = errwidth)
+    labels = [str(level) for level in order]
+    if horizontal :
+        ax.set_yticks(positions)
+        ax.set_yticklabels(labels)
+        ax.set_ylim(len(order) - 0.5, -0.5)
+        ax.yaxis.grid(False)
+    else :
+        ax.set_xticks(positions)
+        ax.set_xticklabels(labels)
+        ax.set_xlim(-0.5, len(order) - 0.5)
+        ax.xaxis.grid(False)
+    if xlabels :
+        ax.set_xticklabels(xlabels)
+    if not rm_legend :
+        plt.legend(ncol=ncol, bbox_to_anchor=(1, -0.2))
+    ax.tick_params(axis='x', labelrotation= x_rot)
+    ax.set_xlabel(xtitle)
+    ax.set_ylabel(ytitle)
+    plt.title(title, y = 1.1)
+    return(fig)
+
+
+def box_stats(data, x, y, whis = 1.5):
+    # Quartiles, whiskers (last values within whis x IQR of the box) and outliers of y for each x,
+    # in the format of Axes.bxp
+    quartiles = data.groupby(x, observed = True)[y].quantile([0.25, 0.5, 0.75]).unstack()
+    quartiles.columns = ['q1', 'med', 'q3']
+    values = data[[x, y]].join(quartiles, on = x)
+    iqr = values['q3'] - values['q1']
+    inside = values[y].between(values['q1'] - whis*iqr, values['q3'] + whis*iqr)
+    whiskers = values[inside].groupby(x, observed = True)[y].agg(['min', 'max'])
+    fliers = values[~inside].groupby(x, observed = True)[y].apply(list)
+    return {key : {'label' : key, 'q1' : row.q1, 'med' : row.med, 'q3' : row.q3,
+                   'whislo' : whiskers.loc[key, 'min'], 'whishi' : whiskers.loc[key, 'max'],
+                   'fliers' : fliers.get(key, [])}
+            for key, row in quartiles.iterrows()}
+
+
+def make_boxplot_from_stats(stats, title = '',
+    xtitle ='', ytitle = 'Number of \nevents',
+    x_rot = 0, order = None, xlabels = None,
+    color_plot = None, palette = None, log = False,
+    width = 8, height = 2.5):
+    # stats : statistics of each box by value of x (see box_stats, or sketch_box_stats of
+    # wildfires_aggregates). log : logarithmic y axis
+    order = list(stats) if order is None else order
+    colors = colors_of(len(order), color_plot, palette)
+    # Lines of the boxes in gray, darker than the darkest box (as seaborn)
+    lum = min(colorsys.rgb_to_hls(*color)[1] for color in colors) * .6
+    gray = mpl.colors.rgb2hex((lum, lum, lum))
+    line = {'color' : gray, 'linewidth' : mpl.rcParams['lines.linewidth']}
+    fig, ax = plt.subplots(figsize = (width, height))
+    boxes = ax.bxp([stats[key] for key in order], positions = np.arange(len(order)),
+        widths = 0.8, patch_artist = True, showfliers = True,
+        boxprops = dict(line, facecolor = 'white'), whiskerprops = line, capprops = line,
+        medianprops = line, flierprops = {'marker' : 'd', 'markerfacecolor' : gray,
+            'markeredgecolor' : gray, 'markersize' : 5})
+    for box, color in zip(boxes['boxes'], colors):
+        box.set_facecolor(color)
+    ax.set_xticks(np.arange(len(order)))
+    ax.set_xticklabels([str(key) for key in order])
+    ax.set_xlim(-0.5, len(order) - 0.5)
+    if log :
+        ax.set_yscale('log')
+    if xlabels :
+        ax.set_xticklabels(xlabels)
+    ax.tick_params(axis='x', labelrotation= x_rot)
+    ax.set_xlabel(xtitle)
+    ax.set_ylabel(ytitle)
+    plt.title(title, y = 1.1)
+    return(fig)
+
+
+def make_lineplot_from_stats(data, x, y, ci = None, title = '',
+    xtitle ='', ytitle = 'Number of \nevents',
+    x_rot = 0, xlabels = None,
+    color_plot = None, palette = None,
+    marker = 'o', hue = None, hue_order = None,
+    width = 8, height = 2.5):
+    # data : one row per x (and hue), y is the value of the line. ci is the column of the half width
+    # of its confidence band, or the columns of its bounds (low, high). No band without ci
+    fig, ax = plt.subplots(figsize = (width, height))
+    levels = levels_of(data[hue], hue_order) if hue else [None]
+    if hue and palette is not None:
+        colors = sns.color_palette(palette, len(levels))
+    elif hue :
+        colors = sns.color_palette(n_colors = len(levels))
+    else :
+        colors = [color_plot if color_plot is not None else 'C0']
+    for level, color in zip(levels, colors):
+        line = data if level is None else data[data[hue] == level]
+        line = line.sort_values(x)
+        ax.plot(line[x], line[y], color = color, marker = marker,
+            markeredgecolor = 'w', markeredgewidth = 0.75, label = level)
+        if isinstance(ci, str):
+            ax.fill_between(line[x], line[y] - line[ci], line[y] + line[ci],
+                color = color, alpha = 0.2, linewidth = 0)
+        elif ci is not None:
+            ax.fill_between(line[x], line[ci[0]], line[ci[1]],
+                color = color, alpha = 0.2, linewidth = 0)
+    if xlabels :
+        ax.set_xticklabels(xlabels)
+    ax.tick_params(axis='x', labelrotation= x_rot)
+    ax.set_xlabel(xtitle)
+    ax.set_ylabel(ytitle)
+    if hue :
+        plt.legend(ncol=3, bbox_to_anchor=(1, -0.2))
+    plt.title(title, y = 1.1)
+    return(fig)
+
+
+# ------------------------------------------
+# ---------------------------- Charts of the 'By State' tab
+# ------------------------------------------
+# Each chart receives only the roll-up (or the columns) it draws, they are sent to the workers
+def state_count_year(state_year_count):
+    f1 = make_countplot_from_counts( state_year_count,
+    'DISC_YEAR', xtitle ='', ytitle = '\n\n', x_rot = 90, color_plot = 'lightslategray')
+    plt.title('Number of fires per year', fontsize=15, fontweight='bold')
+    return f1
+
+
+def state_surf_year_lineplot(state_surf_year):
+    f2 = make_lineplot_from_stats(state_surf_year,
+        'DISC_YEAR', 'FIRE_SIZE',
+        xtitle = '', x_rot = 90, xlabels = range(1992, 2019),
+        ytitle = 'Total surface burnt\n(hectares)', color_plot='lightslategray')
+    plt.title('Total surface burnt per year', fontsize=15, fontweight='bold')
+    return f2
+
+
+def state_month_boxplot(state_nb_month, xlabels, palette):
+    f3 = make_boxplot_from_stats(box_stats(state_nb_month, 'DISC_MONTH', 'FPA_ID'),
+        xtitle = '', x_rot = 0, xlabels = xlabels,
+        ytitle = 'Number of fires \nper year', palette = palette)
+    plt.title('Number of fires per month', fontsize=15, fontweight='bold')
+    return f3
+
+
+def state_duration_lineplot(state_duration):
+    f5=make_lineplot_from_stats(state_duration,
+        x='Year', y='Avg duration of a fire (days)', x_rot = 45, marker = 'o',
+        width = 9, height = 5, color_plot='#B26A22')
+    plt.ylabel('Average duration (days)', fontsize=12)
+    plt.xlabel('', fontsize=12)
+    plt.xticks(range(1992,2018))
+    plt.title('Change in the fire duration over the period', fontsize=15, fontweight='bold')
+    return f5
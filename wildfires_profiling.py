@@ -0,0 +1,193 @@
+# Profiling of the reruns of the dashboard : spans of time and memory around the loading of the data,
+# the frames of the view graph, the drawing of the charts (seaborn, plotly), their encoding and their
+# transfer to the browser (st.pyplot, st.plotly_chart...).
+# Off by default, a span is then a shared empty context. On with WILDFIRES_PROFILE=1 for all the
+# sessions, or with ?profile=1 in the url of a page for its session. The spans of the last reruns
+# are exported as a Chrome trace (chrome://tracing, https://ui.perfetto.dev).
+
+import os
+import json
+import time
+import functools
+import threading
+import contextlib
+from collections import deque
+
+
+profile_env = os.environ.get('WILDFIRES_PROFILE', '') not in ('', '0')
+# Number of reruns (of all the sessions) kept for the trace
+profile_reruns = int(os.environ.get('WILDFIRES_PROFILE_RERUNS', 20))
+
+try:
+    page_size = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError): # Not unix : no memory in the spans
+    page_size = None
+
+no_span = contextlib.nullcontext()
+
+
+def rss_bytes():
+    # Resident memory of the process, 0 where /proc is missing
+    if page_size is None:
+        return 0
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * page_size
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class Profiler:
+    # The spans are recorded by thread : streamlit runs the script of each session in its own thread
+
+    def __init__(self, max_reruns = profile_reruns):
+        self.local = threading.local()
+        self.reruns = deque(maxlen = max_reruns)
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+
+    def now(self):
+        # Microseconds, the unit of the Chrome traces
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def start_rerun(self, enabled = profile_env, label = 'rerun'):
+        if not enabled:
+            self.local.rerun = None
+            return False
+        self.local.rerun = {'label' : label, 'thread' : threading.get_ident(), 'start' : self.now(),
+                            'end' : None, 'rss' : rss_bytes(), 'spans' : []}
+        # Time of the children of the open spans, to get the time spent in each span itself
+        self.local.stack = []
+        with self.lock:
+            self.reruns.append(self.local.rerun)
+        return True
+
+    def end_rerun(self):
+        rerun = self.current()
+        if rerun is not None:
+            rerun['end'] = self.now()
+            self.local.rerun = None
+        return rerun
+
+    def current(self):
+        return getattr(self.local, 'rerun', None)
+
+    def active(self):
+        return self.current() is not None
+
+    def span(self, name, category = 'app'):
+        if self.current() is None:
+            return no_span
+        return self.recorded_span(name, category)
+
+    @contextlib.contextmanager
+    def recorded_span(self, name, category):
+        rerun, stack = self.current(), self.local.stack
+        rss = rss_bytes()
+        start = self.now()
+        stack.append(0)
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            duration = self.now() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += duration
+            span = {'name' : name, 'category' : category, 'start' : start, 'duration' : duration,
+                    'self' : duration - children, 'rss_delta' : rss_bytes() - rss, 'depth' : len(stack)}
+            if error is not None:
+                span['error'] = error
+            rerun['spans'].append(span)
+
+    def traced(self, name = None, category = 'app'):
+        # Decorator : each call of the function is a span
+        def decorate(function):
+            label = name or function.__name__
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(label, category):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def instrument(self, module):
+        # The streamlit module with its outputs recorded as spans
+        return InstrumentedOutputs(module, self) if self.active() else module
+
+    def breakdown(self, rerun = None):
+        # Spans of a rerun (by default the last one of this thread) grouped by name, the slowest first
+        if rerun is None:
+            rerun = self.last_rerun()
+        if rerun is None:
+            return []
+        rows = {}
+        for span in rerun['spans']:
+            row = rows.setdefault(span['name'], {'span' : span['name'], 'category' : span['category'],
+                'calls' : 0, 'total ms' : 0.0, 'self ms' : 0.0, 'RSS MB' : 0.0})
+            row['calls'] += 1
+            row['total ms'] += span['duration'] / 1e3
+            row['self ms'] += span['self'] / 1e3
+            # Only the outermost spans : the memory of the nested ones is already in their parent
+            if span['depth'] == 0:
+                row['RSS MB'] += span['rss_delta'] / 2**20
+        rows = sorted(rows.values(), key = lambda row : -row['total ms'])
+        for row in rows:
+            for col in ['total ms', 'self ms', 'RSS MB']:
+                row[col] = round(row[col], 1)
+        return rows
+
+    def last_rerun(self):
+        thread = threading.get_ident()
+        with self.lock:
+            for rerun in reversed(self.reruns):
+                if rerun['thread'] == thread:
+                    return rerun
+        return None
+
+    def chrome_trace(self):
+        # Complete events ('X') of the spans, one row per session thread in the viewer
+        pid = os.getpid()
+        events = []
+        with self.lock:
+            reruns = list(self.reruns)
+        for rerun in reruns:
+            end = rerun['end'] if rerun['end'] is not None else self.now()
+            events.append({'name' : rerun['label'], 'cat' : 'rerun', 'ph' : 'X', 'pid' : pid,
+                'tid' : rerun['thread'], 'ts' : rerun['start'], 'dur' : end - rerun['start']})
+            for span in rerun['spans']:
+                args = {'self_ms' : round(span['self'] / 1e3, 3),
+                        'rss_delta_MB' : round(span['rss_delta'] / 2**20, 2)}
+                if 'error' in span:
+                    args['error'] = span['error']
+                events.append({'name' : span['name'], 'cat' : span['category'], 'ph' : 'X', 'pid' : pid,
+                    'tid' : rerun['thread'], 'ts' : span['start'], 'dur' : span['duration'], 'args' : args})
+        return json.dumps({'traceEvents' : events, 'displayTimeUnit' : 'ms'})
+
+    def write_trace(self, path):
+        with open(path, 'w') as f:
+            f.write(self.chrome_trace())
+        return path
+
+
+class InstrumentedOutputs:
+    # Stand-in of the streamlit module : the calls sending a chart or a table to the browser
+    # (serialization included) are spans, everything else is the module itself
+
+    outputs = ('pyplot', 'image', 'plotly_chart', 'pydeck_chart', 'dataframe', 'table')
+
+    def __init__(self, module, profiler):
+        self.module = module
+        self.profiler = profiler
+
+    def __getattr__(self, name):
+        attribute = getattr(self.module, name)
+        if name in self.outputs:
+            return self.profiler.traced('st.' + name, 'output')(attribute)
+        return attribute
+
+
+profiler = Profiler()
@@ -0,0 +1,130 @@
+# Registry of the datasets loaded by the server, instead of st.cache for the prepared frames.
+# st.cache hashes its arguments at each rerun (an uploaded file of hundreds of megabytes) and
+# hashes the returned frame to detect its mutations. Here a source is identified by its stat (a
+# path) or by the id given by streamlit to an upload : the lookup doesn't depend on the size of the
+# data. The content is hashed once, when the source is registered. The frames handed out are shared
+# by all the sessions and read-only : a change in place raises instead of being detected afterwards.
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from wildfires_data import source_fingerprint, load_prepared
+from wildfires_aggregates import materialize_cube, materialize_sketch, stream_aggregates
+
+
+# Number of datasets kept (sample file, uploads...), the least recently used ones are dropped
+registry_entries = int(os.environ.get('WILDFIRES_REGISTRY_ENTRIES', 4))
+
+# Handle of a dataset : data is None for the streaming ingest, which only keeps the cube and the
+# quantile sketches
+Dataset = namedtuple('Dataset', ['key', 'fingerprint', 'data', 'cube', 'sketch'])
+
+
+def freeze(data):
+    # The arrays of the frame become read-only (numbers, codes of the categories, dates, objects).
+    # They are only reached through the blocks of the frame, an internal of pandas : the arrays given
+    # by Series.values or to_numpy are views, their flags don't protect the frame, and a frame built
+    # again from read-only arrays is consolidated into new writable ones. Fails closed : with a
+    # pandas whose blocks can't be reached, or whose columns are still writable afterwards (checked
+    # with the public API), freeze raises instead of sharing a writable frame between the sessions
+    if data is None:
+        return data
+    # New frame over the same arrays : the columns already read from the old one (by the cube, the
+    # sketches...) are writable views that its cache of columns would hand out again
+    data = data.copy(deep = False)
+    blocks = getattr(getattr(data, '_mgr', None), 'blocks', None)
+    if blocks is None:
+        raise TypeError('The frames of pandas {} have no blocks, they are not frozen'.format(pd.__version__))
+    for block in blocks:
+        values = getattr(block, 'values', None)
+        arrays = [array for array in [values, getattr(values, '_ndarray', None), getattr(values, '_codes', None)]
+                  if isinstance(array, np.ndarray)]
+        if not arrays:
+            raise TypeError('Arrays of type {} are not frozen'.format(type(values).__name__))
+        for array in arrays:
+            array.flags.writeable = False
+    for i, col in enumerate(data.columns):
+        column = data.iloc[:, i]
+        # The codes of a category are always handed out read-only : they are checked by the loop above
+        if not isinstance(column.dtype, pd.CategoricalDtype) and np.asarray(column).flags.writeable:
+            raise TypeError('The column {} is still writable with pandas {}'.format(col, pd.__version__))
+    return data
+
+
+def source_key(source):
+    # Identity of a source without reading it : path with its size and modification time, or
+    # upload (streamlit gives a new id to each upload)
+    if isinstance(source, (str, os.PathLike)):
+        stat = os.stat(source)
+        return ('path', os.path.abspath(source), stat.st_size, stat.st_mtime_ns)
+    upload_id = getattr(source, 'file_id', None) or getattr(source, 'id', None) or id(source)
+    return ('upload', upload_id, getattr(source, 'name', ''), getattr(source, 'size', None))
+
+
+class DatasetRegistry:
+
+    def __init__(self, max_entries = registry_entries):
+        self.entries = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # Lock of each dataset being loaded
+        self.loading = {}
+
+    def lookup(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            return None
+
+    def get(self, source, streaming = False, progress = None):
+        key = source_key(source) + (streaming,)
+        dataset = self.lookup(key)
+        if dataset is not None:
+            return dataset
+        with self.lock:
+            load_lock = self.loading.setdefault(key, threading.Lock())
+        # Loaded under the lock of the dataset only : the sessions asking for the same dataset wait
+        # for one load, the other datasets are served meanwhile
+        with load_lock:
+            dataset = self.lookup(key)
+            if dataset is not None:
+                return dataset
+            try:
+                dataset = self.load(key, source, streaming, progress)
+                with self.lock:
+                    self.misses += 1
+                    self.entries[key] = dataset
+                    if len(self.entries) > self.max_entries:
+                        self.entries.popitem(last = False)
+            finally:
+                with self.lock:
+                    self.loading.pop(key, None)
+            return dataset
+
+    def load(self, key, source, streaming, progress):
+        fingerprint = source_fingerprint(source)
+        if streaming: # Only the aggregates are kept in memory
+            cube, sketch = stream_aggregates(source, progress = progress, sketches = True)
+            return Dataset(key, fingerprint, None, freeze(cube), freeze(sketch))
+        data = load_prepared(source, fingerprint = fingerprint)
+        cube = materialize_cube(source, fingerprint = fingerprint, data = data)
+        sketch = materialize_sketch(source, fingerprint = fingerprint, data = data)
+        return Dataset(key, fingerprint, freeze(data), freeze(cube), freeze(sketch))
+
+    def stats(self):
+        return {'hits' : self.hits, 'misses' : self.misses, 'entries' : len(self.entries)}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+datasets = DatasetRegistry()
@@ -0,0 +1,286 @@
+# Shared store of the prepared frame, for several server processes on one node.
+# The frame, its aggregate cube and its quantile sketches are published once as uncompressed Arrow
+# files in a shared directory (WILDFIRES_STORE_DIR, under /dev/shm to keep them in memory). Each
+# process maps the files and builds its frames over the mapped buffers, one block per column : the
+# numbers (NaN are kept as NaN, not as nulls which to_pandas would fill in a copy), the dates and the
+# codes of the categories are read-only pages shared by all the processes, only the columns of
+# strings (FPA_ID, CONT_DATE) are copied in each process.
+# The publications are serialized between the processes by a lock file (flock, released by the
+# system if its process dies) : on an empty store, the first process publishes and the other ones
+# map its version. A change of the csv (size or mtime, then its hash) is published as a new version,
+# then the file naming the current version is replaced atomically : the processes attach to the new
+# version at their next rerun, without a restart. Each process holds a shared lock on the versions
+# it maps, the older versions are only removed when no process maps them.
+#
+# Usage from the command line :
+#   python wildfires_store.py publish [source.csv]
+#   python wildfires_store.py status [source.csv]
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+from contextlib import contextmanager
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError: # Each process loads its own copy of the frame
+    pa = None
+try:
+    import fcntl
+except ImportError: # No lock between the processes (not posix) : no shared store
+    fcntl = None
+
+from wildfires_data import data_filename, cache_version, source_fingerprint, load_prepared, temporary_path
+from wildfires_aggregates import materialize_cube, materialize_sketch
+
+
+store_dir = os.environ.get('WILDFIRES_STORE_DIR')
+# Versions kept in the store even when no process maps them : the current one and the previous one
+store_versions = 2
+# Files of a version
+store_kinds = ['data', 'cube', 'sketch']
+
+
+def store_enabled():
+    return store_dir is not None and pa is not None and fcntl is not None
+
+
+def store_name(source):
+    # One dataset per source path, as the cache (see wildfires_data.cache_paths)
+    return hashlib.sha1(os.path.abspath(source).encode()).hexdigest()[:16]
+
+
+def current_path(name):
+    return os.path.join(store_dir, name + '.current.json')
+
+
+def read_current(name):
+    try:
+        with open(current_path(name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def arrow_table(data):
+    # Floats and dates keep their NaN and NaT : as nulls, to_pandas would fill them in a copy of the column
+    data = data.reset_index(drop = True)
+    table = pa.Table.from_pandas(data, preserve_index = False)
+    for i, col in enumerate(data.columns):
+        if data[col].dtype.kind in 'fM':
+            table = table.set_column(i, table.field(i).name, pa.array(data[col].values, from_pandas = False))
+    return table
+
+
+def write_arrow(data, path):
+    # One record batch : the columns are contiguous in the file, so they can be mapped without copy
+    temporary = temporary_path(path)
+    feather.write_feather(arrow_table(data), temporary, compression = 'uncompressed',
+                          chunksize = max(len(data), 1))
+    os.replace(temporary, path)
+
+
+def map_frame(path):
+    # Frame over the pages of the file : split_blocks keeps one block per column, so pandas doesn't
+    # copy the columns into 2d blocks. The arrays are read-only
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.to_pandas(split_blocks = True)
+
+
+def version_path(name, version, kind):
+    return os.path.join(store_dir, '{}.{}.{}.arrow'.format(name, version, kind))
+
+
+@contextmanager
+def store_lock(name, blocking = True):
+    # Lock of a dataset between the processes (and the threads, each call opens its own file).
+    # Without blocking, yields False when another process holds it
+    os.makedirs(store_dir, exist_ok = True)
+    with open(os.path.join(store_dir, name + '.lock'), 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def pin_version(name, version):
+    # Shared lock on the data file of a version, held while the process maps it (see prune).
+    # Returns the open file, None if the version was removed
+    try:
+        f = open(version_path(name, version, 'data'), 'rb')
+    except OSError:
+        return None
+    fcntl.flock(f, fcntl.LOCK_SH)
+    return f
+
+
+# ------------------------------------------
+# ---------------------------- Publication
+# ------------------------------------------
+def publish(source = data_filename, fingerprint = None):
+    # New version of the source, made current. Serialized with the other publications of the node
+    name = store_name(source)
+    with store_lock(name):
+        return publish_locked(source, name, fingerprint or source_fingerprint(source))
+
+
+def publish_locked(source, name, fingerprint):
+    version = '{}-{}'.format(time.time_ns(), fingerprint['sha1'][:12])
+    paths = {kind : version_path(name, version, kind) for kind in store_kinds}
+    data = load_prepared(source, fingerprint = fingerprint)
+    write_arrow(data, paths['data'])
+    write_arrow(materialize_cube(source, fingerprint, data), paths['cube'])
+    write_arrow(materialize_sketch(source, fingerprint, data), paths['sketch'])
+    current = dict({kind : os.path.basename(path) for kind, path in paths.items()},
+                   version = version, fingerprint = fingerprint, rows = len(data))
+    # The switch to the new version
+    temporary = temporary_path(current_path(name))
+    with open(temporary, 'w') as f:
+        json.dump(current, f)
+    os.replace(temporary, current_path(name))
+    prune_locked(name)
+    return current
+
+
+def versions(name):
+    # Versions in the store, the oldest first
+    found = set()
+    for file in os.listdir(store_dir) if os.path.isdir(store_dir) else []:
+        parts = file.split('.')
+        if parts[0] == name and len(parts) == 4 and parts[-1] == 'arrow':
+            found.add(parts[1])
+    return sorted(found, key = lambda version : int(version.split('-')[0]))
+
+
+def prune(name, keep = store_versions):
+    with store_lock(name):
+        return prune_locked(name, keep)
+
+
+def prune_locked(name, keep = store_versions):
+    # Removes the versions beyond the keep last ones, except the current one and the ones mapped by
+    # a process (shared lock on their data file, see pin_version)
+    current = read_current(name)
+    removed = 0
+    for version in versions(name)[:-keep]:
+        if current is not None and version == current['version']:
+            continue
+        data_path = version_path(name, version, 'data')
+        try:
+            f = open(data_path, 'rb')
+        except OSError: # Removed with its other files missing : they are removed below
+            f = None
+        try:
+            if f is not None:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError: # Mapped by a process
+                    continue
+            for kind in store_kinds:
+                try:
+                    os.remove(version_path(name, version, kind))
+                    removed += 1
+                except OSError:
+                    pass
+        finally:
+            if f is not None:
+                f.close()
+    return removed
+
+
+# ------------------------------------------
+# ---------------------------- Attachment of the processes
+# ------------------------------------------
+# Frames mapped by this process, by dataset : (version, data, cube, sketch, pinned file)
+attached = {}
+attach_lock = threading.Lock()
+# Last stat of each source found with the hash of the current version : (size, mtime), sha1
+checked = {}
+
+
+def is_fresh(source, name, current):
+    # The current version is the one of the source : same size and mtime, or same hash (the source
+    # is hashed once for a new stat)
+    if (current is None or any(kind not in current for kind in store_kinds)
+            or current['fingerprint'].get('version') != cache_version):
+        # Empty store, or a version published without the sketches or by an older version
+        return False
+    stat = os.stat(source)
+    known = current['fingerprint']
+    if (stat.st_size, stat.st_mtime_ns) == (known['size'], known['mtime']):
+        return True
+    if checked.get(name, (None, None)) == ((stat.st_size, stat.st_mtime_ns), known['sha1']):
+        return True
+    fresh = source_fingerprint(source)['sha1'] == known['sha1']
+    if fresh:
+        checked[name] = ((stat.st_size, stat.st_mtime_ns), known['sha1'])
+    return fresh
+
+
+def attach(source = data_filename):
+    # Frame, cube, sketches and token of the current version, mapped once by version : the cost of a
+    # rerun is the read of the small file naming the current version and the stat of the source.
+    # A missing or stale version is published by one process, outside the lock of the sessions
+    name = store_name(source)
+    for attempt in range(2):
+        current = read_current(name)
+        if not is_fresh(source, name, current):
+            entry = attached.get(name)
+            with store_lock(name, blocking = entry is None) as locked:
+                if not locked: # Published by another process : the mapped version is served meanwhile
+                    return entry[1:4] + (('store', name, entry[0]),)
+                current = read_current(name)
+                if not is_fresh(source, name, current):
+                    current = publish_locked(source, name, source_fingerprint(source))
+        with attach_lock:
+            entry = attached.get(name)
+            if entry is not None and entry[0] == current['version']:
+                return entry[1:4] + (('store', name, entry[0]),)
+            pinned = pin_version(name, current['version'])
+            try:
+                if pinned is None:
+                    raise FileNotFoundError(current['data'])
+                frames = tuple(map_frame(os.path.join(store_dir, current[kind])) for kind in store_kinds)
+            except (OSError, pa.ArrowInvalid):
+                if pinned is not None:
+                    pinned.close()
+                # Removed by a newer publication between the two reads : the new version is used
+                if attempt:
+                    raise
+                continue
+            if entry is not None: # The older version can be removed once no process maps it
+                entry[4].close()
+            attached[name] = (current['version'],) + frames + (pinned,)
+            return frames + (('store', name, current['version']),)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Shared store of the prepared wildfires data')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    parser_publish = subparsers.add_parser('publish', help = 'Publish a new version of the dataset')
+    parser_publish.add_argument('source', nargs = '?', default = data_filename)
+    parser_status = subparsers.add_parser('status', help = 'Current version and files of the dataset')
+    parser_status.add_argument('source', nargs = '?', default = data_filename)
+    args = parser.parse_args()
+    if not store_enabled():
+        parser.error('WILDFIRES_STORE_DIR must be set, pyarrow installed and the system posix')
+    if args.command == 'publish':
+        current = publish(args.source)
+        print('Published version {} of {} ({} rows) in {}'.format(current['version'], args.source,
+            current['rows'], store_dir))
+    else :
+        name = store_name(args.source)
+        print(json.dumps(read_current(name), indent = 1))
+        for version in versions(name):
+            size = sum(os.path.getsize(version_path(name, version, kind))
+                       for kind in store_kinds if os.path.exists(version_path(name, version, kind)))
+            print('{} {:.1f} MB'.format(version, size / 2**20))
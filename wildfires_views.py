@@ -0,0 +1,144 @@
+# Registry of the frames and charts of the dashboard, as a dependency graph.
+# Each node declares the nodes and the widget values it depends on. Nodes are evaluated
+# lazily and memoized : after a widget change, only the nodes depending on it are computed again,
+# the other ones are served from the memo (which is shared by all the sessions of the server).
+# The inputs (cube, rows of the dataset...) belong to the session : streamlit runs the script of
+# each session in its own thread, the inputs are set by thread at each rerun. The memo is keyed by
+# the tokens of the inputs, and bounded by the size of the values it keeps.
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from wildfires_data import Pinned
+from wildfires_profiling import profiler
+
+
+views_cache_mb = float(os.environ.get('WILDFIRES_VIEWS_CACHE_MB', 256))
+
+
+def frame_size(value, sample = 100):
+    # memory_usage(deep = True) needs writable arrays, and the frames of the registry are read-only
+    # (see wildfires_registry.freeze) : the objects of a column (strings...) are measured on a sample
+    usage = value.memory_usage()
+    size = int(usage.sum() if isinstance(usage, pd.Series) else usage)
+    if isinstance(value, pd.DataFrame):
+        columns = [value.iloc[:, i] for i in range(value.shape[1])] + [value.index]
+    else :
+        columns = [value] if isinstance(value, pd.Index) else [value, value.index]
+    for column in columns:
+        if column.dtype == object and len(column):
+            values = np.asarray(column)[:sample]
+            size += sum(sys.getsizeof(item) for item in values) * len(column) // len(values)
+    return size
+
+
+def value_size(value, sample = 100):
+    # Approximate size in bytes of a value of a node. The long lists are measured on a sample
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        return frame_size(value, sample)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(value_size(key) + value_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        if len(value) > sample:
+            measured = sum(value_size(item) for item in value[:sample])
+            return sys.getsizeof(value) + measured * len(value) // sample
+        return sys.getsizeof(value) + sum(value_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class ViewGraph:
+
+    def __init__(self, max_entries = 512, max_mb = views_cache_mb):
+        self.nodes = {}
+        self.local = threading.local()
+        self.memo = OrderedDict()
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 2**20)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @property
+    def inputs(self):
+        # Inputs of the session running in this thread
+        if not hasattr(self.local, 'inputs'):
+            self.local.inputs = {}
+        return self.local.inputs
+
+    def set_input(self, name, value, token = None):
+        # Source of the graph (aggregate cube, rows of the dataset...). The token identifies the
+        # value in the keys of the memo (fingerprint of the dataset...), the value itself without token
+        self.inputs[name] = (value, Pinned(value) if token is None else token)
+
+    def node(self, deps = (), widgets = ()):
+        # Decorator : the function is called with the values of deps, then the widgets as keywords
+        def register(function):
+            self.nodes[function.__name__] = (function, tuple(deps), tuple(widgets))
+            return function
+        return register
+
+    def key(self, name, context):
+        if name in self.inputs:
+            return ('input', name, self.inputs[name][1])
+        function, deps, widgets = self.nodes[name]
+        return ((name, tuple(context.get(widget) for widget in widgets)) +
+                tuple(self.key(dep, context) for dep in deps))
+
+    def get(self, name, **context):
+        # context holds the current values of the widgets, each node only reads the ones it declared
+        if name in self.inputs:
+            return self.inputs[name][0]
+        key = self.key(name, context)
+        with self.lock:
+            if key in self.memo:
+                self.memo.move_to_end(key)
+                self.hits += 1
+                return self.memo[key][0]
+            self.misses += 1
+        function, deps, widgets = self.nodes[name]
+        args = [self.get(dep, **context) for dep in deps]
+        with profiler.span(name, 'node'):
+            value = function(*args, **{widget : context[widget] for widget in widgets})
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        size = value_size(value)
+        with self.lock:
+            if key in self.memo:
+                self.size -= self.memo.pop(key)[1]
+            # A value above the budget is not kept
+            if size > self.max_bytes:
+                return
+            self.memo[key] = (value, size)
+            self.size += size
+            while len(self.memo) > self.max_entries or self.size > self.max_bytes:
+                self.size -= self.memo.popitem(last = False)[1][1]
+
+    def discard(self, name, context):
+        with self.lock:
+            entry = self.memo.pop(self.key(name, context), None)
+            if entry is not None:
+                self.size -= entry[1]
+
+    def stats(self):
+        return {'hits' : self.hits, 'misses' : self.misses, 'entries' : len(self.memo),
+                'MB' : round(self.size / 2**20, 1)}
+
+    def clear(self):
+        with self.lock:
+            self.memo.clear()
+            self.size = 0
+
+
+views = ViewGraph()